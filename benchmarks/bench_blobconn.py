@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Latency of control messages while BLOBs are streamed, with the BLOBs on
+the main client connection (enableBLOB Also) and on a second connection
+(IndiLoop.enableBlobConnection).
+
+An IndiServer runs two drivers: 'Mount' sends a number holding its send
+time at --rate, 'Camera' sends a --blob-mb BLOB every --blob-period
+seconds. The client measures the delay of the numbers.
+
+    python3 -m benchmarks.bench_blobconn --duration 10 --blob-mb 50
+"""
+
+import sys
+import time
+import logging
+import argparse
+import subprocess
+
+import numpy as np
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+MOUNT = b"""<INDIDriver>
+<defNumberVector device="Mount" name="TIME" state="Idle" perm="ro">
+    <defNumber name="T" format="%.6f" min="0" max="0" step="0">0</defNumber>
+</defNumberVector>
+</INDIDriver>
+"""
+
+CAMERA = b"""<INDIDriver>
+<defBLOBVector device="Camera" name="CCD1" state="Idle" perm="ro">
+    <defBLOB name="CCD1"/>
+</defBLOBVector>
+</INDIDriver>
+"""
+
+
+def run_driver(kind, rate, blob_mb, blob_period):
+    driver = IndiLoop(driver=True)
+    driver.handleEOF = lambda: sys.exit(0)
+    if kind == 'mount':
+        driver.defineProperties(MOUNT)
+        prop = driver.properties['Mount']['TIME']
+        period = 1.0 / rate
+    else:
+        driver.defineProperties(CAMERA)
+        prop = driver.properties['Camera']['CCD1']
+        prop['CCD1'].setValue(np.random.bytes(int(blob_mb * 1e6)))
+        prop['CCD1'].setAttr('format', '.raw')
+        # encoded once, the driver only measures the transport
+        blob_msg = prop.setMessage()
+        period = blob_period
+
+    nxt = time.time() + 1.0
+    while True:
+        driver.loop1(max(nxt - time.time(), 0))
+        if time.time() >= nxt:
+            if kind == 'mount':
+                prop['T'].setValue(time.time())
+                driver.sendDriver(prop.setMessage())
+            else:
+                driver.sendDriver(blob_msg)
+            nxt += period
+
+
+def run_server(args):
+    from indi_python.indi_server import IndiServer
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = IndiServer(port=args.port)
+    cmd = [sys.executable, '-m', 'benchmarks.bench_blobconn', '--rate', str(args.rate),
+           '--blob-mb', str(args.blob_mb), '--blob-period', str(args.blob_period), '--driver']
+    server.startDriver(cmd + ['mount'])
+    server.startDriver(cmd + ['camera'])
+    try:
+        server.loop()
+    finally:
+        server.close()
+
+
+class Client(IndiLoop):
+
+    def __init__(self, port, separate):
+        IndiLoop.__init__(self, client_addr='localhost', client_port=port)
+        self.latencies = []
+        self.blobs = 0
+        self.blob_bytes = 0
+        self.snoop_handlers.add('Mount', 'TIME', self.updated)
+        self.snoop_handlers.add('Camera', 'CCD1', self.blobReceived)
+        self.sendClient(indi.getProperties())
+        if separate:
+            self.enableBlobConnection(['Camera'])
+        else:
+            self.sendClient(indi.enableBLOB('Camera', mode='Also'))
+
+    def updated(self, msg, prop):
+        self.latencies.append(time.time() - prop['T'].native())
+
+    def blobReceived(self, msg, prop):
+        self.blobs += 1
+        self.blob_bytes += len(prop['CCD1'].native())
+
+
+def run(args, separate):
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_blobconn', '--serve', '--port', str(args.port),
+                               '--rate', str(args.rate), '--blob-mb', str(args.blob_mb), '--blob-period', str(args.blob_period)])
+    try:
+        time.sleep(1)
+        client = Client(args.port, separate)
+        start = time.time()
+        while time.time() - start < args.duration:
+            client.loop1(0.1)
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    lat = np.array(client.latencies) * 1e3
+    return {
+        'numbers': len(lat),
+        'blobs': client.blobs,
+        'blob_mb_per_s': client.blob_bytes / 1e6 / elapsed,
+        'latency_ms': { 'p50': float(np.percentile(lat, 50)), 'p99': float(np.percentile(lat, 99)),
+                        'max': float(lat.max()) } if len(lat) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=50, help='numbers per second')
+    parser.add_argument('--blob-mb', type=float, default=50)
+    parser.add_argument('--blob-period', type=float, default=2.0)
+    parser.add_argument('--port', type=int, default=17625)
+    parser.add_argument('--driver', choices=('mount', 'camera'))
+    parser.add_argument('--serve', action='store_true')
+    args = parser.parse_args()
+
+    if args.driver:
+        return run_driver(args.driver, args.rate, args.blob_mb, args.blob_period)
+    if args.serve:
+        return run_server(args)
+
+    print("numbers {:.0f}/s, BLOB {:.0f} MB every {:.1f} s, {:.0f} s".format(args.rate, args.blob_mb, args.blob_period, args.duration))
+    print("{:>12} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}".format("BLOBs on", "numbers", "BLOBs", "MB/s", "p50 ms", "p99 ms", "max ms"))
+    for name, separate in (('main', False), ('separate', True)):
+        r = run(args, separate)
+        lat = r['latency_ms'] or { 'p50': float('nan'), 'p99': float('nan'), 'max': float('nan') }
+        print("{:>12} {:>8} {:>6} {:>8.1f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+            name, r['numbers'], r['blobs'], r['blob_mb_per_s'], lat['p50'], lat['p99'], lat['max']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+BLOB decoding in the loop thread vs on the BlobPool.
+
+Two cameras send 16 bit FITS frames, half of them .fits.z. Inline, the
+loop thread decodes the base64, native() inflates the .z frames and a
+handler parses the FITS data; with the pool, workers do all three. Reported are the loop
+thread CPU time per frame and the wall time until all frames reached
+their handlers.
+
+    python3 -m benchmarks.bench_blobpool --frames 8 --width 3000 --height 2000
+"""
+
+import time
+import zlib
+import base64
+import argparse
+
+import numpy as np
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_blobpool import parse_fits
+
+
+def fits(a):
+    cards = ['SIMPLE  =                    T', 'BITPIX  =                   16', 'NAXIS   =                    2',
+             'NAXIS1  = {:20d}'.format(a.shape[1]), 'NAXIS2  = {:20d}'.format(a.shape[0]),
+             'BZERO   =                32768', 'BSCALE  =                    1', 'END']
+    header = ''.join(c.ljust(80) for c in cards).ljust(2880).encode()
+    data = (a.astype(np.int32) - 32768).astype('>i2').tobytes()
+    return header + data + b'\0' * (-len(data) % 2880)
+
+
+def stream(frames, width, height):
+    defs = ''.join('<defBLOBVector device="Cam{0}" name="CCD1"><defBLOB name="CCD1"/></defBLOBVector>'.format(c) for c in range(2))
+    chunks = [defs.encode()]
+    # noise in a narrow range compresses like a sky background
+    img = np.random.randint(1000, 1100, (height, width)).astype(np.uint16)
+    for i in range(frames):
+        f = fits(img)
+        fmt = '.fits'
+        if i % 4 >= 2:
+            f = zlib.compress(f, 1)
+            fmt = '.fits.z'
+        msg = ('<setBLOBVector device="Cam{}" name="CCD1"><oneBLOB name="CCD1" size="{}" format="{}">'.format(i % 2, len(fits(img)), fmt).encode()
+               + base64.encodebytes(f) + b'</oneBLOB></setBLOBVector>')
+        chunks.extend(msg[k:k + (1 << 20)] for k in range(0, len(msg), 1 << 20))
+    return chunks, img
+
+
+def run(chunks, pool, workers):
+    loop = IndiLoop()
+    images = []
+
+    def handler(msg, prop):
+        # inflated by native()
+        v = prop['CCD1'].native()
+        if not pool:
+            v = parse_fits(v)[1]
+        images.append(v)
+
+    loop.snoop_handlers.add('*', 'CCD1', handler)
+    if pool:
+        loop.enableBlobPool(workers, images=True)
+    parser = indi.INDIStreamParser(loop.blob_sink, loop.acceptMessage)
+
+    start = time.time()
+    cpu = time.thread_time()
+    for chunk in chunks:
+        loop.feedInput(None, parser, chunk)
+        if pool:
+            loop.deliverBlobs()
+    while loop.blob_waiting:
+        loop.loop1(1.0)
+    cpu = time.thread_time() - cpu
+    wall = time.time() - start
+    if pool:
+        loop.disableBlobPool()
+    return cpu, wall, images
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=8)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    args = parser.parse_args()
+
+    chunks, img = stream(args.frames, args.width, args.height)
+    print("{:>12} {:>18} {:>10}".format("mode", "loop cpu ms/frame", "wall s"))
+    for name, pool, workers in (('inline', False, 0), ('pool 2', True, 2), ('pool 4', True, 4)):
+        cpu, wall, images = run(chunks, pool, workers)
+        assert len(images) == args.frames and all((i == img).all() for i in images)
+        print("{:>12} {:>18.1f} {:>10.2f}".format(name, cpu * 1e3 / args.frames, wall))
+
+
+if __name__ == '__main__':
+    main()
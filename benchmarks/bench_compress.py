@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire vs CPU for compressed BLOBs.
+
+16 bit frames of 3000x2000: a dark (bias plus read noise), a sky frame
+(background noise plus stars) and a flat (smooth gradient). For each
+zlib level the base64 size of the compressed frame, compression CPU and
+wall time with BlobCompressor (chunked, on threads) and inflate time
+are reported.
+
+    python3 -m benchmarks.bench_compress
+"""
+
+import os
+import time
+import zlib
+import argparse
+
+import numpy as np
+
+from indi_python.indi_compress import BlobCompressor
+
+
+def frames(width, height):
+    rng = np.random.default_rng(1)
+    dark = rng.normal(1000, 8, (height, width))
+    sky = rng.normal(2500, 40, (height, width))
+    for x, y, f in zip(rng.integers(0, width, 300), rng.integers(0, height, 300), rng.uniform(1e3, 5e4, 300)):
+        sky[max(y - 3, 0):y + 4, max(x - 3, 0):x + 4] += f * np.exp(-((np.arange(-3, 4)[:, None]) ** 2 + np.arange(-3, 4) ** 2) / 3.0)[:min(y + 4, height) - max(y - 3, 0), :min(x + 4, width) - max(x - 3, 0)]
+    yy, xx = np.mgrid[0:height, 0:width]
+    flat = 30000 - ((xx - width / 2) ** 2 + (yy - height / 2) ** 2) / (width * height) * 8000 + rng.normal(0, 150, (height, width))
+    return { name: np.clip(a, 0, 65535).astype('>u2').tobytes() for name, a in (('dark', dark), ('sky', sky), ('flat', flat)) }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--chunk', type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:>6} {:>6} {:>10} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "frame", "level", "wire MB", "ratio", "serial ms", "chunked cpu", "chunked wall", "inflate ms"))
+    for name, data in frames(args.width, args.height).items():
+        raw_wire = (len(data) + 2) // 3 * 4
+        print("{:>6} {:>6} {:>10.2f} {:>8.2f}".format(name, 'none', raw_wire / 1e6, 1.0))
+        for level in (1, 3, 6, 9):
+            c = BlobCompressor(level=level, chunk=args.chunk)
+            t = time.perf_counter()
+            zlib.compress(data, level)
+            serial = time.perf_counter() - t
+            cpu = time.process_time()
+            t = time.perf_counter()
+            z = c.compress(data)
+            wall = time.perf_counter() - t
+            cpu = time.process_time() - cpu
+            c.close()
+            t = time.perf_counter()
+            assert zlib.decompress(z) == data
+            inflate = time.perf_counter() - t
+            wire = (len(z) + 2) // 3 * 4
+            print("{:>6} {:>6} {:>10.2f} {:>8.2f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+                name, level, wire / 1e6, raw_wire / wire, serial * 1e3, cpu * 1e3, wall * 1e3, inflate * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Snoop handler dispatch: HandlerRegistry vs a chain of if tests.
+
+n handlers are registered for distinct properties of 10 devices, plus
+one device wildcard; set messages for random properties are dispatched.
+The if chain compares device and name attributes for every handler, as
+MyDome.handleSnoop did.
+
+    python3 -m benchmarks.bench_dispatch
+"""
+
+import random
+import timeit
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import HandlerRegistry
+
+
+def vector(device, name):
+    return indi.INDIVector(etree.fromstring(
+        '<defNumberVector device="{}" name="{}"><defNumber name="v">0</defNumber></defNumberVector>'.format(device, name)))
+
+
+def bench(n, messages):
+    calls = [0]
+
+    def handler(msg, prop):
+        calls[0] += 1
+
+    keys = [('Dev{}'.format(i % 10), 'P{}'.format(i)) for i in range(n)]
+
+    registry = HandlerRegistry()
+    for device, name in keys:
+        registry.add(device, name, handler)
+    registry.add('Dev0', '*', handler)
+
+    def chain(msg, prop):
+        for device, name in keys:
+            if prop.getAttr("device") == device and prop.getAttr("name") == name:
+                handler(msg, prop)
+        if prop.getAttr("device") == 'Dev0':
+            handler(msg, prop)
+
+    def run_registry():
+        for msg, prop in messages:
+            registry.dispatch(prop.getAttr("device"), prop.getAttr("name"), msg, prop)
+
+    def run_chain():
+        for msg, prop in messages:
+            chain(msg, prop)
+
+    calls[0] = 0
+    run_registry()
+    c1 = calls[0]
+    calls[0] = 0
+    run_chain()
+    assert calls[0] == c1
+
+    t1 = min(timeit.repeat(run_registry, number=1, repeat=5)) / len(messages)
+    t2 = min(timeit.repeat(run_chain, number=1, repeat=5)) / len(messages)
+    return t1, t2
+
+
+def main():
+    print("{:>10} {:>14} {:>14}".format("handlers", "registry us", "if chain us"))
+    for n in (10, 100, 500, 1000):
+        props = [vector('Dev{}'.format(i % 10), 'P{}'.format(i)) for i in range(n)]
+        messages = []
+        for i in range(2000):
+            prop = random.choice(props)
+            msg = etree.fromstring(prop.setMessage())
+            messages.append((msg, prop))
+        t1, t2 = bench(n, messages)
+        print("{:>10} {:>14.2f} {:>14.2f}".format(n, t1 * 1e6, t2 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
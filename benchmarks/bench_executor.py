@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Loop stall caused by a slow handler: inline vs HandlerExecutor.
+
+One device has a handler sleeping 20 ms (like a FITS write or a blocking
+HTTP request), nine others have fast handlers. 1000 updates spread over
+the devices are fed through feedInput; reported is how long the loop
+thread was busy and the latency of the fast handlers.
+
+    python3 -m benchmarks.bench_executor
+"""
+
+import time
+
+import numpy as np
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+def run(executor=None):
+    loop = IndiLoop()
+    defs = ''.join('<defNumberVector device="Dev{}" name="N"><defNumber name="a">0</defNumber></defNumberVector>'.format(d) for d in range(10))
+    loop.feedInput(None, indi.INDIStreamParser(), defs.encode())
+    latency = []
+
+    def slow(msg, prop):
+        time.sleep(0.02)
+
+    def fast(msg, prop):
+        latency.append(time.time() - float(msg[0].text))
+
+    loop.snoop_handlers.add('Dev0', 'N', slow)
+    for d in range(1, 10):
+        loop.snoop_handlers.add('Dev{}'.format(d), 'N', fast)
+    if executor:
+        loop.enableExecutor(**executor)
+
+    start = time.time()
+    for i in range(100):
+        data = ''.join('<setNumberVector device="Dev{}" name="N"><oneNumber name="a">{!r}</oneNumber></setNumberVector>'.format(d, time.time())
+                       for d in range(10)).encode()
+        loop.feedInput(None, indi.INDIStreamParser(), data)
+        time.sleep(0.001)
+    busy = time.time() - start
+    if executor:
+        loop.executor.join()
+        stats = loop.executor.stats()
+        loop.disableExecutor()
+    else:
+        stats = {}
+    lat = np.array(latency) * 1e3
+    return busy, np.percentile(lat, 50), np.percentile(lat, 99), stats.get('dropped', 0) + stats.get('coalesced', 0)
+
+
+def main():
+    print("{:>28} {:>10} {:>14} {:>14} {:>8}".format("mode", "loop s", "fast p50 ms", "fast p99 ms", "dropped"))
+    for name, executor in (('inline', None),
+                           ('executor block q=1000', { 'max_queue': 1000 }),
+                           ('executor block q=10', { 'max_queue': 10 }),
+                           ('executor coalesce q=10', { 'max_queue': 10, 'policy': 'coalesce' })):
+        busy, p50, p99, dropped = run(executor)
+        print("{:>28} {:>10.2f} {:>14.2f} {:>14.2f} {:>8}".format(name, busy, p50, p99, dropped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+CPU per received byte with a subscription filter and lazy elements.
+
+A stream from 10 devices with 20 number vectors each and a CCD sending
+1 MB BLOBs is fed to IndiLoop; the loop is interested in 15 properties
+and reads them after each chunk. Compares processing everything, the
+subscription filter, and the filter with lazy element decoding.
+
+    python3 -m benchmarks.bench_filter
+"""
+
+import time
+import base64
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+DEVICES = ['Dev{}'.format(i) for i in range(10)]
+NVECTORS = 20
+NELEMENTS = 10
+
+
+def numvec(tag, device, i, v):
+    one = 'defNumber' if tag.startswith('def') else 'oneNumber'
+    return '<{} device="{}" name="N{}" state="Ok" perm="ro">{}</{}>'.format(
+        tag, device, i,
+        ''.join('<{} name="e{}" format="%g">{}</{}>'.format(one, j, v + j, one) for j in range(NELEMENTS)), tag)
+
+
+def blobvec(tag, data):
+    one = 'defBLOB' if tag.startswith('def') else 'oneBLOB'
+    return '<{} device="CCD" name="CCD1" state="Ok" perm="ro"><{} name="CCD1" size="{}" format=".fits">{}</{}></{}>'.format(
+        tag, one, len(data), base64.b64encode(data).decode(), one, tag)
+
+
+def stream():
+    defs = ''.join(numvec('defNumberVector', d, i, 0) for d in DEVICES for i in range(NVECTORS))
+    defs += blobvec('defBLOBVector', b'')
+    sets = []
+    for r in range(20):
+        sets.append(''.join(numvec('setNumberVector', d, i, r) for d in DEVICES for i in range(NVECTORS)))
+        if r % 4 == 0:
+            sets.append(blobvec('setBLOBVector', bytes(range(256)) * 4096))
+    return defs.encode(), [s.encode() for s in sets]
+
+
+def run(defs, sets, subscribe, lazy):
+    loop = IndiLoop()
+    parser = indi.INDIStreamParser(accept=loop.acceptMessage)
+    if subscribe:
+        for i in range(15):
+            loop.subscribe('Dev0', 'N{}'.format(i))
+    loop.lazy_elements = lazy
+
+    for msg in parser.feed(defs):
+        loop.processMessage(msg)
+
+    t0 = time.process_time()
+    for data in sets:
+        for msg in parser.feed(data):
+            loop.processMessage(msg, None, parser.blobs.pop(msg, None))
+        for i in range(15):
+            loop.properties['Dev0']['N{}'.format(i)]['e0'].native()
+    t = time.process_time() - t0
+    return t, sum(len(d) for d in sets)
+
+
+def main():
+    defs, sets = stream()
+    print("{:>20} {:>12} {:>12}".format("", "ms", "us/KB"))
+    for label, subscribe, lazy in (("everything", False, False),
+                                   ("filter", True, False),
+                                   ("filter + lazy", True, True),
+                                   ("lazy only", False, True)):
+        t, n = run(defs, sets, subscribe, lazy)
+        print("{:>20} {:>12.1f} {:>12.2f}".format(label, t * 1e3, t * 1e6 / (n / 1024)))
+
+
+if __name__ == '__main__':
+    main()
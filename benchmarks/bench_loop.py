@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+IndiLoop client throughput against the synthetic server.
+
+Each scenario runs in a fresh process: benchmarks.fake_server is
+started, an IndiLoop connects to it and processes everything until the
+server closes the connection. Reported per scenario:
+
+    msgs/s, MB/s       updates and bytes received per wall second
+    p50/p90/p99/max    latency from the send timestamp to the handler, ms
+    cpu ms/MB          process CPU time per MB received
+    rss MB             peak resident set size of the client process
+
+    python3 -m benchmarks.bench_loop --duration 5 --output before.json
+    python3 -m benchmarks.bench_loop --duration 5 --compare before.json
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import resource
+import subprocess
+
+import numpy as np
+
+from indi_python.indi_loop import IndiLoop
+from benchmarks.fake_server import SCENARIOS
+
+
+class ByteCounter(object):
+    """Recorder counting the received bytes."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def record(self, direction, data):
+        if direction == 0:
+            self.bytes += len(data)
+
+
+class BenchClient(IndiLoop):
+
+    def __init__(self, port):
+        IndiLoop.__init__(self, client_addr='localhost', client_port=port)
+        self.done = False
+        self.latencies = []
+        self.recorder = ByteCounter()
+        self.snoop_handlers.add('*', '*', self.updated)
+        self.sendClient(b"<getProperties version='1.7'/>")
+        self.sendClient(b"<enableBLOB>Also</enableBLOB>")
+
+    def updated(self, msg, prop):
+        ts = msg.get('timestamp')
+        if ts:
+            sent = datetime.datetime.fromisoformat(ts).replace(tzinfo=datetime.timezone.utc).timestamp()
+            self.latencies.append(time.time() - sent)
+
+    def handleClientDisconnect(self):
+        self.done = True
+
+
+def run(scenario, duration, rate):
+    cmd = [sys.executable, '-m', 'benchmarks.fake_server', '--scenario', scenario, '--duration', str(duration)]
+    if rate:
+        cmd += ['--rate', str(rate)]
+    server = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline())
+        client = BenchClient(port)
+        start = time.time()
+        cpu = time.process_time()
+        while not client.done:
+            client.loop1(1.0)
+        wall = time.time() - start
+        cpu = time.process_time() - cpu
+        sent = int(server.stdout.readline())
+    finally:
+        server.wait()
+
+    lat = np.array(client.latencies) * 1e3
+    mb = client.recorder.bytes / 1e6
+    return {
+        'sent': sent,
+        'received': len(lat),
+        'msgs_per_s': len(lat) / wall,
+        'mb_per_s': mb / wall,
+        'latency_ms': { 'p50': float(np.percentile(lat, 50)), 'p90': float(np.percentile(lat, 90)),
+                        'p99': float(np.percentile(lat, 99)), 'max': float(lat.max()) } if len(lat) else None,
+        'cpu_ms_per_mb': cpu * 1e3 / mb if mb else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    print("{:>10} {:>9} {:>10} {:>8} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+        "scenario", "received", "msgs/s", "MB/s", "p50 ms", "p99 ms", "max ms", "cpu ms/MB", "rss MB"))
+    for name, r in results.items():
+        lat = r['latency_ms'] or { 'p50': float('nan'), 'p99': float('nan'), 'max': float('nan') }
+        print("{:>10} {:>9} {:>10.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.1f} {:>8.1f}".format(
+            name, r['received'], r['msgs_per_s'], r['mb_per_s'], lat['p50'], lat['p99'], lat['max'],
+            r['cpu_ms_per_mb'] or float('nan'), r['peak_rss_mb']))
+        b = (baseline or {}).get(name)
+        if b and b['cpu_ms_per_mb'] and r['cpu_ms_per_mb']:
+            print("{:>10} {:>9} {:>10} {:>8} {:>8} {:>8} {:>8} {:>9.0f}% {:>7.0f}%".format(
+                'vs base', '', '', '', '', '', '',
+                (r['cpu_ms_per_mb'] / b['cpu_ms_per_mb'] - 1) * 100, (r['peak_rss_mb'] / b['peak_rss_mb'] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='default all')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--rate', type=int, default=None)
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # one scenario per process for a meaningful peak RSS
+        print(json.dumps(run(args.scenario[0], args.duration, args.rate)))
+        return
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        cmd = [sys.executable, '-m', 'benchmarks.bench_loop', '--child', '--scenario', name, '--duration', str(args.duration)]
+        if args.rate:
+            cmd += ['--rate', str(args.rate)]
+        results[name] = json.loads(subprocess.check_output(cmd, text=True).splitlines()[-1])
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({ 'commit': git_commit(), 'time': time.time(), 'python': platform.python_version(),
+                        'duration': args.duration, 'rate': args.rate, 'results': results }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
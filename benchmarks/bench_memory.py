@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Memory used by the property model.
+
+Defines a set of Number, Switch and Text vectors similar to a full
+observatory and prints the allocated bytes per element, for
+INDIVector and for a baseline with the layout indi_base used before
+__slots__: a plain object per vector and element holding a copy of the
+message spec and a dict of attributes.
+
+    python3 -m benchmarks.bench_memory [n_vectors]
+"""
+
+import sys
+import gc
+import tracemalloc
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+def make_defs(n_vectors):
+    defs = []
+    for i in range(n_vectors):
+        if i % 3 == 0:
+            children = ''.join('<defNumber name="N{}" label="Number {}" format="%10.6m" min="0" max="360" step="0">{}</defNumber>'.format(j, j, j * 1.5) for j in range(6))
+            defs.append('<defNumberVector device="Device {}" name="NUMBERS_{}" label="Numbers" group="Main Control" state="Idle" perm="rw" timeout="60">{}</defNumberVector>'.format(i % 10, i, children))
+        elif i % 3 == 1:
+            children = ''.join('<defSwitch name="S{}" label="Switch {}">{}</defSwitch>'.format(j, j, 'On' if j == 0 else 'Off') for j in range(4))
+            defs.append('<defSwitchVector device="Device {}" name="SWITCHES_{}" label="Switches" group="Options" state="Idle" perm="rw" rule="OneOfMany" timeout="60">{}</defSwitchVector>'.format(i % 10, i, children))
+        else:
+            children = ''.join('<defText name="T{}" label="Text {}">value {}</defText>'.format(j, j, j) for j in range(2))
+            defs.append('<defTextVector device="Device {}" name="TEXT_{}" label="Text" group="Info" state="Idle" perm="ro" timeout="60">{}</defTextVector>'.format(i % 10, i, children))
+    return [etree.fromstring(d) for d in defs]
+
+
+class DictElement(object):
+    """Baseline element: spec copied into the instance __dict__."""
+
+    def __init__(self, t):
+        self.__dict__.update(indi.indi_messages[t.tag])
+        self.definemsg = t.tag
+        self.attr = dict(t.attrib)
+        self.value = (t.text or '').strip()
+        self.native_value = self.ptype(self.value)
+
+
+class DictVector(object):
+
+    def __init__(self, t):
+        self.__dict__.update(indi.indi_messages[t.tag])
+        self.definemsg = t.tag
+        self.attr = dict(t.attrib)
+        self.elements = []
+        self.elements_dict = {}
+        self.update_cnt = 0
+        for child in t:
+            e = DictElement(child)
+            self.elements.append(e)
+            self.elements_dict[e.attr['name']] = e
+
+
+def measure(cls, trees):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    props = [cls(t) for t in trees]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del props
+    return after - before
+
+
+def main():
+    n_vectors = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    trees = make_defs(n_vectors)
+    n_elements = sum(len(t) for t in trees)
+
+    print("vectors: {} elements: {}".format(len(trees), n_elements))
+    print("{:<12} {:>12} {:>18}".format("", "total bytes", "bytes per element"))
+    for name, cls in (('INDIVector', indi.INDIVector), ('baseline', DictVector)):
+        total = measure(cls, trees)
+        # per element including the vectors
+        print("{:<12} {:>12} {:>18.1f}".format(name, total, total / n_elements))
+
+
+if __name__ == '__main__':
+    main()
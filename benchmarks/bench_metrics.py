@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+/metrics scrape cost: MetricsExporter vs walking all properties.
+
+10 devices with n number and switch vectors each; between two scrapes
+a few properties are updated. The full walk is the previous
+MyDome.print_state.
+
+    python3 -m benchmarks.bench_metrics
+"""
+
+import re
+import timeit
+
+from lxml import etree
+
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_metrics import MetricsExporter
+
+
+def print_state(loop):
+    ret = ''
+    for device in loop.properties:
+        for prop in loop.properties[device]:
+            for element in loop.properties[device][prop].getElements():
+                out_prop = "{}_{}_{}".format(device, prop, element.getAttr("name"))
+                change_ch = r'[ -]'
+                drop_ch = r'[^A-Za-z0-9_]'
+                value = element.getValue()
+                out_prop = re.sub(change_ch, '_', out_prop)
+                out_prop = re.sub(drop_ch, '', out_prop)
+                if value == 'On':
+                    value = 1
+                elif value == 'Off':
+                    value = 0
+                try:
+                    value = float(value)
+                except:
+                    value = re.sub(change_ch, '_', value)
+                    value = re.sub(drop_ch, '', value)
+                    out_prop += '{' + 'value="{}"'.format(value) + '}'
+                    value = 1
+                ret += "{} {}\n".format(out_prop, value)
+    return ret
+
+
+def setup(n):
+    loop = IndiLoop()
+    for d in range(10):
+        for i in range(n):
+            loop.processMessage(etree.fromstring(
+                '<defNumberVector device="Dev {}" name="N{}" state="Ok"><defNumber name="a">1</defNumber><defNumber name="b">2</defNumber><defNumber name="c">3</defNumber></defNumberVector>'.format(d, i)))
+            loop.processMessage(etree.fromstring(
+                '<defSwitchVector device="Dev {}" name="S{}" state="Ok"><defSwitch name="ON">On</defSwitch><defSwitch name="OFF">Off</defSwitch></defSwitchVector>'.format(d, i)))
+    return loop
+
+
+def main():
+    updates = [etree.fromstring('<setNumberVector device="Dev {}" name="N0" state="Busy"><oneNumber name="a">{}</oneNumber></setNumberVector>'.format(d, d))
+               for d in range(10)]
+    print("{:>10} {:>14} {:>14} {:>16}".format("elements", "full walk ms", "exporter ms", "exporter idle ms"))
+    for n in (10, 100, 500):
+        loop = setup(n)
+        exporter = MetricsExporter(loop)
+        exporter.render()
+
+        def scrape():
+            for msg in updates:
+                loop.processMessage(msg)
+            exporter.render()
+
+        def idle():
+            exporter.render()
+
+        t1 = min(timeit.repeat(lambda: print_state(loop), number=1, repeat=3))
+        t2 = min(timeit.repeat(scrape, number=10, repeat=3)) / 10
+        t3 = min(timeit.repeat(idle, number=100, repeat=3)) / 100
+        print("{:>10} {:>14.2f} {:>14.3f} {:>16.4f}".format(n * 50, t1 * 1e3, t2 * 1e3, t3 * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Serialization of set/new/def messages: MessageTemplate vs the lxml tree path.
+
+Checks that both produce identical bytes, then times them.
+
+    python3 -m benchmarks.bench_serialize
+"""
+
+import timeit
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+VECTORS = [
+    '<defNumberVector device="EQMod Mount" name="EQUATORIAL_EOD_COORD" label="Eq. Coordinates" group="Main Control" state="Ok" perm="rw" timeout="60">'
+    '<defNumber name="RA" label="RA (hh:mm:ss)" format="%010.6m" min="0" max="24" step="0">5.123456</defNumber>'
+    '<defNumber name="DEC" label="DEC (dd:mm:ss)" format="%010.6m" min="-90" max="90" step="0">-12:30:00</defNumber>'
+    '</defNumberVector>',
+    '<defSwitchVector device="CCD" name="FILTER" label="Filter &amp; &lt;wheel&gt; °" group="Main Control" state="Idle" perm="rw" rule="OneOfMany" timeout="0">'
+    + ''.join('<defSwitch name="F{}" label="Filter {}">{}</defSwitch>'.format(i, i, 'On' if i == 0 else 'Off') for i in range(12)) +
+    '</defSwitchVector>',
+    '<defTextVector device="Sensors" name="INFO" label="Info" group="Info" state="Idle" perm="ro">'
+    '<defText name="T1" label="Text">a &amp; b &lt; c "quoted"é\r</defText><defText name="T2" label="Empty"></defText>'
+    '</defTextVector>',
+    '<defBLOBVector device="CCD" name="CCD1" label="Image" group="Image" state="Idle" perm="ro"><defBLOB name="CCD1" label="Image"/></defBLOBVector>',
+]
+
+
+def lxml_set(v, message=None):
+    return etree.tostring(v.setMessageTree(message))
+
+def lxml_def(v, message=None):
+    return etree.tostring(v.defineMessageTree(message))
+
+def lxml_new(v, changes, message=None):
+    return etree.tostring(v.newMessageTree(changes, message))
+
+
+def check(vectors):
+    for v in vectors:
+        for message in (None, 'msg & <"x">\n'):
+            assert v.setMessage(message) == lxml_set(v, message), (v.setMessage(message), lxml_set(v, message))
+            assert v.defineMessage(message) == lxml_def(v, message)
+        name = v.elements[-1].getAttr('name')
+        value = 'On' if v.itype == 'Switch' else '7 & <8>'
+        assert v.newMessage({name: value}) == lxml_new(v, {name: value})
+        assert v.newMessage({}, 'm') == lxml_new(v, {}, 'm')
+    print("output identical")
+
+
+def main():
+    vectors = [indi.INDIVector(etree.fromstring(x)) for x in VECTORS]
+    vectors[3]['CCD1'].setValue(b'\0' * 1000)
+    vectors[3]['CCD1'].setAttr('format', '.fits')
+    check(vectors)
+
+    n = 20000
+    for v in vectors[:3]:
+        name = v.getAttr('name')
+        for label, f1, f2 in (
+                ('set', lambda: v.setMessage(), lambda: lxml_set(v)),
+                ('def', lambda: v.defineMessage(), lambda: lxml_def(v))):
+            t1 = min(timeit.repeat(f1, number=n, repeat=3)) / n
+            t2 = min(timeit.repeat(f2, number=n, repeat=3)) / n
+            print("{:<22} {}  template {:6.2f} us  lxml {:6.2f} us  {:4.1f}x".format(name, label, t1 * 1e6, t2 * 1e6, t2 / t1))
+
+
+if __name__ == '__main__':
+    main()
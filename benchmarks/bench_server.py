@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Load test of IndiServer with dozens of clients.
+
+Starts an IndiServer process with one driver process that sends a
+timestamp number vector at a fixed rate and every 10th time a BLOB.
+The clients subscribe with getProperties, some of them enable BLOBs.
+Reports delivered messages, end-to-end latency and whether each client
+got what its BLOB policy allows.
+
+    python3 -m benchmarks.bench_server --clients 50 --rate 200 --duration 5
+"""
+
+import sys
+import time
+import socket
+import argparse
+import logging
+import selectors
+import subprocess
+
+import indi_python.indi_base as indi
+
+
+DEFS = '''<INDIDriver>
+<defNumberVector device="Load" name="TIME" state="Idle" perm="ro"><defNumber name="T" format="%.6f">0</defNumber></defNumberVector>
+<defBLOBVector device="Load" name="IMAGE" state="Idle" perm="ro"><defBLOB name="IMAGE"/></defBLOBVector>
+</INDIDriver>'''
+
+
+def run_driver(rate):
+    from indi_python.indi_loop import IndiLoop
+
+    driver = IndiLoop(driver=True)
+    driver.defineProperties(DEFS)
+    driver.handleEOF = lambda: sys.exit(0)
+    t = driver.properties['Load']['TIME']
+    image = driver.properties['Load']['IMAGE']
+    image['IMAGE'].setValue(b'\0' * 65536)
+    image['IMAGE'].setAttr('format', '.raw')
+
+    period = 1.0 / rate
+    nxt = time.time()
+    n = 0
+    while True:
+        driver.loop1(max(nxt - time.time(), 0))
+        if time.time() >= nxt:
+            t['T'].setValue(time.time())
+            driver.sendDriver(t.setMessage())
+            n += 1
+            if n % 10 == 0:
+                driver.sendDriver(image.setMessage())
+            nxt += period
+
+
+def run_server(port, rate):
+    from indi_python.indi_server import IndiServer
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = IndiServer(port=port)
+    server.startDriver([sys.executable, '-m', 'benchmarks.bench_server', '--driver', '--rate', str(rate)])
+    try:
+        server.loop()
+    finally:
+        server.close()
+
+
+class Client(object):
+
+    def __init__(self, port, blobs):
+        self.sock = socket.create_connection(('localhost', port))
+        self.sock.setblocking(False)
+        self.parser = indi.INDIStreamParser()
+        self.blobs = blobs
+        self.numbers = 0
+        self.blob_msgs = 0
+        self.latency = []
+        self.sock.sendall(indi.getProperties())
+        if blobs:
+            self.sock.sendall(indi.enableBLOB('Load', mode='Also'))
+
+    def read(self):
+        d = self.sock.recv(1000000)
+        now = time.time()
+        for msg in self.parser.feed(d):
+            if msg.tag == 'setNumberVector':
+                self.numbers += 1
+                self.latency.append(now - float(msg[0].text))
+            elif msg.tag == 'setBLOBVector':
+                self.blob_msgs += 1
+        self.parser.blobs.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--blob-clients', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--port', type=int, default=17624)
+    parser.add_argument('--driver', action='store_true')
+    parser.add_argument('--serve', action='store_true')
+    args = parser.parse_args()
+
+    if args.driver:
+        return run_driver(args.rate)
+    if args.serve:
+        return run_server(args.port, args.rate)
+
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_server', '--serve', '--port', str(args.port), '--rate', str(args.rate)])
+    try:
+        time.sleep(1)
+        clients = [Client(args.port, i < args.blob_clients) for i in range(args.clients)]
+        sel = selectors.DefaultSelector()
+        for c in clients:
+            sel.register(c.sock, selectors.EVENT_READ, c)
+
+        t0 = time.time()
+        while time.time() - t0 < args.duration:
+            for key, mask in sel.select(0.1):
+                key.data.read()
+        elapsed = time.time() - t0
+    finally:
+        server.terminate()
+        server.wait()
+
+    latency = sorted(l for c in clients for l in c.latency)
+    numbers = [c.numbers for c in clients]
+    total = sum(numbers) + sum(c.blob_msgs for c in clients)
+    print("clients {}, driver rate {:.0f}/s, {:.1f} s".format(args.clients, args.rate, elapsed))
+    print("delivered {} messages, {:.0f} msg/s".format(total, total / elapsed))
+    print("numbers per client min/max {} / {}".format(min(numbers), max(numbers)))
+    if latency:
+        print("latency median/p99/max ms {:.2f} / {:.2f} / {:.2f}".format(
+            latency[len(latency) // 2] * 1e3, latency[len(latency) * 99 // 100] * 1e3, latency[-1] * 1e3))
+    blob_ok = all((c.blob_msgs > 0) == c.blobs for c in clients)
+    print("BLOBs only to enabled clients: {}".format('yes' if blob_ok else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
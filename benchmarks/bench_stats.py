@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Cost of the hot path statistics per message.
+
+Number updates for 100 vectors are fed through feedInput with a snoop
+handler registered, with statistics disabled and enabled.
+
+    python3 -m benchmarks.bench_stats
+"""
+
+import timeit
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+def setup():
+    loop = IndiLoop()
+    defs = ''.join('<defNumberVector device="Dev" name="N{}" state="Ok"><defNumber name="a">1</defNumber><defNumber name="b">2</defNumber></defNumberVector>'.format(i)
+                   for i in range(100))
+    loop.feedInput(None, indi.INDIStreamParser(), defs.encode())
+    loop.snoop_handlers.add('Dev', '*', lambda msg, prop: None)
+    data = ''.join('<setNumberVector device="Dev" name="N{}" state="Ok"><oneNumber name="a">{}</oneNumber></setNumberVector>'.format(i % 100, i)
+                   for i in range(10000)).encode()
+    return loop, data
+
+
+def main():
+    loop, data = setup()
+    n = 10000
+
+    def run():
+        loop.feedInput(None, indi.INDIStreamParser(), data)
+
+    t_off = min(timeit.repeat(run, number=1, repeat=5)) / n
+    stats = loop.enableStats()
+    t_on = min(timeit.repeat(run, number=1, repeat=5)) / n
+    loop.disableStats()
+    t_off2 = min(timeit.repeat(run, number=1, repeat=5)) / n
+
+    print("{:>12} {:>12} {:>12}".format("disabled us", "enabled us", "overhead us"))
+    print("{:>12.2f} {:>12.2f} {:>12.2f}".format(min(t_off, t_off2) * 1e6, t_on * 1e6, (t_on - min(t_off, t_off2)) * 1e6))
+    print()
+    for family in ('message_seconds', 'vector_seconds', 'handler_seconds', 'parse_seconds'):
+        for label, s in stats.snapshot()[family].items():
+            print("{:>16} {:>30} {:>8} p50 {:>8.1f} us p99 {:>8.1f} us".format(family, label, s['count'], s['p50'] * 1e6, s['p99'] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
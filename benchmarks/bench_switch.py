@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+newSwitchVector generation: rule resolution on a state snapshot vs the
+previous approach of building a temporary vector from the define tree.
+
+Checks that both give the same states for random changes, then times
+newMessage() on switch vectors of different sizes.
+
+    python3 -m benchmarks.bench_switch
+"""
+
+import random
+import timeit
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+def make_vector(n, rule):
+    children = ''.join('<defSwitch name="S{}" label="Switch {}">{}</defSwitch>'.format(i, i, 'On' if i == 0 else 'Off') for i in range(n))
+    return indi.INDIVector(etree.fromstring(
+        '<defSwitchVector device="Dev" name="MODE" label="Mode" group="Main" state="Idle" perm="rw" rule="{}">{}</defSwitchVector>'.format(rule, children)))
+
+
+def old_enforce_rule(v, name, value):
+    """INDIVector.enforceRule before resolveSwitches."""
+    v.elements_dict[name].setValue(value)
+    rule = v.getAttr('rule')
+    if rule != 'OneOfMany' and rule != 'AtMostOne':
+        return
+    value = v.elements_dict[name].getValue()
+    if rule == 'AtMostOne' or (value == 'On' and rule == 'OneOfMany'):
+        haveOn = (value == 'On')
+        for e in v.elements:
+            if e.getAttr("name") == name:
+                continue
+            if haveOn:
+                e.setValue('Off')
+            elif e.getValue() == 'On':
+                haveOn = True
+    elif value == 'Off' and rule == 'OneOfMany':
+        haveOn = False
+        for e in v.elements:
+            if e.getValue() == 'On':
+                haveOn = True
+                name = e.getAttr("name")
+                break
+        for e in v.elements:
+            if e.getAttr("name") == name:
+                continue
+            if haveOn:
+                e.setValue('Off')
+            else:
+                e.setValue('On')
+                haveOn = True
+
+
+def old_new_message(v, changes):
+    """The tree based implementation this replaces."""
+    tree = etree.Element(v.newmsg, attrib={ 'device': v.getAttr('device'), 'name': v.getAttr('name'), 'timestamp': indi.indi_timestamp() })
+    tmpVector = indi.INDIVector(v.defineMessageTree())
+    for key, val in changes.items():
+        old_enforce_rule(tmpVector, key, val)
+    for e in tmpVector.elements:
+        tree.append(e.setMessageTree())
+    return etree.tostring(tree)
+
+
+def check():
+    rnd = random.Random(1)
+    for rule in ('OneOfMany', 'AtMostOne', 'AnyOfMany'):
+        for n in (1, 2, 5, 12):
+            v = make_vector(n, rule)
+            for k in range(200):
+                for e in v.elements:
+                    e.setValue(rnd.choice(('On', 'Off')))
+                changes = { 'S{}'.format(rnd.randrange(n)): rnd.choice(('On', 'Off', True, False)) for c in range(rnd.randint(0, 3)) }
+                assert v.newMessage(changes) == old_new_message(v, changes), (rule, n, changes)
+    print("results identical")
+
+
+def main():
+    check()
+    n_calls = 2000
+    for n in (8, 50, 200):
+        v = make_vector(n, 'OneOfMany')
+        changes = { 'S{}'.format(n // 2): 'On' }
+        t1 = min(timeit.repeat(lambda: v.resolveSwitches(changes), number=n_calls, repeat=3)) / n_calls
+        t2 = min(timeit.repeat(lambda: v.newMessage(changes), number=n_calls, repeat=3)) / n_calls
+        t3 = min(timeit.repeat(lambda: old_new_message(v, changes), number=n_calls, repeat=3)) / n_calls
+        print("{:4} switches: resolveSwitches {:7.1f} us  newMessage {:7.1f} us  old newMessage {:8.1f} us  {:4.1f}x".format(
+            n, t1 * 1e6, t2 * 1e6, t3 * 1e6, t3 / t2))
+
+
+if __name__ == '__main__':
+    main()
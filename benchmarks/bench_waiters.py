@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Wake latency of a waiting thread vs number of other waiting threads.
+
+One thread waits for an update of the target property while n other
+threads wait for unrelated properties. The loop thread updates the
+target and the time until the waiter runs is measured, together with
+the number of times the other threads were woken up by the updates
+(they wait without timeout, so every wakeup is a notification).
+Compares the per-property waiters of IndiLoop with a single
+Condition.notify_all as used before.
+
+    python3 -m benchmarks.bench_waiters
+"""
+
+import time
+import threading
+
+from lxml import etree
+
+from indi_python.indi_loop import IndiLoop
+
+
+def defxml(n):
+    return '<INDIDriver>' + ''.join(
+        '<defNumberVector device="Dev" name="P{}" state="Idle" perm="rw"><defNumber name="v">0</defNumber></defNumberVector>'.format(i)
+        for i in range(n + 1)) + '</INDIDriver>'
+
+
+def setmsg(i, v):
+    return etree.fromstring('<setNumberVector device="Dev" name="P{}" state="Ok"><oneNumber name="v">{}</oneNumber></setNumberVector>'.format(i, v))
+
+
+def bench_waiters(n_other, rounds):
+    loop = IndiLoop()
+    loop.defineProperties(defxml(n_other))
+    stop = threading.Event()
+    wakeups = [0]
+
+    def other(i):
+        def predicate(prop):
+            # evaluated by the loop thread, True wakes this thread
+            return stop.is_set()
+        loop.waitFor("Dev", "P{}".format(i), predicate)
+        if not stop.is_set():
+            wakeups[0] += 1
+
+    threads = [threading.Thread(target=other, args=(i,), daemon=True) for i in range(1, n_other + 1)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    wakeups[0] = 0
+
+    lat = []
+    for r in range(rounds):
+        prop = loop['Dev']['P0']
+        cnt = prop.update_cnt
+        res = []
+        def target():
+            loop.waitFor("Dev", "P0", lambda prop: prop.update_cnt != cnt, timeout=5)
+            res.append(time.perf_counter())
+        t = threading.Thread(target=target)
+        t.start()
+        time.sleep(0.002)
+        t0 = time.perf_counter()
+        loop.processMessage(setmsg(0, r))
+        t.join()
+        lat.append(res[0] - t0)
+
+    stop.set()
+    for i in range(1, n_other + 1):
+        loop.processMessage(setmsg(i, 0))
+    return lat, wakeups[0]
+
+
+def bench_condition(n_other, rounds):
+    cond = threading.Condition()
+    state = {'cnt': 0, 'stop': False}
+    wakeups = [0]
+
+    def other():
+        with cond:
+            while not state['stop']:
+                cond.wait()
+                if not state['stop']:
+                    wakeups[0] += 1
+
+    threads = [threading.Thread(target=other, daemon=True) for i in range(n_other)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    wakeups[0] = 0
+
+    lat = []
+    for r in range(rounds):
+        cnt = state['cnt']
+        res = []
+        def target():
+            with cond:
+                while state['cnt'] == cnt:
+                    cond.wait(5)
+            res.append(time.perf_counter())
+        t = threading.Thread(target=target)
+        t.start()
+        time.sleep(0.002)
+        t0 = time.perf_counter()
+        with cond:
+            state['cnt'] += 1
+            cond.notify_all()
+        t.join()
+        lat.append(res[0] - t0)
+
+    with cond:
+        state['stop'] = True
+        cond.notify_all()
+    return lat, wakeups[0]
+
+
+def main():
+    rounds = 50
+    print("{:>8} {:>22} {:>10} {:>22} {:>10}".format("waiters", "per-prop median/p90 us", "wakeups", "notify_all median/p90 us", "wakeups"))
+    for n in (0, 10, 100, 500):
+        lat1, w1 = bench_waiters(n, rounds)
+        lat2, w2 = bench_condition(n, rounds)
+        lat1.sort()
+        lat2.sort()
+        print("{:>8} {:>10.0f} / {:>9.0f} {:>10} {:>10.0f} / {:>9.0f} {:>10}".format(
+            n, lat1[rounds // 2] * 1e6, lat1[rounds * 9 // 10] * 1e6, w1,
+            lat2[rounds // 2] * 1e6, lat2[rounds * 9 // 10] * 1e6, w2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Synthetic indiserver for benchmarks.
+
+Accepts one client, sends the definitions and then the update mix of a
+scenario for the given duration, then closes the connection. Every
+update carries its send time as timestamp (UTC, microseconds) so the
+client can measure latency.
+
+    numbers   number vectors updated at --rate Hz in total
+    switches  200 element switch vectors
+    blobs     multi-MB BLOBs
+    burst     thousands of number updates at once, twice a second
+    split     number updates written in pieces of 1..64 bytes
+    mix       all of the above except split
+
+    python3 -m benchmarks.fake_server --scenario numbers --port 7625
+"""
+
+import os
+import time
+import base64
+import random
+import socket
+import argparse
+import datetime
+
+
+SCENARIOS = ('numbers', 'switches', 'blobs', 'burst', 'split', 'mix')
+
+
+def timestamp(t):
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='microseconds')
+
+
+class Stream(object):
+    """One kind of traffic: definitions and updates due at a rate."""
+
+    def __init__(self, rate, batch=1):
+        self.rate = rate
+        self.batch = batch
+        self.sent = 0
+
+    def due(self, elapsed):
+        return int(elapsed * self.rate) * self.batch - self.sent
+
+    def updates(self, n, now):
+        out = []
+        for i in range(n):
+            self.sent += 1
+            out.append(self.update(now))
+        return out
+
+
+class Numbers(Stream):
+
+    def __init__(self, rate, vectors=10, batch=1, device='Numbers'):
+        Stream.__init__(self, rate, batch)
+        self.vectors = vectors
+        self.device = device
+
+    def defs(self):
+        return [('<defNumberVector device="{}" name="N{}" state="Idle" perm="ro">'
+                 '<defNumber name="A" format="%.3f">0</defNumber><defNumber name="B" format="%.3f">0</defNumber>'
+                 '<defNumber name="C" format="%.3f">0</defNumber></defNumberVector>').format(self.device, i)
+                for i in range(self.vectors)]
+
+    def update(self, now):
+        i = self.sent % self.vectors
+        return ('<setNumberVector device="{}" name="N{}" state="Ok" timestamp="{}">'
+                '<oneNumber name="A">{:.3f}</oneNumber><oneNumber name="B">{}</oneNumber>'
+                '<oneNumber name="C">{}</oneNumber></setNumberVector>').format(
+                    self.device, i, timestamp(now), now % 1000, self.sent, i)
+
+
+class Switches(Stream):
+
+    def __init__(self, rate, vectors=5, size=200):
+        Stream.__init__(self, rate)
+        self.vectors = vectors
+        self.size = size
+
+    def defs(self):
+        return ['<defSwitchVector device="Switches" name="S{}" state="Idle" perm="rw" rule="OneOfMany">{}</defSwitchVector>'.format(
+                    i, ''.join('<defSwitch name="SW{}">Off</defSwitch>'.format(j) for j in range(self.size)))
+                for i in range(self.vectors)]
+
+    def update(self, now):
+        i = self.sent % self.vectors
+        on = random.randrange(self.size)
+        return '<setSwitchVector device="Switches" name="S{}" state="Ok" timestamp="{}">{}</setSwitchVector>'.format(
+            i, timestamp(now), ''.join('<oneSwitch name="SW{}">{}</oneSwitch>'.format(j, 'On' if j == on else 'Off')
+                                       for j in range(self.size)))
+
+
+class Blobs(Stream):
+
+    def __init__(self, rate, size=4 * 1024 * 1024):
+        Stream.__init__(self, rate)
+        self.size = size
+        self.data = base64.b64encode(os.urandom(size)).decode()
+
+    def defs(self):
+        return ['<defBLOBVector device="Blobs" name="IMAGE" state="Idle" perm="ro"><defBLOB name="IMAGE"/></defBLOBVector>']
+
+    def update(self, now):
+        return ('<setBLOBVector device="Blobs" name="IMAGE" state="Ok" timestamp="{}">'
+                '<oneBLOB name="IMAGE" size="{}" format=".fits">{}</oneBLOB></setBLOBVector>').format(
+                    timestamp(now), self.size, self.data)
+
+
+def scenario(name, rate=None):
+    if name == 'numbers':
+        return [Numbers(rate or 1000)]
+    if name == 'switches':
+        return [Switches(rate or 100)]
+    if name == 'blobs':
+        return [Blobs(rate or 2)]
+    if name == 'burst':
+        return [Numbers(2, vectors=100, batch=rate or 5000)]
+    if name == 'split':
+        return [Numbers(rate or 1000)]
+    if name == 'mix':
+        return [Numbers(rate or 1000), Switches(20), Blobs(1), Numbers(2, vectors=100, batch=2000, device='Burst')]
+    raise ValueError('unknown scenario ' + name)
+
+
+def send(conn, data, split):
+    if not split:
+        conn.sendall(data)
+        return
+    pos = 0
+    while pos < len(data):
+        n = random.randint(1, 64)
+        conn.sendall(data[pos:pos + n])
+        pos += n
+
+
+def serve(conn, name, duration, rate=None):
+    """Send the scenario to conn, return the number of updates sent."""
+    streams = scenario(name, rate)
+    split = name == 'split'
+    if split:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    send(conn, ''.join(d for s in streams for d in s.defs()).encode(), split)
+    start = time.time()
+    sent = 0
+    while True:
+        now = time.time()
+        elapsed = now - start
+        if elapsed >= duration:
+            break
+        out = []
+        for s in streams:
+            n = s.due(elapsed)
+            if n > 0:
+                out.extend(s.updates(n, now))
+        if out:
+            send(conn, ''.join(out).encode(), split)
+            sent += len(out)
+        else:
+            time.sleep(0.0005)
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS, default='numbers')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--rate', type=int, default=None, help='updates per second, burst size for burst')
+    args = parser.parse_args()
+
+    server = socket.create_server((args.host, args.port))
+    # the port is the first line on stdout, the number of updates sent the last
+    print(server.getsockname()[1], flush=True)
+    conn, addr = server.accept()
+    server.close()
+    with conn:
+        sent = serve(conn, args.scenario, args.duration, args.rate)
+        conn.shutdown(socket.SHUT_WR)
+        # wait until the client has read everything
+        while conn.recv(65536):
+            pass
+    print(sent, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,14 +25,12 @@ def handleSnoop(msg, prop):
     print(prop)
     
     if prop.getAttr('name') == 'CCD1':
-        blob = prop['CCD1'].native()
-        f = open("test.fits", "wb")
-        f.write(blob)
-        f.close()
+        print("saved", prop['CCD1'].native())
 
 driver = IndiLoop(client_addr='localhost')
 
 driver.handleSnoop = handleSnoop
+driver.setBlobSink(indi.FileBlobSink("test.fits"))
 
 driver.sendClient(indi.getProperties())
 driver.timeout=1
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+IndiLoop variant running on asyncio.
+
+The client connection and the driver stdin/stdout are asyncio streams,
+handleSnoop and handleNewValue are coroutines and waiting for a property
+is a future, so any number of concurrent waits cost no threads.
+
+    class MyDriver(AsyncIndiLoop):
+        async def handleSnoop(self, msg, prop):
+            ...
+
+    driver = MyDriver(client_addr='localhost')
+    driver.sendClient(indi.getProperties())
+    asyncio.run(driver.loop())
+
+sendClient and sendDriver only queue data in the transport; the async
+methods drain it.
+
+The recorder and stats work as with IndiLoop; the handler executor, the
+BLOB pool and the BLOB connection depend on the select loop and are not
+available.
+"""
+
+import sys
+import time
+import asyncio
+import inspect
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_record import CLIENT_IN, DRIVER_IN, CLIENT_OUT, DRIVER_OUT
+
+import logging
+log = logging.getLogger()
+
+
+class AsyncIndiLoop(IndiLoop):
+
+    def __init__(self, client_addr = None, driver = False, client_port = 7624):
+        super(AsyncIndiLoop, self).__init__()
+        self.client_addr = client_addr
+        self.client_port = client_port
+        self.driver = driver
+
+        self.client_reader = None
+        self.client_writer = None
+        self.driver_reader = None
+        self.driver_writer = None
+
+        # output queued before connect()
+        self.client_pending = []
+        self.driver_pending = []
+
+        self.waiters = {}
+
+    async def connect(self):
+        if self.client_addr and self.client_writer is None:
+            self.client_reader, self.client_writer = await asyncio.open_connection(self.client_addr, self.client_port)
+            self.client_parser = self.newParser()
+            self.parsers.append(self.client_parser)
+            for msg in self.client_pending:
+                self.client_writer.write(msg)
+            self.client_pending = []
+
+        if self.driver and self.driver_writer is None:
+            loop = asyncio.get_running_loop()
+            self.driver_reader = asyncio.StreamReader()
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.driver_reader), sys.stdin.buffer)
+            transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+            self.driver_writer = asyncio.StreamWriter(transport, protocol, None, loop)
+            self.driver_parser = self.newParser()
+            self.parsers.append(self.driver_parser)
+            for msg in self.driver_pending:
+                self.driver_writer.write(msg)
+            self.driver_pending = []
+
+    def close(self):
+        for writer in (self.client_writer, self.driver_writer):
+            if writer is not None:
+                writer.close()
+
+    async def loop(self):
+        await self.connect()
+        tasks = []
+        if self.client_reader is not None:
+            tasks.append(self.readStream(self.client_reader, self.client_parser))
+        if self.driver_reader is not None:
+            tasks.append(self.readStream(self.driver_reader, self.driver_parser))
+        await asyncio.gather(*tasks)
+
+    def loop1(self, timeout = None):
+        raise RuntimeError('AsyncIndiLoop is driven by loop()')
+
+    def enableExecutor(self, *args, **kwargs):
+        raise RuntimeError('AsyncIndiLoop has no handler executor, use coroutine handlers')
+
+    def enableBlobPool(self, *args, **kwargs):
+        raise RuntimeError('AsyncIndiLoop has no BLOB pool')
+
+    def enableBlobConnection(self, devices):
+        raise RuntimeError('AsyncIndiLoop has no BLOB connection')
+
+    def transportName(self, in_s):
+        return 'client' if in_s is self.client_reader else 'driver'
+
+    async def readStream(self, reader, parser):
+        while True:
+            d = await reader.read(1000000)
+            if not d:
+                log.error("closed %s", "client socket" if reader is self.client_reader else "stdin")
+                await self.handleEOF(reader)
+                return
+
+            if self.recorder is not None:
+                self.recorder.record(CLIENT_IN if reader is self.client_reader else DRIVER_IN, d)
+            msgs, superseded = self.parseInput(reader, parser, d)
+            for j, msg in enumerate(msgs):
+                if j in superseded:
+                    self.updateSilently(msg, parser.blobs.pop(msg, None))
+                else:
+                    await self.processMessage(msg, reader, parser.blobs.pop(msg, None))
+
+    async def processMessage(self, msg, in_s=None, blobs=None):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        self.logMessage(msg)
+
+        spec = indi.getSpec(msg)
+
+        if spec['mode'] == 'define':
+            try:
+                prop = self.storeDefinition(msg)
+                self.wakeWaiters(prop.getAttr('device'), prop.getAttr('name'))
+                await self.dispatch(self.define_handlers, prop.getAttr('device'), prop.getAttr('name'), msg, prop)
+            except:
+                log.exception('define')
+
+        elif spec['mode'] == 'set':
+            try:
+                device = msg.get("device")
+                name = msg.get("name")
+                prop = self.properties[device][name]
+                self.updateProperty(prop, msg, blobs)
+                self.wakeWaiters(device, name)
+                await self.handleSnoop(msg, prop)
+                await self.dispatch(self.snoop_handlers, device, name, msg, prop)
+            except:
+                log.exception('set')
+        elif spec['mode'] == 'new':
+            try:
+                device = msg.get("device")
+                if device in self.my_devices:
+                    name = msg.get("name")
+                    prop = self.properties[device][name]
+                    from_client = in_s is self.client_reader
+                    if from_client or not await self.dispatch(self.new_handlers, device, name, msg, prop):
+                        await self.handleNewValue(msg, prop, from_client_socket=from_client)
+            except:
+                log.exception('new')
+        elif spec['mode'] == 'control':
+            self.processControl(msg)
+
+        if stats is not None:
+            stats.messageProcessed(msg, time.perf_counter() - t0)
+
+    async def dispatch(self, registry, device, name, msg, prop):
+        """Call the matching handlers, awaiting coroutine handlers."""
+        funcs = registry.match(device, name, msg)
+        for func in funcs:
+            stats = self.stats
+            if stats is not None:
+                t0 = time.perf_counter()
+            try:
+                r = func(msg, prop)
+                if inspect.isawaitable(r):
+                    await r
+            except Exception:
+                log.exception('handler %s', func)
+            if stats is not None:
+                stats.observe('handler_seconds', getattr(func, '__qualname__', repr(func)), time.perf_counter() - t0)
+        return len(funcs)
+
+    def sendClient(self, msg):
+        if self.recorder is not None:
+            self.recorder.record(CLIENT_OUT, msg)
+        if self.client_writer is not None:
+            self.client_writer.write(msg)
+            if self.stats is not None:
+                self.sendStats('client', msg, self.client_writer.transport.get_write_buffer_size())
+        elif self.client_addr:
+            self.client_pending.append(msg)
+
+    def sendDriver(self, msg):
+        if self.recorder is not None:
+            self.recorder.record(DRIVER_OUT, msg)
+        if self.driver_writer is not None:
+            self.driver_writer.write(msg)
+            if self.stats is not None:
+                self.sendStats('driver', msg, self.driver_writer.transport.get_write_buffer_size())
+        elif self.driver:
+            self.driver_pending.append(msg)
+
+    async def drain(self):
+        for writer in (self.client_writer, self.driver_writer):
+            if writer is not None:
+                await writer.drain()
+
+    async def handleNewValue(self, msg, prop, from_client_socket=False):
+        if from_client_socket:
+            return
+
+        prop.newFromEtree(msg)
+
+        prop.setAttr('state', 'Ok')
+        self.sendDriver(self.serialize(prop.setMessage))
+
+    async def handleSnoop(self, msg, prop):
+        pass
+
+    async def handleEOF(self, reader):
+        pass
+
+    async def sendDriverMessage(self, device, prop_name, message = None):
+        super(AsyncIndiLoop, self).sendDriverMessage(device, prop_name, message)
+        if self.driver_writer is not None:
+            await self.driver_writer.drain()
+
+    def wakeWaiters(self, device, name):
+        for fut in self.waiters.pop((device, name), ()):
+            if not fut.done():
+                fut.set_result(None)
+
+    async def waitFor(self, device, name, predicate, timeout=None, error='Prop wait timeout'):
+        """Wait until the property exists and predicate(prop) is true."""
+        loop = asyncio.get_running_loop()
+        if timeout is not None:
+            deadline = loop.time() + timeout
+        while True:
+            prop = self.properties.get(device, {}).get(name)
+            if prop is not None and predicate(prop):
+                return prop
+
+            fut = loop.create_future()
+            waiters = self.waiters.setdefault((device, name), [])
+            waiters.append(fut)
+            try:
+                if timeout is None:
+                    await fut
+                else:
+                    await asyncio.wait_for(fut, deadline - loop.time())
+            except asyncio.TimeoutError:
+                raise RuntimeError(error)
+            finally:
+                if fut in waiters:
+                    waiters.remove(fut)
+
+    async def sendClientMessageWait(self, device, name, changes={}, timeout=None):
+        if timeout is None:
+            timeout = self.reply_timeout
+
+        try:
+            baseprop = self.properties[device][name]
+            cnt = baseprop.update_cnt
+            self.sendClientMessage(device, name, changes)
+            if not self._checkChanges(baseprop, changes):
+                # no changes, do not wait for result
+                return
+        except:
+            log.exception("sendClientMessageWait")
+            return
+
+        if self.client_writer is not None:
+            await self.client_writer.drain()
+        await self.waitFor(device, name, lambda prop: prop is not baseprop or prop.update_cnt != cnt,
+                           timeout, 'Prop is still busy')
+
+    async def waitForProp(self, device, name, timeout=None):
+        if timeout is None:
+            timeout = self.reply_timeout
+
+        return await self.waitFor(device, name, lambda prop: True, timeout, 'Prop is still missing')
@@ -8,7 +8,14 @@ import numpy as np
 import numbers
 
 import base64
+import types
+import re
+import time
+import sys
+import binascii
 import zlib
+import fnmatch
+import html
 
 def indi_bool(x):
     if x == 'On':
@@ -17,11 +24,99 @@ def indi_bool(x):
         return False
     return bool(x)
 
+def indi_number(x):
+    if not isinstance(x, str):
+        return float(x)
+    try:
+        return float(x)
+    except ValueError:
+        pass
+    # sexagesimal, "-12:30:00" or "12 30 00"
+    parts = x.replace(':', ' ').split()
+    if not parts:
+        return float('nan')
+    v = 0.0
+    scale = 1.0
+    for p in parts:
+        v += abs(float(p)) * scale
+        scale /= 60.0
+    if x.strip().startswith('-'):
+        v = -v
+    return v
+
+def resolveSwitchRule(names, states, rule, changes):
+    """Apply switch changes (name -> 'On'/'Off'/bool) one by one to a list
+    of states (bools) and enforce OneOfMany/AtMostOne. Returns a new list."""
+    states = list(states)
+    for name, value in changes.items():
+        if value is True:
+            value = 'On'
+        elif value is False:
+            value = 'Off'
+        i = names.index(name)
+        states[i] = (value == 'On')
+
+        if rule == 'AtMostOne' or (value == 'On' and rule == 'OneOfMany'):
+            haveOn = states[i]
+            for j in range(len(states)):
+                if j == i:
+                    continue
+                if haveOn:
+                    states[j] = False
+                elif states[j]:
+                    haveOn = True
+        elif value == 'Off' and rule == 'OneOfMany':
+            # keep the first switch that is On, or turn on the first other one
+            keep = i
+            for j, on in enumerate(states):
+                if on:
+                    keep = j
+                    break
+            haveOn = keep != i
+            for j in range(len(states)):
+                if j == keep:
+                    continue
+                states[j] = not haveOn
+                haveOn = True
+    return states
+
+_timestamp_cache = (0, '')
+
+def indi_timestamp():
+    """Current UTC time as INDI timestamp, formatted once per second."""
+    global _timestamp_cache
+    sec = int(time.time())
+    cache = _timestamp_cache
+    if cache[0] != sec:
+        cache = (sec, datetime.datetime.fromtimestamp(sec, datetime.timezone.utc).replace(tzinfo=None).isoformat())
+        _timestamp_cache = cache
+    return cache[1]
+
+_parsed_timestamp = ('', 0.0)
+
+def indi_timestamp_seconds(ts):
+    """Seconds since the epoch of an INDI (UTC) timestamp, the current
+    time if ts is missing or invalid."""
+    global _parsed_timestamp
+    if not ts:
+        return time.time()
+    cache = _parsed_timestamp
+    if cache[0] != ts:
+        try:
+            dt = datetime.datetime.fromisoformat(ts)
+        except ValueError:
+            return time.time()
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        cache = (ts, dt.timestamp())
+        _parsed_timestamp = cache
+    return cache[1]
+
 indi_messages = {
     "defTextVector"   : { 'mode': 'define', 'ptype': str,         'vector': True,  'itype': 'Text',   'setmsg': "setTextVector", 'newmsg': "newTextVector" },
     "defText"         : { 'mode': 'define', 'ptype': str,         'vector': False, 'itype': 'Text',   'onemsg': "oneText"},
-    "defNumberVector" : { 'mode': 'define', 'ptype': float,       'vector': True,  'itype': 'Number', 'setmsg': "setNumberVector", 'newmsg': "newNumberVector"},
-    "defNumber"       : { 'mode': 'define', 'ptype': float,       'vector': False, 'itype': 'Number', 'onemsg': "oneNumber"},
+    "defNumberVector" : { 'mode': 'define', 'ptype': indi_number, 'vector': True,  'itype': 'Number', 'setmsg': "setNumberVector", 'newmsg': "newNumberVector"},
+    "defNumber"       : { 'mode': 'define', 'ptype': indi_number, 'vector': False, 'itype': 'Number', 'onemsg': "oneNumber"},
     "defSwitchVector" : { 'mode': 'define', 'ptype': indi_bool,   'vector': True,  'itype': 'Switch', 'setmsg': "setSwitchVector", 'newmsg': "newSwitchVector"},
     "defSwitch"       : { 'mode': 'define', 'ptype': indi_bool,   'vector': False, 'itype': 'Switch', 'onemsg': "oneSwitch"},
     "defLightVector"  : { 'mode': 'define', 'ptype': indi_bool,   'vector': True,  'itype': 'Light',  'setmsg': "setLightVector", 'newmsg': "newLightVector"},
@@ -30,18 +125,18 @@ indi_messages = {
     "defBLOB"         : { 'mode': 'define', 'ptype': base64.b64decode,         'vector': False, 'itype': 'BLOB',   'onemsg': "oneBLOB"},
 
     "setTextVector"   : { 'mode': 'set',    'ptype': str,         'vector': True,  'itype': 'Text'},
-    "setNumberVector" : { 'mode': 'set',    'ptype': float,       'vector': True,  'itype': 'Number'},
+    "setNumberVector" : { 'mode': 'set',    'ptype': indi_number, 'vector': True,  'itype': 'Number'},
     "setSwitchVector" : { 'mode': 'set',    'ptype': indi_bool,   'vector': True,  'itype': 'Switch'},
     "setLightVector"  : { 'mode': 'set',    'ptype': indi_bool,   'vector': True,  'itype': 'Light'},
     "setBLOBVector"   : { 'mode': 'set',    'ptype': base64.b64decode,         'vector': True,  'itype': 'BLOB'},
 
     "newTextVector"   : { 'mode': 'new',    'ptype': str,         'vector': True,  'itype': 'Text'},
-    "newNumberVector" : { 'mode': 'new',    'ptype': float,       'vector': True,  'itype': 'Number'},
+    "newNumberVector" : { 'mode': 'new',    'ptype': indi_number, 'vector': True,  'itype': 'Number'},
     "newSwitchVector" : { 'mode': 'new',    'ptype': indi_bool,   'vector': True,  'itype': 'Switch'},
     "newBLOBVector"   : { 'mode': 'new',    'ptype': base64.b64decode,         'vector': True,  'itype': 'BLOB'},
 
     "oneText"         : { 'mode': 'one',    'ptype': str,         'vector': False, 'itype': 'Text'},
-    "oneNumber"       : { 'mode': 'one',    'ptype': float,       'vector': False, 'itype': 'Number'},
+    "oneNumber"       : { 'mode': 'one',    'ptype': indi_number, 'vector': False, 'itype': 'Number'},
     "oneSwitch"       : { 'mode': 'one',    'ptype': indi_bool,   'vector': False, 'itype': 'Switch'},
     "oneLight"        : { 'mode': 'one',    'ptype': indi_bool,   'vector': False, 'itype': 'Light'},
     "oneBLOB"         : { 'mode': 'one',    'ptype': base64.b64decode,         'vector': False, 'itype': 'BLOB'},
@@ -59,79 +154,264 @@ def getSpec(t):
     except:
         return { 'mode': 'unknown'}
 
+
+class INDIType(object):
+    """indi_messages entry shared by all elements/vectors of one tag."""
+    __slots__ = ('tag', 'mode', 'ptype', 'vector', 'itype', 'definemsg', 'setmsg', 'newmsg', 'onemsg')
+
+    def __init__(self, tag, spec):
+        self.tag = tag
+        self.mode = spec['mode']
+        self.ptype = spec.get('ptype')
+        self.vector = spec.get('vector')
+        self.itype = spec.get('itype')
+        self.definemsg = tag if self.mode == 'define' else None
+        self.setmsg = spec.get('setmsg')
+        self.newmsg = spec.get('newmsg')
+        self.onemsg = spec.get('onemsg')
+
+indi_types = { tag: INDIType(tag, spec) for tag, spec in indi_messages.items() }
+
+
+class AttrLayout(object):
+    """Attribute name -> index table shared between objects.
+
+    Objects with the same attribute names keep only a list of values;
+    adding a new attribute moves the object to the extended layout,
+    which is created once and cached.
+    """
+    __slots__ = ('keys', 'index', 'transitions')
+
+    def __init__(self, keys=()):
+        self.keys = keys
+        self.index = { k: i for i, k in enumerate(keys) }
+        self.transitions = {}
+
+    def extend(self, key):
+        try:
+            return self.transitions[key]
+        except KeyError:
+            layout = AttrLayout(self.keys + (key,))
+            self.transitions[key] = layout
+            return layout
+
+empty_layout = AttrLayout()
+
+
+def _spec_property(name):
+    return property(lambda self: getattr(self.spec, name))
+
+
 class INDIBase(object):
+    __slots__ = ('spec', 'layout', 'attr_values')
+
+    mode = _spec_property('mode')
+    ptype = _spec_property('ptype')
+    vector = _spec_property('vector')
+    itype = _spec_property('itype')
+    definemsg = _spec_property('definemsg')
+    setmsg = _spec_property('setmsg')
+    newmsg = _spec_property('newmsg')
+    onemsg = _spec_property('onemsg')
+
+    def initAttrs(self, tag):
+        self.spec = indi_types[tag]
+        self.layout = empty_layout
+        self.attr_values = []
+
     def getAttr(self, a):
-        return self.attr[a]
+        return self.attr_values[self.layout.index[a]]
 
     def setAttr(self, a, v):
-        self.attr[a] = v
-    
-    def attrsFromEtree(self, t):
+        try:
+            self.attr_values[self.layout.index[a]] = v
+        except KeyError:
+            self.layout = self.layout.extend(a)
+            self.attr_values.append(v)
+
+    def hasAttr(self, a):
+        return a in self.layout.index
+
+    def getAttrs(self):
+        return dict(zip(self.layout.keys, self.attr_values))
+
+    @property
+    def attr(self):
+        return types.MappingProxyType(self.getAttrs())
+
+    def attrsFromEtree(self, t, intern=False):
+         # labels, groups, formats etc. repeat a lot, share them
+         # between objects when defining
          for name, value in t.items():
+             if intern:
+                 value = sys.intern(value)
              self.setAttr(name, value)
     
 
 
+# BLOB format suffix -> (compress(data, level), decompress(data))
+BLOB_CODECS = {
+    '.z': (zlib.compress, zlib.decompress),
+}
+
+
+def blob_codec(fmt):
+    """The codec suffix fmt ends with, None if uncompressed."""
+    for suffix in BLOB_CODECS:
+        if fmt.endswith(suffix):
+            return suffix
+    return None
+
+
+class CompressedBlob(object):
+    """BLOB payload in a compressed format, inflated on first access.
+
+    The compressed data is kept to re-send the value as received.
+    """
+    __slots__ = ('data', 'codec', 'inflated')
+
+    def __init__(self, data, codec, inflated=None):
+        self.data = data
+        self.codec = codec
+        self.inflated = inflated
+
+    def inflate(self):
+        if self.inflated is None:
+            self.inflated = BLOB_CODECS[self.codec][1](self.data)
+        return self.inflated
+
+    def __len__(self):
+        return len(self.data)
+
+
 class INDIElement(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
+    __slots__ = ('value', 'native_value')
+
     def __init__(self, t):
-        spec = indi_messages[t.tag]
-        self.__dict__.update(spec)
-        if self.mode != 'define' and self.vector != False:
+        self.initAttrs(t.tag)
+        if self.spec.mode != 'define' and self.spec.vector != False:
             raise RuntimeError('cant define ' + t.tag)
         
-        self.definemsg = t.tag
-        self.attr = {}
-        self.fromEtree(t)
+        self.fromEtree(t, intern=True)
 
     def getValue(self):
+        if self.value is None:
+            self.value = self.formatValue()
         return self.value
 
-    def setValue(self, v, compress=False):
+    def setValue(self, v, compress=False, level=-1):
+        """For BLOBs compress is True or a BLOB_CODECS suffix, the suffix
+        is appended to the format."""
         if v is True:
             v = 'On'
         elif v is False:
             v = 'Off'
 	
-        if self.itype == 'BLOB':
+        if self.spec.itype == 'BLOB':
             if isinstance(v, str):
                 v = v.encode()
-            self.setAttr('size', str(len(v)))
             if compress:
-                v = zlib.compress(v)
-            self.value = base64.b64encode(v).decode('ascii')
+                codec = '.z' if compress is True else compress
+                self.setCompressed(BLOB_CODECS[codec][0](v, level), codec, len(v), v)
+                return
+            self.setAttr('size', str(len(v)))
+            self.native_value = v
+            self.value = None
             return
 
-        self.value = v
-
-    def fromEtree(self, t):
-        text = t.text or ''
-        self.value = text.strip()
-        self.attrsFromEtree(t)
+        if isinstance(v, str):
+            self.value = v
+            self.native_value = self.parseValue(v)
+        else:
+            self.native_value = self.spec.ptype(v)
+            # integers are sent as given ("5", not "5.0")
+            self.value = str(v) if isinstance(v, (int, np.integer)) else None
+
+    def setCompressed(self, data, codec, size, inflated=None, text=None):
+        """Set a BLOB to data compressed with codec from size bytes; text
+        is the base64 of data if already encoded."""
+        self.setAttr('size', str(size))
+        fmt = self.getAttr('format') if self.hasAttr('format') else ''
+        if blob_codec(fmt) != codec:
+            self.setAttr('format', fmt + codec)
+        self.native_value = CompressedBlob(data, codec, inflated)
+        self.value = text
+
+    def parseValue(self, text):
+        try:
+            return self.spec.ptype(text)
+        except ValueError:
+            log.error("%s: invalid value '%s'", self.getAttrs().get('name'), text)
+            if self.spec.itype == 'Number':
+                return float('nan')
+            return text
+
+    def formatValue(self):
+        v = self.native_value
+        if self.spec.itype == 'BLOB':
+            if type(v) is CompressedBlob:
+                v = v.data
+            return base64.b64encode(v).decode('ascii')
+        if self.spec.itype in ('Switch', 'Light') and isinstance(v, bool):
+            return 'On' if v else 'Off'
+        return str(v)
+
+    def fromEtree(self, t, payload=None, intern=False):
+        if payload is not None:
+            # decoded data is formatted again when sent, other sink
+            # values (e.g. a path) are not sent
+            self.value = None if isinstance(payload, (bytes, bytearray)) else ''
+            self.native_value = payload
+        elif self.spec.itype == 'BLOB':
+            self.value = None
+            self.native_value = base64.b64decode(t.text or '')
+            fmt = t.get('format')
+            codec = blob_codec(fmt) if fmt else None
+            if codec is not None:
+                self.native_value = CompressedBlob(self.native_value, codec)
+        else:
+            text = t.text or ''
+            self.value = text.strip()
+            self.native_value = self.parseValue(self.value)
+        self.attrsFromEtree(t, intern)
 
     def __str__(self):
-        return str(self.value)
+        return self.getValue()
 
     def __float__(self):
-        return float(self.value)
+        return float(self.native_value)
 
     def __repr__(self):
-        if self.itype == 'BLOB':
-            return str(self.attr) + ': blob(' + str(len(self.value)) + ')'
-        return str(self.attr) + ': ' + self.value
+        if self.spec.itype == 'BLOB':
+            # the data may have gone to a BlobSink, its value is then a
+            # path, a view or None
+            attrs = self.getAttrs()
+            v = self.native_value
+            size = attrs.get('size')
+            if size is None and isinstance(v, (bytes, bytearray, memoryview, CompressedBlob)):
+                size = len(v)
+            if isinstance(v, str):
+                return str(attrs) + ': blob(' + str(size) + ', ' + repr(v) + ')'
+            return str(attrs) + ': blob(' + str(size) + ')'
+        return str(self.getAttrs()) + ': ' + self.getValue()
 
     def native(self):
-        return self.ptype(self.value)
+        """The value; compressed BLOBs received as text are inflated."""
+        v = self.native_value
+        if type(v) is CompressedBlob:
+            return v.inflate()
+        return v
 
     def __getitem__(self, key):
-        return self.attr[key]
+        return self.getAttr(key)
             
     def __setitem__(self, key, val):
-        self.attr[key] = val
+        self.setAttr(key, val)
 
     def setMessageTree(self, value = None):
         attrs = {}
         alist = ['name']
-        if self.itype == 'BLOB':
+        if self.spec.itype == 'BLOB':
             alist += ['size', 'format']
         for a in alist:
             try:
@@ -139,11 +419,11 @@ class INDIElement(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
             except:
                 pass
             
-        tree = etree.Element(self.onemsg, attrib=attrs)
+        tree = etree.Element(self.spec.onemsg, attrib=attrs)
         if value is not None:
             tree.text = str(value)
         else:
-            tree.text = str(self.value)
+            tree.text = self.getValue()
         return tree
 
     def setMessage(self):
@@ -153,7 +433,7 @@ class INDIElement(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
     def defineMessageTree(self):
         attrs = {}
         alist = ['name', 'label']
-        if self.itype == 'Number':
+        if self.spec.itype == 'Number':
             alist += ['format', 'min', 'max', 'step']
         for a in alist:
             try:
@@ -161,9 +441,9 @@ class INDIElement(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
             except:
                 pass
             
-        tree = etree.Element(self.definemsg, attrib=attrs)
-        if self.itype != 'BLOB':
-            tree.text = str(self.value)
+        tree = etree.Element(self.spec.definemsg, attrib=attrs)
+        if self.spec.itype != 'BLOB':
+            tree.text = self.getValue()
         return tree
 
     def defineMessage(self):
@@ -192,28 +472,96 @@ class INDIElement(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
                 for x in out)
         result = getattr(ufunc, method)(*inputs, **kwargs)
 
+        if out:
+            # in-place operation, return the updated objects
+            return out[0] if len(out) == 1 else out
         return result
 
 
+class INDINumberElement(INDIElement):
+    """Number element whose value is stored in the float64 array of its vector."""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, t, store, index):
+        self.store = store
+        self.index = index
+        INDIElement.__init__(self, t)
+
+    def getValue(self):
+        # the array can be modified directly, re-format if it differs
+        # from the value the string was made from
+        v = self.store.item(self.index)
+        if self.value is None or v != self.native_value:
+            self.native_value = v
+            self.value = self.formatValue()
+        return self.value
+
+    def setValue(self, v, compress=False, level=-1):
+        INDIElement.setValue(self, v)
+        self.store[self.index] = self.native_value
+
+    def fromEtree(self, t, payload=None, intern=False):
+        INDIElement.fromEtree(self, t, payload, intern)
+        self.store[self.index] = self.native_value
+
+    def __float__(self):
+        return self.store.item(self.index)
+
+    def native(self):
+        return self.store.item(self.index)
+
+    def to_array(self):
+        return self.store[self.index:self.index + 1]
+
+
 class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
+    __slots__ = ('_elements', '_elements_dict', 'update_cnt', '_array', 'template', 'pending', 'history')
+
     def __init__(self, t):
-        spec = indi_messages[t.tag]
-        self.__dict__.update(spec)
-        if self.mode != 'define' and self.vector != True:
+        self.initAttrs(t.tag)
+        if self.spec.mode != 'define' and self.spec.vector != True:
             raise RuntimeError('cant define ' + t.tag)
 
-        self.definemsg = t.tag
-        self.attr = {}
-        self.elements = []
-        self.elements_dict = {}
+        self._elements = []
+        self._elements_dict = {}
         self.update_cnt = 0
+        self._array = None
+        self.template = None
+        self.pending = None
+        # ring buffer of Number values, see indi_history
+        self.history = None
         self.defineFromEtree(t)
         
+    # element values of lazy updates are decoded on first access
+
+    @property
+    def elements(self):
+        if self.pending is not None:
+            self.applyPending()
+        return self._elements
+
+    @property
+    def elements_dict(self):
+        if self.pending is not None:
+            self.applyPending()
+        return self._elements_dict
+
+    @property
+    def array(self):
+        if self.pending is not None:
+            self.applyPending()
+        return self._array
+
+    def applyPending(self):
+        pending, self.pending = self.pending, None
+        for name, (child, payload) in pending.items():
+            self._elements_dict[name].fromEtree(child, payload)
 
     def append(self, e):
         name = e.getAttr('name')
-        self.elements_dict[name] = e
-        self.elements.append(e)
+        self._elements_dict[name] = e
+        self._elements.append(e)
+        self.template = None
 
     def getElements(self):
         return self.elements
@@ -228,46 +576,24 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         if name is not None and value is not None:
             self.elements_dict[name].setValue(value)
 
-        try:
-            rule = self.getAttr('rule')
-            if rule != 'OneOfMany' and rule != 'AtMostOne':
-                return
-        except:
-            return
-            
         if name is None:
             name = self.elements[0].getAttr("name")
-        
-        value = self.elements_dict[name].getValue()
-        
-        if rule == 'AtMostOne' or (value == 'On' and rule == 'OneOfMany'):
-            haveOn = (value == 'On')
-            for e in self.elements:
-                if e.getAttr("name") == name:
-                    continue
-                if haveOn:
-                   e.setValue('Off')
-                else:
-                   if e.getValue() == 'On':
-                       haveOn = True
-        elif value == 'Off' and rule == 'OneOfMany':
-            haveOn = False
 
-            for e in self.elements:
-               if e.getValue() == 'On':
-                    haveOn = True
-                    name = e.getAttr("name")
-                    break
+        states = self.resolveSwitches({ name: self.elements_dict[name].getValue() })
+        for e, on in zip(self.elements, states):
+            if on != (e.getValue() == 'On'):
+                e.setValue('On' if on else 'Off')
 
-            for e in self.elements:
-                if e.getAttr("name") == name:
-                    continue
-
-                if haveOn:
-                    e.setValue('Off')
-                else:
-                    e.setValue('On')
-                    haveOn = True
+    def resolveSwitches(self, changes = {}):
+        """On/Off states (as bools, in element order) after applying changes
+        under the vector rule, without modifying the vector."""
+        try:
+            rule = self.getAttr('rule')
+        except KeyError:
+            rule = None
+        names = [e.getAttr("name") for e in self.elements]
+        states = [e.getValue() == 'On' for e in self.elements]
+        return resolveSwitchRule(names, states, rule, changes)
 
     def setValue(self, v):
         for i, e in enumerate(self.elements):
@@ -281,21 +607,63 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         return None
 
     def defineFromEtree(self, t):
-        self.attrsFromEtree(t)
+        self.attrsFromEtree(t, intern=True)
+        if self.spec.itype == 'Number':
+            # element values live in one contiguous array
+            self._array = np.zeros(len(t))
+            for i, child in enumerate(t):
+                self.append(INDINumberElement(child, self._array, i))
+            return
+
         for child in t:
             name = child.get('name')
             e = INDIElement(child)
             self.append(e)
 
-    def updateFromEtree(self, t):
+    def redefineFromEtree(self, t):
+        """Apply a repeated definition in place if it has the same type and
+        elements, return False if the vector has to be defined anew."""
+        if t.tag != self.spec.tag or len(t) != len(self._elements):
+            return False
+        for child, e in zip(t, self._elements):
+            if child.get('name') != e.getAttr('name'):
+                return False
+
+        self.update_cnt += 1
+        self.pending = None
+        self.attrsFromEtree(t, intern=True)
+        for child, e in zip(t, self.elements):
+            e.fromEtree(child, intern=True)
+        self.template = None
+        return True
+
+    def updateFromEtree(self, t, blobs=None, lazy=False):
+        """Apply a set/new message. With lazy the element subtrees are kept
+        and decoded when the elements are accessed; element objects held
+        across updates are current only after accessing the vector."""
         self.update_cnt += 1
-        spec = indi_messages[t.tag]
 
         self.attrsFromEtree(t)
+        if lazy and self.history is None:
+            if self.pending is None:
+                self.pending = {}
+            for child in t:
+                name = child.get('name')
+                if name not in self._elements_dict:
+                    raise KeyError(name)
+                self.pending[name] = (child, blobs.get(name) if blobs else None)
+            return
+
         for child in t:
             name = child.get('name')
             e = self.getElementByName(name)
-            e.fromEtree(child)
+            if blobs:
+                e.fromEtree(child, blobs.get(name))
+            else:
+                e.fromEtree(child)
+
+        if self.history is not None:
+            self.history.append(indi_timestamp_seconds(t.get('timestamp')), self._array)
 
     def newFromEtree(self, t):
         self.updateFromEtree(t)
@@ -308,14 +676,14 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         
 
     def __repr__(self):
-        r = str(self.attr) + ':\n'
+        r = str(self.getAttrs()) + ':\n'
         for e in self.elements:
             r += '                ' + repr(e) + '\n'
         return r
     
     def __getitem__(self, key):
         try:
-            return self.attr[key]
+            return self.getAttr(key)
         except KeyError:
             try:
                 return self.elements_dict[key]
@@ -323,15 +691,15 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
                 return self.elements[key]
             
     def __setitem__(self, key, val):
-        if key in self.attr:
-            self.attr[key] = val
+        if self.hasAttr(key):
+            self.setAttr(key, val)
         elif key in self.elements_dict:
             self.elements_dict[key].setValue(val)
         else:
             self.elements[key].setValue(val)
 
     def setMessageTree(self, message = None):
-        self.attr['timestamp'] = datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+        self.setAttr('timestamp', indi_timestamp())
         attrs = {}
         for a in ['device', 'name', 'state', 'timeout', 'timestamp']:
             try:
@@ -342,19 +710,28 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         if message is not None:
             attrs['message'] = message
             
-        tree = etree.Element(self.setmsg, attrib=attrs)
+        tree = etree.Element(self.spec.setmsg, attrib=attrs)
         
         for e in self.elements:
             tree.append(e.setMessageTree())
         
         return tree
 
+    def getTemplate(self):
+        key = (self.attr_values[self.layout.index['device']] if 'device' in self.layout.index else None,
+               self.attr_values[self.layout.index['name']] if 'name' in self.layout.index else None)
+        template = self.template
+        if template is None or template.key != key:
+            template = MessageTemplate(self, key)
+            self.template = template
+        return template
+
     def setMessage(self, message = None):
-        tree = self.setMessageTree(message)
-        return etree.tostring(tree)
+        self.setAttr('timestamp', indi_timestamp())
+        return self.getTemplate().setMessage(self, message)
 
     def defineMessageTree(self, message = None):
-        self.attr['timestamp'] = datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+        self.setAttr('timestamp', indi_timestamp())
         attrs = {}
         for a in ['device', 'name', 'label', 'group', 'state', 'perm', 'rule', 'timeout', 'timestamp']:
             try:
@@ -365,16 +742,16 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         if message is not None:
             attrs['message'] = message
             
-        tree = etree.Element(self.definemsg, attrib=attrs)
+        tree = etree.Element(self.spec.definemsg, attrib=attrs)
         
         for e in self.elements:
             tree.append(e.defineMessageTree())
         
         return tree
 
-    def defineMessage(self):
-        tree = self.defineMessageTree()
-        return etree.tostring(tree)
+    def defineMessage(self, message = None):
+        self.setAttr('timestamp', indi_timestamp())
+        return self.getTemplate().defineMessage(self, message)
 
     def newMessageTree(self, changes = {}, message = None):
         attrs = {}
@@ -384,18 +761,15 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
             except:
                 pass
 
-        attrs['timestamp'] = datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+        attrs['timestamp'] = indi_timestamp()
         if message is not None:
             attrs['message'] = message
             
-        tree = etree.Element(self.newmsg, attrib=attrs)
+        tree = etree.Element(self.spec.newmsg, attrib=attrs)
 
-        if self.itype == 'Switch':
-            tmpVector = INDIVector(self.defineMessageTree())
-            for key,v in changes.items():
-                tmpVector.enforceRule(key, v)
-            for e in tmpVector.elements:
-            	tree.append(e.setMessageTree())
+        if self.spec.itype == 'Switch':
+            for e, on in zip(self.elements, self.resolveSwitches(changes)):
+                tree.append(e.setMessageTree('On' if on else 'Off'))
                 
         else:
             for key,v in changes.items():
@@ -404,13 +778,17 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         return tree
 
     def newMessage(self, changes = {}, message = None):
-        tree = self.newMessageTree(changes, message)
-        return etree.tostring(tree)
+        if self.spec.itype == 'Switch':
+            values = [(e, 'On' if on else 'Off') for e, on in zip(self.elements, self.resolveSwitches(changes))]
+        else:
+            values = [(self.elements_dict[key], str(v)) for key, v in changes.items()]
+        return self.getTemplate().newMessage(self, values, message)
 
-    def checkValue(self, item, state = ['Ok', 'Idle'], defvalue = None):
+    def checkValue(self, item, state = ['Ok', 'Idle'], defvalue = None, native = False):
         try:
             if self.getAttr('state') in state:
-                value = self.elements_dict[item].getValue()
+                e = self.elements_dict[item]
+                value = e.native() if native else e.getValue()
             else:
                 value = defvalue
         except KeyError:
@@ -419,6 +797,8 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         return value
 
     def to_array(self):
+        if self.array is not None:
+            return self.array
         return np.array([x.native() for x in self.elements])
 
     _HANDLED_TYPES = (np.ndarray, numbers.Number, bool, str)
@@ -437,11 +817,17 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
         inputs = tuple(x.to_array() if isinstance(x, INDIVector) else x
                        for x in inputs)
         if out:
+            for x in out:
+                if isinstance(x, INDIVector) and x.array is None:
+                    raise TypeError('out= is supported only for Number vectors')
             kwargs['out'] = tuple(
                 x.to_array() if isinstance(x, INDIVector) else x
                 for x in out)
         result = getattr(ufunc, method)(*inputs, **kwargs)
 
+        if out:
+            # in-place operation, return the updated objects
+            return out[0] if len(out) == 1 else out
         return result
 #        if type(result) is tuple:
 #            # multiple return values
@@ -454,6 +840,473 @@ class INDIVector(INDIBase, np.lib.mixins.NDArrayOperatorsMixin):
 #            return type(self)(result)
 
 
+_attr_table = str.maketrans({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;' })
+_attr_special = re.compile('[&<>"\n\r\t]')
+_text_table = str.maketrans({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;' })
+_text_special = re.compile('[&<>\r]')
+
+# most values need no escaping, searching is cheaper than translate()
+def _attr_escape(v):
+    return v.translate(_attr_table) if _attr_special.search(v) else v
+
+def _text_escape(v):
+    return v.translate(_text_table) if _text_special.search(v) else v
+
+def _attrs(obj, names):
+    r = ''
+    index = obj.layout.index
+    for a in names:
+        if a in index:
+            r += ' ' + a + '="' + _attr_escape(str(obj.attr_values[index[a]])) + '"'
+    return r
+
+def _message_attr(message):
+    if message is None:
+        return ''
+    return ' message="' + _attr_escape(message) + '"'
+
+
+class MessageTemplate(object):
+    """Serializer of one vector with the static parts pre-formatted.
+
+    Produces the same bytes as etree.tostring() of the *MessageTree()
+    methods; only the values and changing attributes are escaped per
+    message. Rebuilt when the device or name changes.
+    """
+    __slots__ = ('key', 'set_head', 'set_tail', 'new_head', 'new_tail', 'one_open', 'one_close', 'blob')
+
+    def __init__(self, vector, key):
+        spec = vector.spec
+        self.key = key
+        static = _attrs(vector, ('device', 'name'))
+        self.set_head = '<' + spec.setmsg + static
+        self.set_tail = '</' + spec.setmsg + '>'
+        self.new_head = '<' + spec.newmsg + static
+        self.new_tail = '</' + spec.newmsg + '>'
+        self.blob = spec.itype == 'BLOB'
+        self.one_open = {}
+        self.one_close = None
+        for e in vector.elements:
+            onemsg = e.spec.onemsg
+            self.one_close = '</' + onemsg + '>'
+            self.one_open[e.getAttr('name')] = '<' + onemsg + _attrs(e, ('name',)) + ('' if self.blob else '>')
+
+    def _elements(self, r, values):
+        one_open = self.one_open
+        one_close = self.one_close
+        if self.blob:
+            for e, text in values:
+                r.append(one_open[e.getAttr('name')] + _attrs(e, ('size', 'format')) + '>' + _text_escape(text) + one_close)
+        else:
+            for e, text in values:
+                r.append(one_open[e.getAttr('name')] + _text_escape(text) + one_close)
+
+    def setMessage(self, vector, message = None):
+        r = [self.set_head + _attrs(vector, ('state', 'timeout', 'timestamp')) + _message_attr(message)]
+        if vector.elements:
+            r.append('>')
+            self._elements(r, [(e, e.getValue()) for e in vector.elements])
+            r.append(self.set_tail)
+        else:
+            r.append('/>')
+        return ''.join(r).encode('ascii', 'xmlcharrefreplace')
+
+    def newMessage(self, vector, values, message = None):
+        r = [self.new_head + ' timestamp="' + indi_timestamp() + '"' + _message_attr(message)]
+        if values:
+            r.append('>')
+            self._elements(r, values)
+            r.append(self.new_tail)
+        else:
+            r.append('/>')
+        return ''.join(r).encode('ascii', 'xmlcharrefreplace')
+
+    def defineMessage(self, vector, message = None):
+        definemsg = vector.spec.definemsg
+        r = ['<' + definemsg + _attrs(vector, ('device', 'name', 'label', 'group', 'state', 'perm', 'rule', 'timeout', 'timestamp')) + _message_attr(message)]
+        if vector.elements:
+            r.append('>')
+            if vector.spec.itype == 'Number':
+                alist = ('name', 'label', 'format', 'min', 'max', 'step')
+            else:
+                alist = ('name', 'label')
+            for e in vector.elements:
+                defmsg = e.spec.definemsg
+                if self.blob:
+                    r.append('<' + defmsg + _attrs(e, alist) + '/>')
+                else:
+                    r.append('<' + defmsg + _attrs(e, alist) + '>' + _text_escape(e.getValue()) + '</' + defmsg + '>')
+            r.append('</' + definemsg + '>')
+        else:
+            r.append('/>')
+        return ''.join(r).encode('ascii', 'xmlcharrefreplace')
+
+
+class BlobSink(object):
+    """Destination for streamed oneBLOB payloads.
+
+    open() is called with the device, vector name and oneBLOB attributes
+    and returns a writer; the writer gets the decoded data chunk by chunk
+    and close() returns the value stored in the element. The base class
+    discards the data. A raw sink gets the base64 text as received
+    instead of decoded data.
+    """
+    raw = False
+
+    def open(self, device, name, attrs):
+        return self
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        return None
+
+
+class FileBlobSink(BlobSink):
+    """Write each BLOB to a file, the element value is the path.
+
+    The template is formatted with device, name, element, format
+    and n (a running counter).
+    """
+    def __init__(self, template):
+        self.template = template
+        self.cnt = 0
+
+    def open(self, device, name, attrs):
+        self.cnt += 1
+        path = self.template.format(device=device, name=name, element=attrs.get('name'),
+                                    format=attrs.get('format', ''), n=self.cnt)
+        return _FileBlobWriter(path)
+
+
+class _FileBlobWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'wb')
+
+    def write(self, data):
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+        return self.path
+
+
+class BufferBlobSink(BlobSink):
+    """Decode into a preallocated bytearray, the element value is a memoryview.
+
+    The buffer is reused for every BLOB, so the view is valid only until
+    the next one arrives. It is replaced by a bigger one if a BLOB does
+    not fit.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def open(self, device, name, attrs):
+        self.pos = 0
+        return self
+
+    def write(self, data):
+        end = self.pos + len(data)
+        if end > len(self.buf):
+            buf = bytearray(max(end, len(self.buf) * 2))
+            buf[:self.pos] = self.buf[:self.pos]
+            self.buf = buf
+        self.buf[self.pos:end] = data
+        self.pos = end
+
+    def close(self):
+        return memoryview(self.buf)[:self.pos]
+
+
+class CallbackBlobSink(BlobSink):
+    """Pass decoded chunks to callback(device, name, attrs, data).
+
+    The final call has data None, its return value is the element value.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def open(self, device, name, attrs):
+        return _CallbackBlobWriter(self.callback, device, name, attrs)
+
+
+class _CallbackBlobWriter(object):
+    def __init__(self, callback, device, name, attrs):
+        self.callback = callback
+        self.device = device
+        self.name = name
+        self.attrs = attrs
+
+    def write(self, data):
+        self.callback(self.device, self.name, self.attrs, data)
+
+    def close(self):
+        return self.callback(self.device, self.name, self.attrs, None)
+
+
+class SubscriptionFilter(object):
+    """Devices and properties of interest as fnmatch patterns.
+
+    An empty filter matches everything; results are cached per
+    (device, name).
+    """
+    def __init__(self):
+        self.patterns = []
+        self.cache = {}
+
+    def add(self, device='*', name='*'):
+        self.patterns.append((device, name))
+        self.cache.clear()
+
+    def match(self, device, name):
+        key = (device, name)
+        r = self.cache.get(key)
+        if r is None:
+            r = not self.patterns or any(fnmatch.fnmatchcase(device, d) and (name is None or fnmatch.fnmatchcase(name, n))
+                                         for d, n in self.patterns)
+            self.cache[key] = r
+        return r
+
+
+class INDIStreamParser(object):
+    """Incremental parser for a stream of top-level INDI messages.
+
+    Data is fed as it arrives; each complete message is returned as soon
+    as its closing tag is seen, parser state is kept between reads.
+
+    With blob_sink set, the base64 text of oneBLOB elements in a bytes
+    stream never reaches lxml: it is decoded as it arrives and written to
+    the sink. The payloads of a returned message are in blobs[msg], keyed
+    by element name.
+
+    accept(tag, device, name) is called when the start tag of a message
+    is read; rejected messages are dropped and their BLOBs not decoded.
+    In a bytes stream they are skipped before reaching lxml.
+    """
+    BLOB_TAG = b'<oneBLOB'
+    START_TAG = re.compile(rb'<([A-Za-z_][\w.:-]*)((?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>')
+    ATTR = re.compile(rb'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+    # longest start tag waited for before giving it to lxml as it is
+    MAX_START_TAG = 1 << 20
+
+    def __init__(self, blob_sink=None, accept=None):
+        self.blob_sink = blob_sink
+        self.accept = accept
+        self.skipped = 0
+        self.blobs = {}
+        self.reset()
+
+    def reset(self):
+        self.parser = etree.XMLPullParser(events=('start', 'end'), huge_tree=True)
+        self.started = False
+        self.msgs = []
+        self.pending = b''
+        self.vector = None
+        self.skip = False
+        self.check_start = False
+        self.frame_end = None
+        self.frame_skip = False
+        self.frame_pending = b''
+        self.blob_elem = None
+        self.blob_writer = None
+        self.blob_tail = b''
+        self.blob_payloads = {}
+
+    def feed(self, data):
+        if not self.started:
+            self.parser.feed(b'<msg>' if isinstance(data, bytes) else '<msg>')
+            self.started = True
+
+        try:
+            self.check_start = self.accept is not None and not isinstance(data, bytes)
+            if self.accept is not None and isinstance(data, bytes):
+                data = self._filter(data)
+            if self.blob_sink is not None and isinstance(data, bytes):
+                self._feedBlob(data)
+            else:
+                self._feedXml(data)
+        except etree.XMLSyntaxError:
+            log.exception('stream parser')
+            if self.blob_writer is not None:
+                self.blob_writer.close()
+            msgs = self.msgs
+            self.reset()
+            return msgs
+
+        msgs = self.msgs
+        self.msgs = []
+        return msgs
+
+    def _feedXml(self, data):
+        if not data:
+            return
+        self.parser.feed(data)
+        for event, elem in self.parser.read_events():
+            parent = elem.getparent()
+            if parent is None or parent.getparent() is not None:
+                if event == 'start' and elem.tag == 'oneBLOB':
+                    self.blob_elem = elem
+                continue
+
+            if event == 'start':
+                self.vector = elem
+                self.skip = self.check_start and not self.accept(elem.tag, elem.get('device'), elem.get('name'))
+                continue
+
+            parent.remove(elem)
+            if self.skip:
+                self.skipped += 1
+                self.blob_payloads = {}
+                continue
+            self.msgs.append(elem)
+            if self.blob_payloads:
+                self.blobs[elem] = self.blob_payloads
+                self.blob_payloads = {}
+
+    def _filter(self, data):
+        """Drop the top-level messages rejected by accept from data."""
+        data = self.frame_pending + data
+        self.frame_pending = b''
+        out = []
+        pos = 0
+        n = len(data)
+        while pos < n:
+            if self.frame_end is not None:
+                i = data.find(self.frame_end, pos)
+                j = data.find(b'>', i + len(self.frame_end)) if i >= 0 else -1
+                if j < 0:
+                    # keep what may be the start of the end tag
+                    keep = i if i >= 0 else max(pos, n - len(self.frame_end) + 1)
+                    if not self.frame_skip:
+                        out.append(data[pos:keep])
+                    self.frame_pending = data[keep:]
+                    break
+                if not self.frame_skip:
+                    out.append(data[pos:j + 1])
+                self.frame_end = None
+                pos = j + 1
+                continue
+
+            i = data.find(b'<', pos)
+            if i < 0:
+                out.append(data[pos:])
+                break
+            out.append(data[pos:i])
+            if n - i < 2:
+                self.frame_pending = data[i:]
+                break
+            if not data[i + 1:i + 2].isalpha():
+                # comment, processing instruction, ...
+                j = data.find(b'>', i)
+                if j < 0:
+                    self.frame_pending = data[i:]
+                    break
+                out.append(data[i:j + 1])
+                pos = j + 1
+                continue
+            m = self.START_TAG.match(data, i)
+            if m is None:
+                if n - i < self.MAX_START_TAG:
+                    self.frame_pending = data[i:]
+                    break
+                # not a valid start tag, let lxml report it
+                out.append(data[i:])
+                break
+
+            attrs = {}
+            for a in self.ATTR.finditer(m.group(2)):
+                if a.group(1) in (b'device', b'name'):
+                    value = a.group(2) if a.group(2) is not None else a.group(3)
+                    attrs[a.group(1)] = html.unescape(value.decode(errors='replace'))
+            tag = m.group(1)
+            accepted = self.accept(tag.decode(), attrs.get(b'device'), attrs.get(b'name'))
+            if not accepted:
+                self.skipped += 1
+            if m.group(3):
+                if accepted:
+                    out.append(data[i:m.end()])
+            else:
+                self.frame_end = b'</' + tag
+                self.frame_skip = not accepted
+                if accepted:
+                    out.append(data[i:m.end()])
+            pos = m.end()
+        return b''.join(out)
+
+    def _feedBlob(self, data):
+        data = self.pending + data
+        self.pending = b''
+        while data:
+            if self.blob_writer is not None:
+                i = data.find(b'<')
+                if i < 0:
+                    self._decodeBlob(data)
+                    return
+                self._decodeBlob(data[:i])
+                self._closeBlob()
+                data = data[i:]
+                continue
+
+            i = data.find(self.BLOB_TAG)
+            if i < 0:
+                keep = 0
+                for k in range(min(len(self.BLOB_TAG) - 1, len(data)), 0, -1):
+                    if data.endswith(self.BLOB_TAG[:k]):
+                        keep = k
+                        break
+                self._feedXml(data[:len(data) - keep])
+                self.pending = data[len(data) - keep:]
+                return
+
+            j = data.find(b'>', i)
+            if j < 0:
+                self._feedXml(data[:i])
+                self.pending = data[i:]
+                return
+
+            self._feedXml(data[:j + 1])
+            if data[j - 1:j] != b'/':
+                self._openBlob()
+            data = data[j + 1:]
+
+    def _openBlob(self):
+        if self.skip:
+            self.blob_writer = BlobSink()
+            return
+        attrs = dict(self.blob_elem.items())
+        try:
+            self.blob_writer = self.blob_sink.open(self.vector.get('device'), self.vector.get('name'), attrs)
+        except Exception:
+            log.exception('blob sink open')
+            self.blob_writer = BlobSink()
+        self.blob_tail = b''
+
+    def _decodeBlob(self, data):
+        if self.skip:
+            return
+        if getattr(self.blob_sink, 'raw', False):
+            self.blob_writer.write(data)
+            return
+        data = self.blob_tail + data.translate(None, b' \t\r\n')
+        n = len(data) & ~3
+        if n:
+            self.blob_writer.write(binascii.a2b_base64(data[:n]))
+        self.blob_tail = data[n:]
+
+    def _closeBlob(self):
+        try:
+            if self.blob_tail:
+                log.error('blob: truncated base64 data')
+            self.blob_payloads[self.blob_elem.get('name')] = self.blob_writer.close()
+        except Exception:
+            log.exception('blob sink close')
+        self.blob_writer = None
+        self.blob_tail = b''
+
+
 def getProperties(device=None, name=None):
     if device is not None and name is not None:
         return "<getProperties version='1.7' device='{}' name='{}'/>".format(device, name).encode()
@@ -472,10 +1325,10 @@ def message(device, text):
     if device is not None:
         tree = etree.Element('message', attrib={
             'device': device,
-            'timestamp': datetime.datetime.utcnow().replace(microsecond=0).isoformat(),
+            'timestamp': indi_timestamp(),
             'message': text})
     else:
         tree = etree.Element('message', attrib={
-            'timestamp': datetime.datetime.utcnow().replace(microsecond=0).isoformat(),
+            'timestamp': indi_timestamp(),
             'message': text})
     return etree.tostring(tree)
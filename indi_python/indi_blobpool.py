@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+BLOB decoding on a process pool.
+
+    loop.enableBlobPool(workers=2, images=True)
+
+The pool is the loop's blob sink in raw mode: the parser copies the
+base64 text of each oneBLOB into a shared memory block as it arrives,
+without decoding it. When the element is complete a worker process
+decodes it, inflates .z formats and with images=True parses FITS into
+a NumPy array, writing the result into a second shared memory block,
+so no multi-MB buffer is pickled. The element value is then bytes, or
+the image array.
+
+The workers are forked when the pool is enabled, so enable it before
+starting threads (enableExecutor, PropWaiters users).
+
+A message waits until its BLOBs are decoded; later messages of the
+same device wait behind it, so handlers see them in order while other
+devices go on.
+"""
+
+import os
+import mmap
+import socket
+import binascii
+import zlib
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import indi_python.indi_base as indi
+
+import logging
+log = logging.getLogger()
+
+
+FITS_BLOCK = 2880
+
+FITS_TYPES = { 8: '>u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8' }
+
+
+def parse_fits(data):
+    """Primary HDU of a FITS file as (header dict, array), native byte
+    order; signed data with the usual BZERO offset becomes unsigned."""
+    header = {}
+    pos = 0
+    while True:
+        block = bytes(data[pos:pos + FITS_BLOCK])
+        if len(block) < FITS_BLOCK:
+            raise ValueError('truncated FITS header')
+        pos += FITS_BLOCK
+        end = False
+        for i in range(0, FITS_BLOCK, 80):
+            card = block[i:i + 80].decode('ascii', 'replace')
+            key = card[:8].strip()
+            if key == 'END':
+                end = True
+                break
+            if card[8:10] != '= ':
+                continue
+            value = card[10:].split('/')[0].strip()
+            if value.startswith("'"):
+                value = card[10:].strip()[1:].split("'")[0].strip()
+            else:
+                try:
+                    value = int(value)
+                except ValueError:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+            header[key] = value
+        if end:
+            break
+
+    bitpix = header['BITPIX']
+    shape = tuple(header.get('NAXIS{}'.format(i), 0) for i in range(header.get('NAXIS', 0), 0, -1))
+    count = int(np.prod(shape)) if shape else 0
+    a = np.frombuffer(data, dtype=FITS_TYPES[bitpix], count=count, offset=pos).reshape(shape)
+    bzero = header.get('BZERO', 0)
+    bscale = header.get('BSCALE', 1)
+    if bscale == 1 and bitpix > 8 and bzero == 2 ** (bitpix - 1):
+        # flip the sign bit instead of adding BZERO
+        a = a.astype(a.dtype.newbyteorder('=')).view('u{}'.format(bitpix // 8))
+        a ^= np.array(1 << (bitpix - 1), dtype=a.dtype)
+    elif bscale != 1 or bzero != 0:
+        a = a.astype(np.float32) * bscale + bzero
+    else:
+        a = a.astype(a.dtype.newbyteorder('='))
+    return header, a
+
+
+def _attach(name):
+    """Map a shared memory block in a worker. Not SharedMemory(name),
+    which would register the block with the resource tracker a second
+    time, racing with the unlink in the loop process."""
+    fd = os.open('/dev/shm/' + name, os.O_RDWR)
+    try:
+        return mmap.mmap(fd, 0)
+    finally:
+        os.close(fd)
+
+
+def _decode(in_name, in_len, out_name, out_size, fmt, images):
+    """Worker: decode the base64 in in_name into out_name, returns
+    ('bytes', n, fmt), ('array', dtype, shape, fmt) or ('inline', value,
+    fmt) when the result does not fit; fmt is the format of the result,
+    without .z when inflated."""
+    with _attach(in_name) as mm:
+        buf = memoryview(mm)
+        data = binascii.a2b_base64(buf[:in_len])
+        buf.release()
+    if fmt.endswith('.z'):
+        data = zlib.decompress(data)
+        fmt = fmt[:-2]
+    if images and fmt in ('.fits', '.fit', '.fts'):
+        header, value = parse_fits(data)
+        value = np.ascontiguousarray(value)
+        nbytes = value.nbytes
+    else:
+        value = data
+        nbytes = len(data)
+    if nbytes > out_size:
+        return ('inline', value, fmt)
+
+    with _attach(out_name) as mm:
+        if isinstance(value, np.ndarray):
+            out = np.frombuffer(mm, dtype=value.dtype, count=value.size).reshape(value.shape)
+            out[...] = value
+            del out
+            return ('array', value.dtype.str, value.shape, fmt)
+        mm[:nbytes] = value
+        return ('bytes', nbytes, fmt)
+
+
+def _release(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except (OSError, BufferError):
+        log.exception('shared memory %s', shm.name)
+
+
+class PendingBlob(object):
+    """Payload being decoded by a worker."""
+    __slots__ = ('pool', 'future', 'shm_in', 'shm_out', 'value', 'format', 'resolved')
+
+    def __init__(self, pool, future, shm_in, shm_out):
+        self.pool = pool
+        self.future = future
+        self.shm_in = shm_in
+        self.shm_out = shm_out
+        self.value = None
+        # of the decoded value, set by result()
+        self.format = None
+        self.resolved = False
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        """The decoded value, None if decoding failed. Waits for the
+        worker if not done."""
+        if self.resolved:
+            return self.value
+        self.resolved = True
+        try:
+            r = self.future.result()
+            if r[0] == 'bytes':
+                self.value = bytes(self.shm_out.buf[:r[1]])
+            elif r[0] == 'array':
+                dtype = np.dtype(r[1])
+                count = int(np.prod(r[2]))
+                self.value = np.frombuffer(self.shm_out.buf, dtype=dtype, count=count).reshape(r[2]).copy()
+            else:
+                self.value = r[1]
+            self.format = r[-1]
+        except Exception:
+            log.exception('blob decode')
+        finally:
+            self.pool.recycle(self.shm_in)
+            self.pool.recycle(self.shm_out)
+        return self.value
+
+
+class _ShmBlobWriter(object):
+    """Collects the base64 text of one BLOB in shared memory."""
+
+    def __init__(self, pool, attrs):
+        self.pool = pool
+        self.format = attrs.get('format', '')
+        try:
+            self.size = int(attrs.get('size', 0))
+        except ValueError:
+            self.size = 0
+        # base64 with a line break every 76 characters
+        self.shm = pool.acquire(self.size * 4 // 3 * 77 // 76 + 8)
+        self.pos = 0
+
+    def write(self, data):
+        end = self.pos + len(data)
+        if end > self.shm.size:
+            shm = self.pool.acquire(max(end, self.shm.size * 2))
+            shm.buf[:self.pos] = self.shm.buf[:self.pos]
+            self.pool.recycle(self.shm)
+            self.shm = shm
+        self.shm.buf[self.pos:end] = data
+        self.pos = end
+
+    def close(self):
+        return self.pool.submit(self.shm, self.pos, self.format, self.size)
+
+
+class BlobPool(indi.BlobSink):
+    """Raw mode blob sink decoding on a process pool."""
+
+    # the parser passes the base64 text, see INDIStreamParser
+    raw = True
+
+    def __init__(self, workers=2, images=False):
+        self.images = images
+        # fork all workers now, before the loop starts threads; spawn
+        # would re-run driver scripts without a __main__ guard
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        self.executor.submit(int).result()
+        # written when a result arrives, the loop selects on wakeup
+        self.wakeup, self.wakeup_w = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.submitted = 0
+        # released blocks kept for reuse, mapped pages need no faults
+        self.free = []
+        self.max_free = 4 * workers
+
+    def acquire(self, size):
+        size = max(size, 4096)
+        fits = [shm for shm in self.free if shm.size >= size]
+        if fits:
+            shm = min(fits, key=lambda shm: shm.size)
+            self.free.remove(shm)
+            return shm
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def recycle(self, shm):
+        self.free.append(shm)
+        if len(self.free) > self.max_free:
+            smallest = min(self.free, key=lambda shm: shm.size)
+            self.free.remove(smallest)
+            _release(smallest)
+
+    def open(self, device, name, attrs):
+        return _ShmBlobWriter(self, attrs)
+
+    def submit(self, shm_in, length, fmt, size):
+        shm_out = self.acquire(max(length * 3 // 4, size))
+        future = self.executor.submit(_decode, shm_in.name, length, shm_out.name, shm_out.size, fmt, self.images)
+        future.add_done_callback(self._done)
+        self.submitted += 1
+        return PendingBlob(self, future, shm_in, shm_out)
+
+    def _done(self, future):
+        try:
+            self.wakeup_w.send(b'\0')
+        except BlockingIOError:
+            # already woken
+            pass
+
+    def drainWakeup(self):
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for shm in self.free:
+            _release(shm)
+        self.free = []
+        self.wakeup.close()
+        self.wakeup_w.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+BLOB compression off the loop thread.
+
+zlib releases the GIL while compressing, so chunks of one BLOB are
+compressed in parallel on a thread pool. Like pigz, each chunk is raw
+deflate primed with the last 32 KiB of the previous chunk and ended
+with a sync flush; the chunks concatenated with a zlib header and the
+Adler-32 of the whole input make one ordinary zlib stream, so readers
+inflate it with zlib.decompress.
+
+    compressor = BlobCompressor(level=1)
+    future = loop.sendBlob('CCD Simulator', 'CCD1', { 'CCD1': frame }, compressor)
+"""
+
+import zlib
+import base64
+import concurrent.futures
+
+import logging
+log = logging.getLogger()
+
+
+WINDOW = 32 * 1024
+
+
+def _deflate(data, start, end, level, last):
+    c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=data[max(start - WINDOW, 0):start] if start else b'')
+    out = c.compress(data[start:end])
+    return out + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _header(level):
+    # FLEVEL only informs, FCHECK makes the header a multiple of 31
+    if level == -1:
+        level = 6
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf = 0x78
+    flg = flevel << 6
+    flg += 31 - ((cmf << 8) + flg) % 31
+    return bytes((cmf, flg))
+
+
+class BlobCompressor(object):
+    """zlib (.z) compression of BLOBs in chunks on worker threads."""
+
+    codec = '.z'
+
+    def __init__(self, level=1, chunk=1024 * 1024, workers=None):
+        self.level = level
+        self.chunk = chunk
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='indi-compress')
+        # one thread for whole BLOBs: they are sent in order, and the
+        # chunk workers are never all waiting for chunks
+        self.sender = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='indi-blob-send')
+
+    def compress(self, data):
+        """zlib stream of data, chunks compressed in parallel. Blocks the
+        calling thread, call it from a worker (see submit)."""
+        data = memoryview(data).cast('B')
+        n = len(data)
+        if n <= self.chunk:
+            return zlib.compress(data, self.level)
+        starts = range(0, n, self.chunk)
+        futures = [self.executor.submit(_deflate, data, s, min(s + self.chunk, n), self.level, s + self.chunk >= n)
+                   for s in starts]
+        adler = zlib.adler32(data)
+        return b''.join([_header(self.level)] + [f.result() for f in futures] + [adler.to_bytes(4, 'big')])
+
+    def submit(self, func, *args):
+        """Run func(*args) on the sender thread."""
+        return self.sender.submit(func, *args)
+
+    def close(self):
+        self.sender.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+
+def compress_values(compressor, values):
+    """Compress values {element: bytes}, returns {element: (compressed,
+    base64 text)} for INDIElement.setCompressed."""
+    ret = {}
+    for name, v in values.items():
+        data = compressor.compress(v)
+        ret[name] = (data, base64.b64encode(data).decode('ascii'))
+    return ret
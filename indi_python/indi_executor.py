@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Thread pool for snoop and new value handlers.
+
+    executor = loop.enableExecutor(workers=4, max_queue=100, policy='coalesce')
+
+Handlers of one device (or one property with order='property') run one
+at a time in submission order; handlers of different devices run in
+parallel. Each device has a queue of at most max_queue handler calls;
+when it is full, submit
+
+    block         waits until a worker takes a call
+    drop_oldest   drops the oldest queued call
+    coalesce      drops the queued call of the same handler and
+                  property, else the oldest
+
+Handlers get the message of their update and the vector, whose values
+may already be newer when the handler runs. With block, a handler that
+waits for the loop thread (sendClientMessageWait) can stall until its
+timeout while the loop waits for queue space.
+"""
+
+import time
+import threading
+import collections
+
+import logging
+log = logging.getLogger()
+
+
+POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+
+class HandlerExecutor(object):
+
+    def __init__(self, workers=4, max_queue=100, policy='block', order='device'):
+        if policy not in POLICIES:
+            raise ValueError('unknown overload policy ' + policy)
+        if order not in ('device', 'property'):
+            raise ValueError('order is device or property')
+        self.max_queue = max_queue
+        self.policy = policy
+        self.order = order
+        self.cond = threading.Condition()
+        # key -> deque of (call, (handler, name), submit time)
+        self.queues = {}
+        # keys with queued calls and no worker running them
+        self.ready = collections.deque()
+        self.running = set()
+        self.closed = False
+        self.submitted = 0
+        self.executed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+        self.threads = [threading.Thread(target=self._worker, name='indi-handler-{}'.format(i), daemon=True)
+                        for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, device, name, call, handler=None):
+        """Queue call() for the property; calls of the same handler
+        (default call) and property may be coalesced."""
+        key = device if self.order == 'device' else (device, name)
+        task = (call, (handler or call, name), time.time())
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('executor is closed')
+            q = self.queues.setdefault(key, collections.deque())
+            if len(q) >= self.max_queue:
+                self._overload(key, q, task)
+                # a worker may have emptied and removed the queue meanwhile
+                q = self.queues.setdefault(key, collections.deque())
+            q.append(task)
+            self.submitted += 1
+            if len(q) > self.max_depth:
+                self.max_depth = len(q)
+            if key not in self.running and key not in self.ready:
+                self.ready.append(key)
+                self.cond.notify_all()
+
+    def _overload(self, key, q, task):
+        if self.policy == 'block':
+            self.blocked += 1
+            while len(self.queues.get(key, ())) >= self.max_queue and not self.closed:
+                self.cond.wait()
+            return
+        if self.policy == 'coalesce':
+            for i, queued in enumerate(q):
+                if queued[1] == task[1]:
+                    del q[i]
+                    self.coalesced += 1
+                    return
+        q.popleft()
+        self.dropped += 1
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready and not self.closed:
+                    self.cond.wait()
+                if not self.ready:
+                    return
+                key = self.ready.popleft()
+                q = self.queues[key]
+                call, ckey, submitted = q.popleft()
+                self.running.add(key)
+                # a blocked submit may go on
+                self.cond.notify_all()
+
+            wait = time.time() - submitted
+            try:
+                call()
+            except Exception:
+                log.exception('handler %s', ckey[0])
+
+            with self.cond:
+                self.executed += 1
+                if wait > self.max_wait:
+                    self.max_wait = wait
+                self.running.discard(key)
+                if q:
+                    self.ready.append(key)
+                    self.cond.notify_all()
+                elif self.queues.get(key) is q:
+                    del self.queues[key]
+                    self.cond.notify_all()
+
+    def depth(self):
+        """Queued calls per device (or property)."""
+        with self.cond:
+            return { key: len(q) for key, q in self.queues.items() if q }
+
+    def join(self, timeout=None):
+        """Wait until all queued calls are done, return False on timeout."""
+        end = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.queues or self.running:
+                wait = None if end is None else end - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self.cond.wait(wait)
+        return True
+
+    def close(self, wait=True):
+        if wait:
+            self.join()
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+
+    def stats(self):
+        with self.cond:
+            return { 'submitted': self.submitted, 'executed': self.executed, 'dropped': self.dropped,
+                     'coalesced': self.coalesced, 'blocked': self.blocked, 'queued': sum(len(q) for q in self.queues.values()),
+                     'max_depth': self.max_depth, 'max_wait': self.max_wait }
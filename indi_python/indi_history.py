@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+History of Number vectors in preallocated NumPy ring buffers.
+
+Each tracked vector gets a buffer of (time, values) rows; an update
+copies the vector value array into the next row, so no Python object
+per element and sample is created. Queries return NumPy arrays in time
+order.
+
+    history = HistoryStore(max_bytes=32 * 1024 * 1024)
+    history.attach(driver, 'Power Switch', 'SENSORS')
+    ...
+    h = history.get('Power Switch', 'SENSORS')
+    t, v = h.range(time.time() - 600, element='V_SUPPLY')
+    drop_per_hour = h.slope('V_SUPPLY', time.time() - 3600) * 3600
+"""
+
+import numpy as np
+
+import indi_python.indi_base as indi
+
+import logging
+log = logging.getLogger()
+
+
+class NumberHistory(object):
+    """Ring buffer of one Number vector."""
+
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.index = { n: i for i, n in enumerate(self.names) }
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, len(self.names)))
+        self.pos = 0
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.values.nbytes
+
+    def append(self, t, row):
+        # rows stay in time order for the searchsorted queries
+        if self.count and t < self.times[self.pos - 1]:
+            t = self.times[self.pos - 1]
+        i = self.pos
+        self.times[i] = t
+        self.values[i] = row
+        self.pos = i + 1 if i + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _column(self, element):
+        if element is None:
+            return slice(None)
+        return self.index[element]
+
+    def series(self, element=None):
+        """(times, values) of all stored samples, oldest first; values has
+        one column per element unless element is given."""
+        col = self._column(element)
+        if self.count < self.capacity:
+            return self.times[:self.count].copy(), self.values[:self.count, col].copy()
+        order = np.r_[self.pos:self.capacity, 0:self.pos]
+        return self.times[order], self.values[order, col]
+
+    def range(self, t0=None, t1=None, element=None):
+        """Samples with t0 <= time < t1."""
+        times, values = self.series(element)
+        lo = 0 if t0 is None else np.searchsorted(times, t0, 'left')
+        hi = len(times) if t1 is None else np.searchsorted(times, t1, 'left')
+        return times[lo:hi], values[lo:hi]
+
+    def downsample(self, bucket, t0=None, t1=None, element=None, how='mean'):
+        """Aggregate samples into buckets of bucket seconds, returns the
+        bucket start times and the mean, min or max per bucket."""
+        times, values = self.range(t0, t1, element)
+        if len(times) == 0:
+            return times, values
+        origin = times[0] if t0 is None else t0
+        idx = np.floor((times - origin) / bucket).astype(np.int64)
+        starts = np.r_[0, np.flatnonzero(np.diff(idx)) + 1]
+        if how == 'mean':
+            agg = np.add.reduceat(values, starts, axis=0)
+            counts = np.diff(np.r_[starts, len(times)])
+            agg = agg / (counts if agg.ndim == 1 else counts[:, None])
+        elif how == 'min':
+            agg = np.minimum.reduceat(values, starts, axis=0)
+        elif how == 'max':
+            agg = np.maximum.reduceat(values, starts, axis=0)
+        else:
+            raise ValueError('unknown aggregation ' + how)
+        return origin + idx[starts] * bucket, agg
+
+    def rolling(self, window, element, how='mean', t0=None, t1=None):
+        """Rolling mean, min or max over window samples of one element,
+        returns the times of the last sample of each window and the values."""
+        times, values = self.range(t0, t1, element)
+        if len(values) < window:
+            return times[:0], values[:0]
+        if how == 'mean':
+            c = np.cumsum(np.r_[0.0, values])
+            agg = (c[window:] - c[:-window]) / window
+        else:
+            windows = np.lib.stride_tricks.sliding_window_view(values, window)
+            if how == 'min':
+                agg = windows.min(axis=-1)
+            elif how == 'max':
+                agg = windows.max(axis=-1)
+            else:
+                raise ValueError('unknown aggregation ' + how)
+        return times[window - 1:], agg
+
+    def slope(self, element, t0=None, t1=None):
+        """Least squares rate of change per second, nan with less than two
+        samples."""
+        times, values = self.range(t0, t1, element)
+        if len(times) < 2:
+            return float('nan')
+        t = times - times.mean()
+        d = (t * t).sum()
+        if d == 0:
+            return float('nan')
+        return float((t * (values - values.mean())).sum() / d)
+
+
+class HistoryStore(object):
+    """Ring buffers of tracked Number vectors, all together at most
+    max_bytes; a vector that does not fit gets a shorter buffer."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, capacity=10000):
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self.histories = {}
+
+    @property
+    def used_bytes(self):
+        return sum(h.nbytes for h in self.histories.values())
+
+    def track(self, prop, capacity=None):
+        if prop.itype != 'Number':
+            raise TypeError('history is kept only for Number vectors')
+        if prop.history is not None:
+            return prop.history
+        key = (prop.getAttr('device'), prop.getAttr('name'))
+        self.release(key)
+
+        if capacity is None:
+            capacity = self.capacity
+        names = [e.getAttr('name') for e in prop.elements]
+        row_bytes = 8 * (len(names) + 1)
+        capacity = min(capacity, (self.max_bytes - self.used_bytes) // row_bytes)
+        if capacity < 2:
+            log.error('history memory cap reached, not tracking %s %s', *key)
+            return None
+
+        h = NumberHistory(names, capacity)
+        h.append(indi.indi_timestamp_seconds(prop.getAttr('timestamp')), prop.array)
+        self.histories[key] = h
+        prop.history = h
+        return h
+
+    def release(self, key):
+        self.histories.pop(key, None)
+
+    def get(self, device, name):
+        return self.histories.get((device, name))
+
+    def attach(self, loop, device='*', name='*', capacity=None):
+        """Track the Number vectors of loop matching device/name ('*' for
+        any), including those defined later; the buffers of deleted
+        vectors are released."""
+        def defined(msg, prop):
+            if prop.itype == 'Number':
+                self.track(prop, capacity)
+
+        def deleted(msg, prop):
+            d = msg.get('device')
+            n = msg.get('name')
+            for key in list(self.histories):
+                if key[0] == d and (not n or key[1] == n):
+                    self.release(key)
+
+        loop.define_handlers.add(device, name, defined)
+        # a delProperty of a whole device has no name
+        loop.delete_handlers.add(device, '*', deleted)
+        for d, props in loop.properties.items():
+            if device not in ('*', d):
+                continue
+            for n, prop in props.items():
+                if name in ('*', n):
+                    defined(None, prop)
@@ -5,26 +5,256 @@ A basic INDI driver.
 """
 
 import socket
+import errno
 import sys
 import time
 import os
 import fcntl
+import stat
 import datetime
 import select
 from lxml import etree
 import threading
 import collections
+import itertools
+import heapq
+import functools
+import concurrent.futures
 
 import indi_python.indi_base as indi
+from indi_python.indi_record import CLIENT_IN, DRIVER_IN, CLIENT_OUT, DRIVER_OUT, BLOB_IN, BLOB_OUT
+import indi_python.indi_stats as indi_stats
+import indi_python.indi_executor as indi_executor
+import indi_python.indi_blobpool as indi_blobpool
+import indi_python.indi_compress as indi_compress
 
 import logging
 logging.basicConfig(format="%(filename)s:%(lineno)d: %(message)s", level=logging.INFO)
 log = logging.getLogger()
 
 
+class PropWaiter(object):
+    __slots__ = ('key', 'predicate', 'event')
+
+    def __init__(self, key, predicate):
+        self.key = key
+        self.predicate = predicate
+        self.event = threading.Event()
+
+
+class PropWaiters(object):
+    """Threads waiting for a property, keyed by (device, name).
+
+    notify() wakes only the waiters of the given property whose
+    predicate holds for the new state, others keep sleeping.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = {}
+
+    def add(self, device, name, predicate=None):
+        w = PropWaiter((device, name), predicate)
+        with self.lock:
+            self.waiters.setdefault(w.key, []).append(w)
+        return w
+
+    def remove(self, w):
+        with self.lock:
+            waiters = self.waiters.get(w.key)
+            if waiters is not None and w in waiters:
+                waiters.remove(w)
+                if not waiters:
+                    del self.waiters[w.key]
+
+    def notify(self, device, name, prop):
+        waiters = self.waiters.get((device, name))
+        if not waiters:
+            return
+        with self.lock:
+            for w in waiters:
+                if w.event.is_set():
+                    continue
+                try:
+                    if w.predicate is None or w.predicate(prop):
+                        w.event.set()
+                except Exception:
+                    log.exception('waiter predicate')
+                    w.event.set()
+
+
+class HandlerRegistry(object):
+    """Message handlers keyed by (device, name), '*' matches any device
+    or name. A handler registered with element is called only for
+    messages containing that element.
+
+    The handlers of a property are collected once and cached, so finding
+    them is one dict lookup however many are registered.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.cache = {}
+        self.seq = itertools.count()
+        # LoopStats recording handler durations
+        self.stats = None
+        # HandlerExecutor running the handlers
+        self.executor = None
+
+    def add(self, device, name, func, element=None):
+        self.handlers.setdefault((device, name), []).append((next(self.seq), element, func))
+        self.cache.clear()
+
+    def remove(self, device, name, func):
+        handlers = self.handlers.get((device, name), [])
+        handlers[:] = [h for h in handlers if h[2] != func]
+        self.cache.clear()
+
+    def lookup(self, device, name):
+        try:
+            return self.cache[(device, name)]
+        except KeyError:
+            pass
+        found = []
+        for key in set(((device, name), (device, '*'), ('*', name), ('*', '*'))):
+            found.extend(self.handlers.get(key, ()))
+        found.sort(key=lambda h: h[0])
+        found = [(element, func) for seq, element, func in found]
+        self.cache[(device, name)] = found
+        return found
+
+    def match(self, device, name, msg):
+        """Handlers to call for msg, in registration order."""
+        found = self.lookup(device, name)
+        if not found:
+            return ()
+        elements = None
+        funcs = []
+        for element, func in found:
+            if element is not None:
+                if elements is None:
+                    elements = set(child.get('name') for child in msg)
+                if element not in elements:
+                    continue
+            funcs.append(func)
+        return funcs
+
+    def dispatch(self, device, name, msg, prop):
+        """Call the matching handlers with (msg, prop), or submit them to
+        the executor, return their count."""
+        funcs = self.match(device, name, msg)
+        executor = self.executor
+        for func in funcs:
+            if executor is not None:
+                executor.submit(device, name, functools.partial(self.call, func, msg, prop), func)
+            else:
+                self.call(func, msg, prop)
+        return len(funcs)
+
+    def call(self, func, msg, prop):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        try:
+            func(msg, prop)
+        except Exception:
+            log.exception('handler %s', func)
+        if stats is not None:
+            stats.observe('handler_seconds', getattr(func, '__qualname__', repr(func)), time.perf_counter() - t0)
+
+
+def nonblockingWritev(fd):
+    """(writev, fd to select on) writing to fd without blocking. The
+    flags of fd itself are left alone: O_NONBLOCK on stdout would make
+    print() and logging fail with BlockingIOError when the pipe is full.
+    """
+    mode = os.fstat(fd).st_mode
+    if stat.S_ISREG(mode):
+        return (lambda bufs: os.writev(fd, bufs)), fd
+    if stat.S_ISSOCK(mode):
+        sock = socket.socket(fileno=os.dup(fd))
+        return (lambda bufs: sock.sendmsg(bufs, (), socket.MSG_DONTWAIT)), sock.fileno()
+    # a pipe or tty opened again is a separate open file description
+    # with its own O_NONBLOCK
+    wfd = os.open('/proc/self/fd/{}'.format(fd), os.O_WRONLY | os.O_NONBLOCK)
+    return (lambda bufs: os.writev(wfd, bufs)), wfd
+
+
+class OutputQueue(object):
+    """Outgoing data of one transport.
+
+    Queued messages are written together with one non-blocking
+    scatter/gather write; what the transport does not accept stays
+    queued until select() reports it writable. When more than high_water
+    bytes are queued, the sender blocks until the queue drains below it;
+    with high_water None put never blocks.
+    """
+    IOV_MAX = 1024
+
+    def __init__(self, writev, fd, high_water = 16 * 1024 * 1024):
+        self.writev = writev
+        self.fd = fd
+        self.high_water = high_water
+        self.lock = threading.Lock()
+        self.chunks = collections.deque()
+        self.queued = 0
+        self.max_queued = 0
+        self.messages = 0
+        self.bytes_sent = 0
+        self.writes = 0
+
+    def fileno(self):
+        return self.fd
+
+    def put(self, msg, flush=True):
+        with self.lock:
+            self.chunks.append(msg)
+            self.queued += len(msg)
+            self.messages += 1
+            if self.queued > self.max_queued:
+                self.max_queued = self.queued
+        if flush:
+            self.flush()
+        if self.high_water is not None and self.queued > self.high_water:
+            self.flush(block=True)
+
+    def flush(self, block=False):
+        while True:
+            with self.lock:
+                if self._write():
+                    continue
+                if not self.chunks or not block or self.queued <= self.high_water:
+                    return
+            # wait without the lock, the loop thread may flush meanwhile
+            select.select([], [self], [])
+
+    def _write(self):
+        if not self.chunks:
+            return 0
+        bufs = list(itertools.islice(self.chunks, self.IOV_MAX))
+        try:
+            n = self.writev(bufs)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        self.writes += 1
+        self.bytes_sent += n
+        self.queued -= n
+        written = n
+        while n:
+            l = len(self.chunks[0])
+            if n < l:
+                self.chunks[0] = memoryview(self.chunks[0])[n:]
+                break
+            self.chunks.popleft()
+            n -= l
+        return written
+
+    def stats(self):
+        return { 'queued': self.queued, 'max_queued': self.max_queued, 'messages': self.messages,
+                 'bytes_sent': self.bytes_sent, 'writes': self.writes }
+
+
 class IndiLoop(object):
 
-    def __init__(self, client_addr = None, driver = False, client_port = 7624):
+    def __init__(self, client_addr = None, driver = False, client_port = 7624, output_high_water = 16 * 1024 * 1024):
 
         self.my_devices = []
         self.properties = collections.OrderedDict()
@@ -32,6 +262,12 @@ class IndiLoop(object):
         self.stdin = None
         self.stdout = None
         self.client_socket = None
+        self.client_queue = None
+        self.driver_queue = None
+        # second connection carrying only BLOBs, see enableBlobConnection
+        self.blob_socket = None
+        self.blob_queue = None
+        self.blob_devices = []
         
         self.input_sockets = []
         
@@ -43,26 +279,300 @@ class IndiLoop(object):
             fd = self.stdin.fileno()
             flag = fcntl.fcntl(fd, fcntl.F_GETFL)
             fcntl.fcntl(fd, fcntl.F_SETFL, flag | os.O_NONBLOCK)
-            self.driver_write_lock = threading.Lock()
+            writev, fd = nonblockingWritev(self.stdout.fileno())
+            self.driver_queue = OutputQueue(writev, fd, output_high_water)
         
-        if client_addr:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((client_addr, client_port))
-            self.input_sockets.append(self.client_socket)
-            self.client_socket.settimeout(0.1)
-            self.client_write_lock = threading.Lock()
+        self.blob_sink = None
+        # TrafficRecorder of received and sent data
+        self.recorder = None
+        # LoopStats while enabled, see enableStats
+        self.stats = None
+        # HandlerExecutor running snoop and new value handlers, see enableExecutor
+        self.executor = None
+        # BlobPool decoding BLOBs, see enableBlobPool
+        self.blob_pool = None
+        # device -> messages waiting for BLOBs being decoded
+        self.blob_waiting = collections.OrderedDict()
+        # messages of other devices are parsed only if they match
+        self.subscription = indi.SubscriptionFilter()
+        # decode elements of set messages on first access
+        self.lazy_elements = False
+        self.parsers = [self.newParser() for s in self.input_sockets]
+
+        self.client_addr = client_addr
+        self.client_port = client_port
+        self.output_high_water = output_high_water
+        # reconnect backoff after the client connection is lost, seconds
+        self.reconnect_min = 0.5
+        self.reconnect_max = 30.0
+        self.reconnect_delay = self.reconnect_min
+        self.reconnect_at = None
+        self.reconnects = 0
+        # getProperties/enableBLOB sent to the server, repeated on reconnect
+        self.client_subscriptions = []
+        # sockets with a connect in progress, see openConnection
+        self.connecting = []
+        # properties not yet redefined since the reconnect; those still
+        # pending when no definition came for resync_quiet seconds are
+        # deleted, see finishResync
+        self.resync_pending = set()
+        self.resync_start = None
+        self.resync_duration = None
+        self.resync_quiet = 2.0
+        self.resync_timeout = 10.0
+        self.resync_deadline = None
+        # definitions applied to an existing vector / creating a new one
+        self.define_stats = collections.Counter()
 
-        self.buf = [''] * len(self.input_sockets)
+        if client_addr:
+            self.connectClient(socket.create_connection((client_addr, client_port), timeout=self.reconnect_max))
 
         self.extra_input = []
         self.timeout = None
         self.reply_timeout = None
         self.snoop_condition = threading.Condition()
+        self.prop_waiters = PropWaiters()
         self.log_messages = False
+        # apply set messages followed by another set of the same property
+        # in the same read without calling handlers
+        self.coalesce_sets = False
+        self.coalesced = collections.Counter()
+        # handlers of set messages, definitions, deletions (prop is None)
+        # and of new values for own devices
+        self.snoop_handlers = HandlerRegistry()
+        self.define_handlers = HandlerRegistry()
+        self.delete_handlers = HandlerRegistry()
+        self.new_handlers = HandlerRegistry()
+        # with batch_output, output from the thread running loop1 is
+        # written at its end; handlers that sleep or wait call flush()
+        self.batch_output = False
+        self.loop_thread = None
+        # calls from other threads run by the loop thread, see callInLoop
+        self.loop_calls = collections.deque()
+        self.loop_calls_lock = threading.Lock()
+        # heap of (time, seq, func, args), see callLater
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.call_wakeup = None
  
     def close(self):
         pass
 
+    def openConnection(self):
+        """Socket connecting to the server without blocking, _loop1 calls
+        connectionReady when the connect has finished."""
+        if not self.client_addr:
+            raise ValueError('IndiLoop was created without client_addr')
+        family, type_, proto, _, addr = socket.getaddrinfo(self.client_addr, self.client_port, type=socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        err = sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS):
+            sock.close()
+            raise OSError(err, os.strerror(err))
+        self.connecting.append(sock)
+        return sock
+
+    def connectionReady(self, sock):
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        error = OSError(err, os.strerror(err)) if err else None
+        if sock is self.client_socket:
+            if error:
+                self.clientDisconnected(error)
+                return
+            self.connecting.remove(sock)
+            self.reconnects += 1
+            log.info("reconnected to %s:%d", self.client_addr, self.client_port)
+            self.startResync()
+        elif sock is self.blob_socket:
+            if error:
+                self.blobDisconnected(error)
+                return
+            self.connecting.remove(sock)
+
+    def dropSocket(self, sock):
+        i = self.input_sockets.index(sock)
+        del self.input_sockets[i]
+        del self.parsers[i]
+        if sock in self.connecting:
+            self.connecting.remove(sock)
+        sock.close()
+
+    def connectClient(self, sock=None):
+        if sock is None:
+            sock = self.openConnection()
+        sock.setblocking(False)
+        self.client_socket = sock
+        self.client_queue = OutputQueue(sock.sendmsg, sock.fileno(), self.output_high_water)
+        self.input_sockets.append(sock)
+        self.parsers.append(self.newParser())
+    def connectBlob(self):
+        sock = self.openConnection()
+        self.blob_socket = sock
+        self.blob_queue = OutputQueue(sock.sendmsg, sock.fileno(), self.output_high_water)
+        self.input_sockets.append(sock)
+        self.parsers.append(self.newParser())
+        self.subscribeBlobs(self.blob_devices)
+
+    def subscribeBlobs(self, devices):
+        # Only before getProperties, the definitions come on the main connection
+        for device in devices:
+            for msg in (indi.enableBLOB(device, mode='Only'), indi.getProperties(device)):
+                if self.recorder is not None:
+                    self.recorder.record(BLOB_OUT, msg)
+                self.blob_queue.put(msg, flush=False)
+
+    def blobDisconnected(self, error=None):
+        failed = self.blob_socket in self.connecting
+        self.closeBlob()
+        self.scheduleReconnect(failed)
+        log.error("BLOB connection to %s:%d %s%s", self.client_addr, self.client_port, 'failed' if failed else 'lost',
+                  ': {}'.format(error) if error else '')
+
+    def closeBlob(self):
+        self.dropSocket(self.blob_socket)
+        self.blob_socket = None
+        self.blob_queue = None
+
+    def enableBlobConnection(self, devices):
+        """Receive BLOBs of devices on a second connection to the
+        server, so that a large BLOB does not delay the control
+        traffic; the main connection gets enableBLOB Never for them.
+        The connection is made by the loop, without blocking."""
+        if not self.client_addr:
+            raise ValueError('a BLOB connection needs client_addr')
+        if isinstance(devices, str):
+            devices = [devices]
+        for device in devices:
+            if device not in self.blob_devices:
+                self.blob_devices.append(device)
+                self.setClientBlobMode(device, 'Never')
+        if self.blob_socket is None:
+            try:
+                self.connectBlob()
+            except OSError as e:
+                self.scheduleReconnect(True)
+                log.error("BLOB connection to %s:%d failed: %s, next try in %.1f s", self.client_addr, self.client_port, e, self.reconnect_delay)
+        else:
+            self.subscribeBlobs(devices)
+
+    def disableBlobConnection(self, mode='Also'):
+        """Close the BLOB connection, the main connection gets
+        enableBLOB mode for its devices."""
+        if self.blob_socket is not None:
+            self.closeBlob()
+        for device in self.blob_devices:
+            self.setClientBlobMode(device, mode)
+        self.blob_devices = []
+
+    def setClientBlobMode(self, device, mode):
+        """Send enableBLOB for device on the main connection, replacing
+        the one repeated on reconnect."""
+        for m in ('Never', 'Also', 'Only'):
+            msg = indi.enableBLOB(device, mode=m)
+            if msg in self.client_subscriptions:
+                self.client_subscriptions.remove(msg)
+        self.sendClient(indi.enableBLOB(device, mode=mode))
+
+    def clientDisconnected(self, error=None):
+        failed = self.client_socket in self.connecting
+        self.dropSocket(self.client_socket)
+        self.client_socket = None
+        self.client_queue = None
+        self.scheduleReconnect(failed)
+        if failed:
+            log.error("reconnect to %s:%d failed: %s, next try in %.1f s", self.client_addr, self.client_port, error, self.reconnect_delay)
+            return
+        log.error("client connection to %s:%d lost%s", self.client_addr, self.client_port, ': {}'.format(error) if error else '')
+        self.handleClientDisconnect()
+
+    def scheduleReconnect(self, failed=False):
+        """Reconnect after reconnect_min seconds, doubled after each failed
+        attempt up to reconnect_max."""
+        if failed:
+            self.reconnect_delay = min(self.reconnect_delay * 2, self.reconnect_max)
+        else:
+            self.reconnect_delay = self.reconnect_min
+        at = time.time() + self.reconnect_delay
+        if self.reconnect_at is None or at < self.reconnect_at:
+            self.reconnect_at = at
+
+    def reconnectClient(self):
+        self.reconnect_at = None
+        try:
+            if self.client_socket is None:
+                self.connectClient()
+                # sent once connected
+                for msg in self.client_subscriptions:
+                    self.client_queue.put(msg, flush=False)
+            if self.blob_devices and self.blob_socket is None:
+                self.connectBlob()
+        except OSError as e:
+            self.scheduleReconnect(True)
+            log.error("reconnect to %s:%d failed: %s, next try in %.1f s", self.client_addr, self.client_port, e, self.reconnect_delay)
+
+    def startResync(self):
+        """Track the redefinition of the properties known before the
+        reconnect; see finishResync."""
+        self.resync_pending = set((device, name) for device in self.properties if device not in self.my_devices
+                                  for name in self.properties[device])
+        self.resync_start = time.time()
+        self.resync_duration = None
+        self.resync_deadline = self.resync_start + self.resync_timeout if self.resync_pending else None
+
+    def finishResync(self):
+        """Called when no definition came for resync_quiet seconds (or
+        resync_timeout after the reconnect): the properties still pending
+        are no longer defined by the server and are deleted."""
+        stale = self.resync_pending
+        self.resync_pending = set()
+        self.resync_deadline = None
+        for device, name in sorted(stale):
+            log.info("%s.%s not defined after reconnect, deleting", device, name)
+            self.deleteProperty(device, name)
+        self.resync_duration = time.time() - self.resync_start
+        log.info("resync took %.3f s, %d properties deleted", self.resync_duration, len(stale))
+
+    def setBlobSink(self, sink):
+        """Stream received BLOBs to sink (an indi.BlobSink) instead of
+        keeping their base64 text, None restores the default."""
+        self.blob_sink = sink
+        for parser in self.parsers:
+            parser.blob_sink = sink
+
+    def subscribe(self, device='*', name='*'):
+        """Process only messages of own devices and of the subscribed
+        devices/properties (fnmatch patterns); without any subscription
+        everything is processed. Subscribe before the loop reads, the
+        parsers filter from the next message start they see."""
+        self.subscription.add(device, name)
+        for parser in self.parsers:
+            parser.accept = self.acceptMessage
+
+    def newParser(self):
+        # without subscriptions the parser skips the message filter
+        return indi.INDIStreamParser(self.blob_sink, self.acceptMessage if self.subscription.patterns else None)
+
+    def acceptMessage(self, tag, device, name):
+        if device is None or not self.subscription.patterns or device in self.my_devices:
+            return True
+        return self.subscription.match(device, name)
+
+    def onSnoop(self, device='*', name='*', element=None):
+        """Decorator registering func(msg, prop) for set messages."""
+        def register(func):
+            self.snoop_handlers.add(device, name, func, element)
+            return func
+        return register
+
+    def onNew(self, device='*', name='*', element=None):
+        """Decorator registering func(msg, prop) for new values of own
+        devices, called instead of handleNewValue."""
+        def register(func):
+            self.new_handlers.add(device, name, func, element)
+            return func
+        return register
+
     def addExtraInput(self, s):
         self.extra_input.append(s)
 
@@ -84,103 +594,510 @@ class IndiLoop(object):
         if timeout is None:
             timeout = self.timeout
     
-        readable, writable, exceptional = select.select(self.input_sockets + self.extra_input, [], self.input_sockets + self.extra_input, timeout)
+        outer_loop_thread = self.loop_thread
+        self.loop_thread = threading.get_ident()
+        try:
+            self._loop1(timeout)
+        finally:
+            self.loop_thread = outer_loop_thread
+            self.flush()
+
+    def _loop1(self, timeout):
+        if self.reconnect_at is not None and self.reconnect_at <= time.time():
+            self.reconnectClient()
+        if self.resync_deadline is not None and self.resync_deadline <= time.time():
+            self.finishResync()
+        self.runTimers()
+        for at in (self.reconnect_at, self.resync_deadline, self.timers[0][0] if self.timers else None):
+            if at is not None:
+                wait = max(at - time.time(), 0)
+                if timeout is None or wait < timeout:
+                    timeout = wait
 
-        for i, in_s in enumerate(self.input_sockets):
+        output = [q for q in (self.client_queue, self.blob_queue, self.driver_queue) if q is not None and q.queued]
+        if self.connecting:
+            # written when connected
+            fds = [sock.fileno() for sock in self.connecting]
+            output = [q for q in output if q.fd not in fds] + self.connecting
+        inputs = self.input_sockets + self.extra_input
+        if self.blob_pool is not None:
+            inputs.append(self.blob_pool.wakeup)
+        if self.call_wakeup is not None:
+            inputs.append(self.call_wakeup[0])
+        readable, writable, exceptional = select.select(inputs, output, inputs, timeout)
+
+        for w in writable:
+            if isinstance(w, OutputQueue):
+                self.flushQueue(w)
+            else:
+                self.connectionReady(w)
+
+        for in_s, parser in list(zip(self.input_sockets, self.parsers)):
             if in_s in readable:
-                tree = []
-                try:
-                    if hasattr(in_s, 'recv'):
-                        d = in_s.recv(1000000).decode()
+                if hasattr(in_s, 'recv'):
+                    try:
+                        d = in_s.recv(1000000)
+                    except BlockingIOError:
+                        continue
+                    except OSError as e:
+                        d = b''
+                        error = e
                     else:
-                        d = in_s.read(1000000)
-                        if d == '':
-                            log.error("closed stdin")
-                            self.handleEOF()
-
-                    self.buf[i] += d
-                    tree = etree.fromstring('<msg>' + self.buf[i] + '</msg>')
-                    self.buf[i] = ''
-                except etree.ParseError:
-                    pass
-            
-                for msg in tree:
-                    if self.log_messages:
-                        logmsg = msg.get("message")
-                        if logmsg:
-                            log.info("%s %s", msg.get("timestamp"), logmsg)
-
-                    spec = indi.getSpec(msg)
-                
-                
-                    if spec['mode'] == 'define':
-                        try:
-                            prop = indi.INDIVector(msg)
-                            with self.snoop_condition:
-                                self.properties.setdefault(prop.getAttr('device'), collections.OrderedDict())[prop.getAttr("name")] = prop
-                                self.snoop_condition.notify_all()
-                        except:
-                            log.exception('define')
-                            
-                    elif spec['mode'] == 'set':
-                        try:
-                            prop = self.properties[msg.get("device")][msg.get("name")]
-                            with self.snoop_condition:
-                                prop.updateFromEtree(msg)
-                                self.snoop_condition.notify_all()
-                            self.handleSnoop(msg, prop)
-                        except:
-                            log.exception('set')
-                    elif spec['mode'] == 'new':
-                        try:
-                            device = msg.get("device")
-                            if device in self.my_devices:
-                                prop = self.properties[device][msg.get("name")]
-                                self.handleNewValue(msg, prop, from_client_socket=(in_s is self.client_socket))
-                        except:
-                            log.exception('new')
-                    elif spec['mode'] == 'control':
-                        if msg.tag == 'getProperties':
-                            try:
-                                devices = [ msg["device"] ]
-                            except:
-                                devices = self.my_devices
-
-                            for device in devices:
-                                if device not in self.my_devices:
-                                    continue
-                                for prop in self.properties[device]:
-                                    self.sendDriver(self.properties[device][prop].defineMessage())
-                        elif msg.tag == 'delProperty':
-                            try:
-                                device = msg.get("device")
-                                propname = msg.get("name")
-                                if propname:
-                                    del self.properties[device][propname]
-                                else:
-                                    self.properties[device] = collections.OrderedDict()
-                            except:
-                                log.exception('delProperty')
+                        error = None
+                    if not d:
+                        if in_s is self.blob_socket:
+                            self.blobDisconnected(error)
+                        else:
+                            self.clientDisconnected(error)
+                        continue
+                else:
+                    d = in_s.read(1000000)
+                    if d == '':
+                        log.error("closed stdin")
+                        self.handleEOF()
+
+                if self.recorder is not None:
+                    self.recorder.record(CLIENT_IN if in_s is self.client_socket else BLOB_IN if in_s is self.blob_socket else DRIVER_IN, d)
+                self.feedInput(in_s, parser, d)
 
         for in_s in self.extra_input:
             if in_s in readable:
                 self.handleExtraInput(in_s)
 
+        if self.blob_pool is not None and self.blob_pool.wakeup in readable:
+            self.blob_pool.drainWakeup()
+            self.deliverBlobs()
+
+        if self.call_wakeup is not None and self.call_wakeup[0] in readable:
+            self.runLoopCalls()
+
+        self.runTimers()
+
+    def callWakeup(self):
+        """Socket readable when callInLoop queued a call."""
+        with self.loop_calls_lock:
+            if self.call_wakeup is None:
+                r, w = socket.socketpair()
+                r.setblocking(False)
+                w.setblocking(False)
+                self.call_wakeup = (r, w)
+        return self.call_wakeup[0]
+
+    def callInLoop(self, func, *args):
+        """Run func(*args) on the thread running loop1, in call order."""
+        self.callWakeup()
+        self.loop_calls.append((func, args))
+        try:
+            self.call_wakeup[1].send(b'\0')
+        except BlockingIOError:
+            # already woken
+            pass
+
+    def runLoopCalls(self):
+        try:
+            while self.call_wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.loop_calls:
+            func, args = self.loop_calls.popleft()
+            try:
+                func(*args)
+            except Exception:
+                log.exception('loop call %s', func)
+
+    def callLater(self, delay, func, *args):
+        """Run func(*args) from loop1 after delay seconds, instead of
+        sleeping in a handler. Call only on the loop thread."""
+        heapq.heappush(self.timers, (time.time() + delay, next(self.timer_seq), func, args))
+
+    def runTimers(self):
+        timers = self.timers
+        while timers and timers[0][0] <= time.time():
+            at, seq, func, args = heapq.heappop(timers)
+            try:
+                func(*args)
+            except Exception:
+                log.exception('timer %s', func)
+
+    def transportName(self, in_s):
+        return 'client' if in_s is self.client_socket else 'blob' if in_s is self.blob_socket else 'driver'
+
+    def parseInput(self, in_s, parser, d):
+        """Complete messages in data read from in_s and the indices of
+        those superseded by a later set."""
+        stats = self.stats
+        if stats is not None:
+            transport = self.transportName(in_s)
+            stats.count('received_bytes', transport, len(d))
+            stats.observeSize('read_size_bytes', transport, len(d))
+            t0 = time.perf_counter()
+        msgs = parser.feed(d)
+        if stats is not None:
+            stats.observe('parse_seconds', transport, time.perf_counter() - t0)
+            stats.count('messages', transport, len(msgs))
+        superseded = self.supersededSets(msgs) if self.coalesce_sets else ()
+        return msgs, superseded
+
+    def feedInput(self, in_s, parser, d):
+        """Parse data read from in_s and process the complete messages."""
+        msgs, superseded = self.parseInput(in_s, parser, d)
+        for j, msg in enumerate(msgs):
+            blobs = parser.blobs.pop(msg, None)
+            if self.blob_pool is not None and self.waitForBlobs(msg, in_s, blobs):
+                continue
+            if j in superseded:
+                self.updateSilently(msg, blobs)
+            else:
+                self.processMessage(msg, in_s, blobs)
+
+    def waitForBlobs(self, msg, in_s, blobs):
+        """Queue msg if it has BLOBs being decoded or its device has
+        messages queued, return True if queued."""
+        device = msg.get('device')
+        waiting = self.blob_waiting.get(device)
+        if waiting is None:
+            if not blobs or not any(isinstance(v, indi_blobpool.PendingBlob) for v in blobs.values()):
+                return False
+            waiting = self.blob_waiting[device] = collections.deque()
+        waiting.append((msg, in_s, blobs))
+        return True
+
+    def deliverBlobs(self, wait=False):
+        """Process the queued messages whose BLOBs are decoded, in order
+        per device; with wait all of them."""
+        for device in list(self.blob_waiting):
+            waiting = self.blob_waiting[device]
+            while waiting:
+                msg, in_s, blobs = waiting[0]
+                pending = [v for v in (blobs or {}).values() if isinstance(v, indi_blobpool.PendingBlob)]
+                if not wait and not all(p.done() for p in pending):
+                    break
+                waiting.popleft()
+                if pending:
+                    decoded = { k: v.result() if isinstance(v, indi_blobpool.PendingBlob) else v for k, v in blobs.items() }
+                    for child in msg:
+                        v = blobs.get(child.get('name'))
+                        if isinstance(v, indi_blobpool.PendingBlob) and v.format is not None:
+                            # the worker inflated .z formats
+                            child.set('format', v.format)
+                    blobs = decoded
+                self.processMessage(msg, in_s, blobs)
+            if not waiting:
+                del self.blob_waiting[device]
+
+    def enableBlobPool(self, workers=2, images=False):
+        """Decode BLOBs on a process pool, see indi_blobpool. Replaces
+        the blob sink."""
+        if self.blob_pool is None:
+            self.blob_pool = indi_blobpool.BlobPool(workers, images)
+            self.setBlobSink(self.blob_pool)
+        return self.blob_pool
+
+    def disableBlobPool(self):
+        pool = self.blob_pool
+        if pool is not None:
+            self.deliverBlobs(wait=True)
+            self.blob_pool = None
+            self.setBlobSink(None)
+            pool.close()
+
+    def processMessage(self, msg, in_s=None, blobs=None):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        self.logMessage(msg)
+
+        spec = indi.getSpec(msg)
+
+        if spec['mode'] == 'define':
+            try:
+                with self.snoop_condition:
+                    prop = self.storeDefinition(msg)
+                    # for threads waiting on snoop_condition themselves
+                    self.snoop_condition.notify_all()
+                self.prop_waiters.notify(prop.getAttr('device'), prop.getAttr("name"), prop)
+                self.define_handlers.dispatch(prop.getAttr('device'), prop.getAttr("name"), msg, prop)
+            except:
+                log.exception('define')
+
+        elif spec['mode'] == 'set':
+            try:
+                device = msg.get("device")
+                name = msg.get("name")
+                prop = self.properties[device][name]
+                self.updateProperty(prop, msg, blobs)
+                self.prop_waiters.notify(device, name, prop)
+                handle = self.handleSnoop
+                if getattr(handle, '__func__', None) is not IndiLoop.handleSnoop:
+                    self.callHandler(device, name, handle, msg, prop)
+                self.snoop_handlers.dispatch(device, name, msg, prop)
+            except:
+                log.exception('set')
+        elif spec['mode'] == 'new':
+            try:
+                device = msg.get("device")
+                if device in self.my_devices:
+                    name = msg.get("name")
+                    prop = self.properties[device][name]
+                    from_client = in_s is self.client_socket
+                    if from_client or not self.new_handlers.dispatch(device, name, msg, prop):
+                        self.callHandler(device, name, self.handleNewValue, msg, prop, from_client_socket=from_client)
+            except:
+                log.exception('new')
+        elif spec['mode'] == 'control':
+            self.processControl(msg)
+
+        if stats is not None:
+            stats.messageProcessed(msg, time.perf_counter() - t0)
+
+    def callHandler(self, device, name, func, *args, **kwargs):
+        if self.executor is not None:
+            self.executor.submit(device, name, functools.partial(func, *args, **kwargs), func)
+        else:
+            func(*args, **kwargs)
+
+    def enableExecutor(self, workers=4, max_queue=100, policy='block', order='device'):
+        """Run handleSnoop, handleNewValue and the snoop and new value
+        handlers on a thread pool, see indi_executor. Definition and
+        deletion handlers stay on the loop thread."""
+        if self.executor is None:
+            self.executor = indi_executor.HandlerExecutor(workers, max_queue, policy, order)
+            self.snoop_handlers.executor = self.executor
+            self.new_handlers.executor = self.executor
+        return self.executor
+
+    def disableExecutor(self, wait=True):
+        executor = self.executor
+        if executor is not None:
+            self.executor = None
+            self.snoop_handlers.executor = None
+            self.new_handlers.executor = None
+            executor.close(wait)
+
+    def supersededSets(self, msgs):
+        """Indices of set messages in msgs that are followed by another
+        set message of the same property."""
+        if len(msgs) < 2:
+            return ()
+        last = {}
+        for j, msg in enumerate(msgs):
+            if indi.getSpec(msg)['mode'] == 'set':
+                last[(msg.get("device"), msg.get("name"))] = j
+        if len(last) == len(msgs):
+            return ()
+        superseded = set()
+        for j, msg in enumerate(msgs):
+            if indi.getSpec(msg)['mode'] == 'set':
+                key = (msg.get("device"), msg.get("name"))
+                if last[key] != j:
+                    superseded.add(j)
+                    self.coalesced[key] += 1
+        self.mergeSuperseded(msgs, superseded, last)
+        return superseded
+
+    def mergeSuperseded(self, msgs, superseded, last):
+        """Move the elements changed only by superseded sets into the
+        last set of their property, so that its handlers (e.g. the
+        metrics exporter) see every changed element. BLOB vectors are
+        left alone, their payloads belong to their message."""
+        names = {}
+        for j in sorted(superseded, reverse=True):
+            msg = msgs[j]
+            if msg.tag == 'setBLOBVector':
+                continue
+            survivor = msgs[last[(msg.get("device"), msg.get("name"))]]
+            present = names.get(survivor)
+            if present is None:
+                present = names[survivor] = set(child.get('name') for child in survivor)
+            for child in list(msg):
+                name = child.get('name')
+                if name not in present:
+                    present.add(name)
+                    # the newest value of the element, applied with the survivor
+                    survivor.append(child)
+
+    def updateSilently(self, msg, blobs=None):
+        self.logMessage(msg)
+        try:
+            prop = self.properties[msg.get("device")][msg.get("name")]
+            self.updateProperty(prop, msg, blobs)
+        except:
+            log.exception('set')
+
+    def updateProperty(self, prop, msg, blobs=None):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        with self.snoop_condition:
+            prop.updateFromEtree(msg, blobs, self.lazy_elements)
+            self.snoop_condition.notify_all()
+        if stats is not None:
+            stats.observe('vector_seconds', 'update', time.perf_counter() - t0)
+
+    def serialize(self, method, *args):
+        """Message of a vector method (prop.setMessage, ...), timed while
+        stats are enabled."""
+        stats = self.stats
+        if stats is None:
+            return method(*args)
+        t0 = time.perf_counter()
+        msg = method(*args)
+        stats.observe('serialize_seconds', getattr(method.__self__.spec, indi_stats.SERIALIZE_SPEC[method.__name__]),
+                      time.perf_counter() - t0)
+        return msg
+
+    def logMessage(self, msg):
+        if self.log_messages:
+            logmsg = msg.get("message")
+            if logmsg:
+                log.info("%s %s", msg.get("timestamp"), logmsg)
+
+    def storeDefinition(self, msg):
+        """Define a property from msg. A redefinition with the same elements,
+        e.g. after reconnect, updates the existing vector."""
+        device = msg.get('device')
+        name = msg.get('name')
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        prop = self.getProperty(device, name)
+        if prop is not None and prop.redefineFromEtree(msg):
+            self.define_stats['updated'] += 1
+        else:
+            prop = indi.INDIVector(msg)
+            self.storeProperty(prop)
+            self.define_stats['created'] += 1
+        if stats is not None:
+            stats.observe('vector_seconds', 'define', time.perf_counter() - t0)
+
+        if self.resync_pending:
+            self.resync_pending.discard((device, name))
+            if not self.resync_pending:
+                self.resync_deadline = None
+                self.resync_duration = time.time() - self.resync_start
+                log.info("resync took %.3f s", self.resync_duration)
+            else:
+                self.resync_deadline = time.time() + self.resync_quiet
+        return prop
+
+    def storeProperty(self, prop):
+        self.properties.setdefault(prop.getAttr('device'), collections.OrderedDict())[prop.getAttr("name")] = prop
+
+    def processControl(self, msg):
+        if msg.tag == 'getProperties':
+            try:
+                devices = [ msg["device"] ]
+            except:
+                devices = self.my_devices
+
+            for device in devices:
+                if device not in self.my_devices:
+                    continue
+                for prop in self.properties[device]:
+                    self.sendDriver(self.serialize(self.properties[device][prop].defineMessage))
+        elif msg.tag == 'delProperty':
+            try:
+                self.deleteProperty(msg.get("device"), msg.get("name"), msg)
+            except:
+                log.exception('delProperty')
+
+    def deleteProperty(self, device, name=None, msg=None):
+        """Delete a property, or all properties of device if name is None."""
+        if msg is None:
+            msg = etree.Element('delProperty', device=device)
+            if name:
+                msg.set('name', name)
+        if name:
+            del self.properties[device][name]
+        else:
+            self.properties[device] = collections.OrderedDict()
+        if self.resync_pending:
+            self.resync_pending = set(key for key in self.resync_pending
+                                      if key[0] != device or (name and key[1] != name))
+        self.delete_handlers.dispatch(device, name or None, msg, None)
 
     def loop(self):
         while True:
             self.loop1()
 
     def sendClient(self, msg):
-        if self.client_socket:
-            with self.client_write_lock:
-                self.client_socket.send(msg)
+        if self.client_addr and (msg.startswith(b'<getProperties') or msg.startswith(b'<enableBLOB')):
+            if msg not in self.client_subscriptions:
+                self.client_subscriptions.append(msg)
+        if self.recorder is not None:
+            self.recorder.record(CLIENT_OUT, msg)
+        q = self.client_queue
+        if q is not None:
+            try:
+                q.put(msg, flush=not self.batch_output or self.loop_thread != threading.get_ident())
+            except OSError as e:
+                # the loop thread handles the disconnect
+                log.error("send to %s:%d failed: %s", self.client_addr, self.client_port, e)
+            if self.stats is not None:
+                self.sendStats('client', msg, q.queued)
 
     def sendDriver(self, msg):
-        if self.stdout:
-            with self.driver_write_lock:
-                self.stdout.buffer.write(msg)
-                self.stdout.flush()
+        if self.recorder is not None:
+            self.recorder.record(DRIVER_OUT, msg)
+        q = self.driver_queue
+        if q is not None:
+            try:
+                q.put(msg, flush=not self.batch_output or self.loop_thread != threading.get_ident())
+            except OSError as e:
+                log.error("write to stdout failed: %s", e)
+            if self.stats is not None:
+                self.sendStats('driver', msg, q.queued)
+
+    def sendStats(self, transport, msg, queued):
+        stats = self.stats
+        stats.count('sent_bytes', transport, len(msg))
+        stats.observeSize('send_size_bytes', transport, len(msg))
+        stats.observeSize('queued_bytes', transport, queued)
+
+    def enableStats(self):
+        """Start recording hot path statistics, returns the LoopStats."""
+        if self.stats is None:
+            self.stats = indi_stats.LoopStats()
+            for registry in (self.snoop_handlers, self.define_handlers, self.delete_handlers, self.new_handlers):
+                registry.stats = self.stats
+        return self.stats
+
+    def disableStats(self):
+        if self.stats is not None:
+            for registry in (self.snoop_handlers, self.define_handlers, self.delete_handlers, self.new_handlers):
+                registry.stats = None
+            self.stats = None
+
+    def flush(self):
+        """Write the queued output now; with batch_output a handler that
+        sleeps or waits must call this first."""
+        for q in (self.client_queue, self.blob_queue, self.driver_queue):
+            if q is not None and q.queued:
+                self.flushQueue(q)
+
+    def flushQueue(self, q):
+        try:
+            q.flush()
+        except OSError as e:
+            if q is self.client_queue:
+                self.clientDisconnected(e)
+            elif q is self.blob_queue:
+                self.blobDisconnected(e)
+            else:
+                log.error("write to stdout failed: %s", e)
+                self.handleEOF()
+
+    def outputStats(self):
+        """Queued/sent bytes and write counts of the output queues."""
+        stats = {}
+        if self.client_queue is not None:
+            stats['client'] = self.client_queue.stats()
+        if self.blob_queue is not None:
+            stats['blob'] = self.blob_queue.stats()
+        if self.driver_queue is not None:
+            stats['driver'] = self.driver_queue.stats()
+        return stats
 
     def handleNewValue(self, msg, prop, from_client_socket=False):
         if from_client_socket:
@@ -189,7 +1106,7 @@ class IndiLoop(object):
         prop.newFromEtree(msg)
 
         prop.setAttr('state', 'Ok')
-        self.sendDriver(prop.setMessage())
+        self.sendDriver(self.serialize(prop.setMessage))
 
     def handleSnoop(self, msg, prop):
         pass
@@ -200,6 +1117,9 @@ class IndiLoop(object):
     def handleEOF(self):
         sys.exit(1)
 
+    def handleClientDisconnect(self):
+        pass
+
     def snoopDevice(self, device, prop = None):
         if prop is None:
             msg = indi.getProperties(device=device)
@@ -208,10 +1128,10 @@ class IndiLoop(object):
 
         self.sendDriver(msg)
 
-    def checkValue(self, device, prop, item, state = ['Ok', 'Idle'], defvalue = None):
+    def checkValue(self, device, prop, item, state = ['Ok', 'Idle'], defvalue = None, native = False):
         try:
             prop = self.properties[device][prop]
-            return prop.checkValue(item, state, defvalue)
+            return prop.checkValue(item, state, defvalue, native)
         except KeyError:
             log.exception('checkValue')
             return defvalue
@@ -230,9 +1150,47 @@ class IndiLoop(object):
         log.info(text)
         self.sendDriver(indi.message(device, text))
 
+    def sendBlob(self, device, name, values, compressor=None, state='Ok'):
+        """Set BLOB elements {element: bytes} of an own property and send
+        it. With an indi_compress.BlobCompressor, compression and base64
+        encoding run on its thread, the property is updated and sent by
+        the loop thread; the returned Future is done when the message is
+        queued, BLOBs are sent in submission order."""
+        prop = self.properties[device][name]
+        if compressor is None:
+            for element, v in values.items():
+                prop[element].setValue(v)
+            prop.setAttr('state', state)
+            self.sendDriver(self.serialize(prop.setMessage))
+            return None
+
+        future = concurrent.futures.Future()
+
+        def send(compressed):
+            try:
+                for element, (data, text) in compressed.items():
+                    v = values[element]
+                    prop[element].setCompressed(data, compressor.codec, len(v), v, text)
+                prop.setAttr('state', state)
+                self.sendDriver(self.serialize(prop.setMessage))
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(sum(len(data) for data, text in compressed.values()))
+
+        def compress():
+            try:
+                compressed = indi_compress.compress_values(compressor, values)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            self.callInLoop(send, compressed)
+        compressor.submit(compress)
+        return future
+
     def sendDriverMessage(self, device, prop_name, message = None):
         prop = self.properties[device][prop_name]
-        self.sendDriver(prop.setMessage(message))
+        self.sendDriver(self.serialize(prop.setMessage, message))
 
     def _checkChanges(self, prop, changes={}):
         for c in changes:
@@ -244,60 +1202,74 @@ class IndiLoop(object):
         try:
             baseprop = self.properties[device][name]
             baseprop.setAttr('state', 'Busy')
-            self.sendClient(baseprop.newMessage(changes))
+            self.sendClient(self.serialize(baseprop.newMessage, changes))
         except:
             log.exception("sendClientMessage")
 
-    def sendClientMessageWait(self, device, name, changes={}, timeout=None, call_loop=False):
+    def getProperty(self, device, name):
+        try:
+            return self.properties[device][name]
+        except KeyError:
+            return None
+
+    def waitFor(self, device, name, predicate=None, timeout=None, call_loop=False, error='Prop wait timeout'):
+        """Wait until the property exists and predicate(prop) is true.
+
+        Only updates of this property wake the thread, e.g.
+        waitFor(device, name, lambda prop: prop.getAttr('state') != 'Busy')
+        """
         if timeout is None:
             timeout = self.reply_timeout
-    
+        if timeout:
+            t1 = time.time() + timeout
+
+        if call_loop:
+            while True:
+                prop = self.getProperty(device, name)
+                if prop is not None and (predicate is None or predicate(prop)):
+                    return prop
+                self.loop1(timeout)
+                if timeout and t1 < time.time():
+                    raise RuntimeError(error)
+
+        waiter = self.prop_waiters.add(device, name, predicate)
+        try:
+            while True:
+                prop = self.getProperty(device, name)
+                if prop is not None and (predicate is None or predicate(prop)):
+                    return prop
+                if timeout:
+                    remaining = t1 - time.time()
+                    if remaining <= 0 or not waiter.event.wait(remaining):
+                        raise RuntimeError(error)
+                else:
+                    waiter.event.wait()
+                waiter.event.clear()
+        finally:
+            self.prop_waiters.remove(waiter)
+
+    def sendClientMessageWait(self, device, name, changes={}, timeout=None, call_loop=False):
         log.error("sendClientMessageWait start %s %s", device, name)
-        with self.snoop_condition:
-            try:
-                baseprop = self.properties[device][name]
-                cnt = baseprop.update_cnt
-                self.sendClientMessage(device, name, changes)
-                changes = self._checkChanges(baseprop, changes)
-                if not changes:
-                    # no changes, do not wait for result
-                    log.error("sendClientMessageWait no changes %s %s", device, name)
-                    return
-                t0 = time.time()
-            except:
-                log.exception("sendClientMessageWait")
+        try:
+            baseprop = self.properties[device][name]
+            cnt = baseprop.update_cnt
+            self.sendClientMessage(device, name, changes)
+            changes = self._checkChanges(baseprop, changes)
+            if not changes:
+                # no changes, do not wait for result
+                log.error("sendClientMessageWait no changes %s %s", device, name)
                 return
-            
-            while baseprop.update_cnt == cnt:
-                if call_loop:
-                    self.loop1(timeout)
-                else:
-                    self.snoop_condition.wait(timeout)
-                
-                if timeout and t0 + timeout < time.time():
-                    raise RuntimeError('Prop is still busy')
-                    
+        except:
+            log.exception("sendClientMessageWait")
+            return
+
+        self.waitFor(device, name, lambda prop: prop is not baseprop or prop.update_cnt != cnt,
+                     timeout, call_loop, 'Prop is still busy')
         log.error("sendClientMessageWait end %s %s", device, name)
 
     def waitForProp(self, device, name, timeout=None, call_loop=False):
-        if timeout is None:
-            timeout = self.reply_timeout
-
         log.error("waitForProp start %s %s", device, name)
-        with self.snoop_condition:
-            while True:
-                try:
-                    return self.properties[device][name]
-                except:
-                    pass
-            
-                if call_loop:
-                    self.loop1(timeout)
-                else:
-                    self.snoop_condition.wait(timeout)
-                
-                if timeout and t0 + timeout < time.time():
-                    raise RuntimeError('Prop is still missing')
+        return self.waitFor(device, name, None, timeout, call_loop, 'Prop is still missing')
 
     def __getitem__(self, key):
         return self.properties[key]
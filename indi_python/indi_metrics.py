@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Prometheus exposition of the properties known to an IndiLoop.
+
+    indi_number{device="EQMod Mount",property="TIME_LST",element="LST"} 5.25
+    indi_switch{device="EQMod Mount",property="CONNECTION",element="CONNECT"} 1
+    indi_light{...} 0..3 (Idle, Ok, Busy, Alert)
+    indi_text_info{...,value="..."} 1
+    indi_property_state{device="...",property="..."} 0..3
+
+Label prefixes are escaped when a property is defined. Updates mark
+the changed elements dirty; render() formats only those lines and
+reuses the cached body when nothing changed. Properties of own devices
+are updated without messages and are re-rendered on every scrape.
+Loop statistics (indi_stats) are appended while enabled.
+"""
+
+import math
+import threading
+import collections
+
+import logging
+log = logging.getLogger()
+
+
+STATES = { 'Idle': 0, 'Ok': 1, 'Busy': 2, 'Alert': 3 }
+
+FAMILIES = { 'Number': 'number', 'Switch': 'switch', 'Light': 'light', 'Text': 'text_info' }
+
+
+def escape_label(v):
+    return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(v):
+    if math.isnan(v):
+        return 'NaN'
+    if math.isinf(v):
+        return '+Inf' if v > 0 else '-Inf'
+    return repr(float(v))
+
+
+class PropMetrics(object):
+    """Cached exposition lines of one property."""
+    __slots__ = ('family', 'prefixes', 'lines', 'state_prefix', 'state_line')
+
+    def __init__(self, prefix, prop):
+        device = escape_label(prop.getAttr('device'))
+        name = escape_label(prop.getAttr('name'))
+        self.family = FAMILIES.get(prop.itype)
+        self.prefixes = collections.OrderedDict()
+        if self.family is not None:
+            for e in prop.elements:
+                self.prefixes[e.getAttr('name')] = '{}_{}{{device="{}",property="{}",element="{}"'.format(
+                    prefix, self.family, device, name, escape_label(e.getAttr('name')))
+        self.lines = dict.fromkeys(self.prefixes, '')
+        self.state_prefix = '{}_property_state{{device="{}",property="{}"}} '.format(prefix, device, name)
+        self.state_line = ''
+
+    def update(self, prop, names=None):
+        """Re-render the lines of the given elements (all if None),
+        return the number of lines formatted."""
+        self.state_line = self.state_prefix + str(STATES.get(prop.getAttr('state'), -1)) + '\n'
+        if names is None:
+            names = self.prefixes
+        n = 1
+        for name in names:
+            prefix = self.prefixes.get(name)
+            if prefix is None:
+                continue
+            e = prop.getElementByName(name)
+            if self.family == 'number':
+                line = '{}}} {}\n'.format(prefix, format_value(e.native()))
+            elif self.family == 'switch':
+                line = '{}}} {}\n'.format(prefix, 1 if e.getValue() == 'On' else 0)
+            elif self.family == 'light':
+                line = '{}}} {}\n'.format(prefix, STATES.get(e.getValue(), -1))
+            else:
+                line = '{},value="{}"}} 1\n'.format(prefix, escape_label(e.getValue()))
+            self.lines[name] = line
+            n += 1
+        return n
+
+    def text(self):
+        return ''.join(self.lines.values())
+
+
+class MetricsExporter(object):
+
+    def __init__(self, loop, prefix='indi'):
+        self.loop = loop
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.props = {}
+        # (device, name) -> element names to re-render, None for all
+        self.dirty = {}
+        # family -> (device, name) -> rendered text
+        self.chunks = collections.OrderedDict((f, collections.OrderedDict()) for f in list(FAMILIES.values()) + ['property_state'])
+        self.body = None
+        self.lines_rendered = 0
+
+        loop.define_handlers.add('*', '*', self.propertyDefined)
+        loop.snoop_handlers.add('*', '*', self.propertyUpdated)
+        loop.delete_handlers.add('*', '*', self.propertyDeleted)
+        for device in loop.properties:
+            for prop in loop.properties[device].values():
+                self.propertyDefined(None, prop)
+
+    def propertyDefined(self, msg, prop):
+        key = (prop.getAttr('device'), prop.getAttr('name'))
+        with self.lock:
+            self.props[key] = PropMetrics(self.prefix, prop)
+            self.dirty[key] = None
+
+    def propertyUpdated(self, msg, prop):
+        key = (prop.getAttr('device'), prop.getAttr('name'))
+        with self.lock:
+            if key in self.dirty:
+                names = self.dirty[key]
+                if names is not None:
+                    names.update(child.get('name') for child in msg)
+            else:
+                self.dirty[key] = set(child.get('name') for child in msg)
+
+    def propertyDeleted(self, msg, prop):
+        device = msg.get('device')
+        name = msg.get('name')
+        with self.lock:
+            for key in list(self.props):
+                if key[0] == device and (name is None or key[1] == name):
+                    del self.props[key]
+                    self.dirty.pop(key, None)
+                    for chunks in self.chunks.values():
+                        chunks.pop(key, None)
+                    self.body = None
+
+    def render(self):
+        """The exposition body."""
+        with self.lock:
+            for device in self.loop.my_devices:
+                for name, prop in self.loop.properties.get(device, {}).items():
+                    if (device, name) not in self.props:
+                        self.props[(device, name)] = PropMetrics(self.prefix, prop)
+                    self.dirty[(device, name)] = None
+            dirty, self.dirty = self.dirty, {}
+
+            for key, names in dirty.items():
+                pm = self.props.get(key)
+                prop = self.loop.getProperty(*key)
+                if pm is None or prop is None:
+                    continue
+                self.lines_rendered += pm.update(prop, names)
+                for family, text in ((pm.family, pm.text()), ('property_state', pm.state_line)):
+                    if family is not None and self.chunks[family].get(key) != text:
+                        self.chunks[family][key] = text
+                        self.body = None
+
+            if self.body is None:
+                parts = []
+                for family, chunks in self.chunks.items():
+                    if chunks:
+                        parts.append('# TYPE {}_{} gauge\n'.format(self.prefix, family))
+                        parts.extend(chunks.values())
+                self.body = ''.join(parts)
+        stats = self.loop.stats
+        if stats is not None:
+            return self.body + stats.render(self.prefix)
+        return self.body
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Recording and replay of INDI traffic.
+
+The recorder appends every chunk received by an IndiLoop and every
+message it sends to a log file:
+
+    name          b'INDIREC1', then records of
+                  float64 time, uint8 direction, uint32 length, data
+    name.idx      one INDEX_DTYPE row per record, readable with np.memmap
+    name.blobs    data of records of at least blob_threshold bytes
+                  (BLOB transfers); the log record then holds
+                  uint64 offset, uint32 length into this file
+
+    loop.recorder = TrafficRecorder('night.rec')
+    ...
+    log = TrafficLog('night.rec')
+    TrafficReplayer(log, speed=None).feed(IndiLoop())
+
+Replay feeds the received chunks into a loop as if they had been read
+from its sockets, or sends them on a local socket to a loop connected
+as a client; speed 1 replays in real time, None as fast as possible.
+"""
+
+import os
+import mmap
+import time
+import socket
+import struct
+import threading
+
+import numpy as np
+
+import logging
+log = logging.getLogger()
+
+
+CLIENT_IN = 0
+DRIVER_IN = 1
+CLIENT_OUT = 2
+DRIVER_OUT = 3
+# the BLOB connection, see IndiLoop.enableBlobConnection
+BLOB_IN = 4
+BLOB_OUT = 5
+DIRECTIONS = ('client in', 'driver in', 'client out', 'driver out', 'blob in', 'blob out')
+
+# record data is in the .blobs file
+BLOB_REF = 0x80
+
+MAGIC = b'INDIREC1'
+HEADER = struct.Struct('<dBI')
+REF = struct.Struct('<QI')
+INDEX = struct.Struct('<dqII')
+INDEX_DTYPE = np.dtype([('t', '<f8'), ('offset', '<i8'), ('length', '<u4'), ('direction', '<u4')])
+
+
+class TrafficRecorder(object):
+
+    def __init__(self, path, blob_threshold=64 * 1024, flush_interval=1.0):
+        self.path = path
+        self.blob_threshold = blob_threshold
+        self.flush_interval = flush_interval
+        self.log = open(path, 'ab')
+        if self.log.tell() == 0:
+            self.log.write(MAGIC)
+        self.index = open(path + '.idx', 'ab')
+        self.blobs = open(path + '.blobs', 'ab') if blob_threshold else None
+        # sendClient may be called from other threads
+        self.lock = threading.Lock()
+        self.flush_at = time.time() + flush_interval
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, direction, data):
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        t = time.time()
+        with self.lock:
+            offset = self.log.tell()
+            if self.blobs is not None and n >= self.blob_threshold:
+                ref = REF.pack(self.blobs.tell(), n)
+                self.blobs.write(data)
+                self.log.write(HEADER.pack(t, direction | BLOB_REF, len(ref)))
+                self.log.write(ref)
+            else:
+                self.log.write(HEADER.pack(t, direction, n))
+                self.log.write(data)
+            self.index.write(INDEX.pack(t, offset, n, direction))
+            self.records += 1
+            self.bytes += n
+            if t >= self.flush_at:
+                self._flush()
+                self.flush_at = t + self.flush_interval
+
+    def _flush(self):
+        # data before the records referring to it
+        for f in (self.blobs, self.log, self.index):
+            if f is not None:
+                f.flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            for f in (self.blobs, self.log, self.index):
+                if f is not None:
+                    f.close()
+
+
+def _map(path):
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return b''
+
+
+class TrafficLog(object):
+    """Read access to a recording, the files are mapped, not read."""
+
+    def __init__(self, path):
+        self.path = path
+        self.log = _map(path)
+        if self.log[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + ' is not a traffic recording')
+        self.blobs = _map(path + '.blobs')
+        self.index = self._loadIndex()
+
+    def _loadIndex(self):
+        try:
+            size = os.path.getsize(self.path + '.idx')
+        except FileNotFoundError:
+            size = 0
+        n = size // INDEX_DTYPE.itemsize
+        if n == 0:
+            return self.rebuildIndex()
+        index = np.memmap(self.path + '.idx', dtype=INDEX_DTYPE, mode='r', shape=(n,))
+        # the index may be ahead of the log after a crash
+        end = len(self.log)
+        if index['offset'][-1] + HEADER.size > end:
+            index = index[:np.searchsorted(index['offset'], end - HEADER.size, 'right')]
+        return index
+
+    def rebuildIndex(self):
+        """Index built by scanning the log, for a missing index file."""
+        rows = []
+        pos = len(MAGIC)
+        end = len(self.log)
+        while pos + HEADER.size <= end:
+            t, direction, n = HEADER.unpack_from(self.log, pos)
+            if pos + HEADER.size + n > end:
+                break
+            length = n
+            if direction & BLOB_REF:
+                length = REF.unpack_from(self.log, pos + HEADER.size)[1]
+            rows.append((t, pos, length, direction & ~BLOB_REF))
+            pos += HEADER.size + n
+        return np.array(rows, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def data(self, i):
+        pos = int(self.index['offset'][i])
+        t, direction, n = HEADER.unpack_from(self.log, pos)
+        pos += HEADER.size
+        if direction & BLOB_REF:
+            offset, n = REF.unpack_from(self.log, pos)
+            return self.blobs[offset:offset + n]
+        return self.log[pos:pos + n]
+
+    def select(self, directions=None, t0=None, t1=None):
+        """Positions of the records with t0 <= time < t1 in directions."""
+        t = self.index['t']
+        lo = 0 if t0 is None else np.searchsorted(t, t0, 'left')
+        hi = len(t) if t1 is None else np.searchsorted(t, t1, 'left')
+        pos = np.arange(lo, hi)
+        if directions is not None:
+            pos = pos[np.isin(self.index['direction'][lo:hi], list(directions))]
+        return pos
+
+    def records(self, directions=None, t0=None, t1=None):
+        """(time, direction, data) of the selected records."""
+        index = self.index
+        for i in self.select(directions, t0, t1):
+            yield float(index['t'][i]), int(index['direction'][i]), self.data(i)
+
+    def stats(self):
+        stats = {}
+        for d, name in enumerate(DIRECTIONS):
+            sel = self.index['direction'] == d
+            stats[name] = { 'records': int(sel.sum()), 'bytes': int(self.index['length'][sel].sum()) }
+        if len(self.index):
+            stats['duration'] = float(self.index['t'][-1] - self.index['t'][0])
+        return stats
+
+
+class TrafficReplayer(object):
+
+    def __init__(self, log, speed=1.0, directions=(CLIENT_IN, BLOB_IN), t0=None, t1=None):
+        if isinstance(log, str):
+            log = TrafficLog(log)
+        self.log = log
+        self.speed = speed
+        self.directions = directions
+        self.t0 = t0
+        self.t1 = t1
+        self.records = 0
+        self.bytes = 0
+        self.duration = None
+        # how far behind the schedule replay fell at most, seconds
+        self.max_lag = 0.0
+
+    def schedule(self):
+        """The selected records, each returned no earlier than its
+        recorded time offset divided by speed."""
+        start = time.time()
+        first = None
+        for t, direction, data in self.log.records(self.directions, self.t0, self.t1):
+            if first is None:
+                first = t
+            if self.speed:
+                wait = start + (t - first) / self.speed - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                elif -wait > self.max_lag:
+                    self.max_lag = -wait
+            self.records += 1
+            self.bytes += len(data)
+            yield direction, data
+        self.duration = time.time() - start
+
+    def feed(self, loop):
+        """Process the received data in loop as if read from its input.
+
+        Driver input is fed as from loop.stdin, client input as from
+        the client connection, BLOB connection input as from the BLOB
+        connection; each gets a parser of its own, as the chunks of the
+        connections are interleaved.
+        """
+        sources = {
+            CLIENT_IN: (loop.client_socket, loop.newParser()),
+            DRIVER_IN: (loop.stdin if loop.stdin is not None else self, loop.newParser()),
+            BLOB_IN: (loop.blob_socket, loop.newParser()),
+        }
+        for direction, data in self.schedule():
+            in_s, parser = sources[direction]
+            loop.feedInput(in_s, parser, bytes(data))
+        return self.duration
+
+    def listen(self, host='localhost', port=0):
+        """Listening socket for serve(), returns its port."""
+        self.server = socket.create_server((host, port))
+        return self.server.getsockname()[1]
+
+    def serve(self):
+        """Accept one client, as IndiLoop(client_addr=...), and send it
+        the replayed data. Input from the client is discarded. There is
+        one connection, so BLOB connection input is not sent: its chunks
+        would split the messages of the client connection."""
+        conn, addr = self.server.accept()
+        self.server.close()
+        with conn:
+            for direction, data in self.schedule():
+                if direction == BLOB_IN:
+                    continue
+                conn.sendall(data)
+                try:
+                    while conn.recv(65536, socket.MSG_DONTWAIT):
+                        pass
+                except BlockingIOError:
+                    pass
+            conn.shutdown(socket.SHUT_WR)
+        return self.duration
+
+    def stats(self):
+        return { 'records': self.records, 'bytes': self.bytes, 'duration': self.duration,
+                 'max_lag': self.max_lag }
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+INDI server / hub.
+
+Listens for clients on TCP and optionally a Unix socket, spawns driver
+processes or attaches to drivers/servers over TCP and routes messages
+between them like indiserver:
+
+  - getProperties from a client subscribes it to the device (or all
+    devices) and is forwarded to the driver owning the device
+  - new*Vector goes to the driver owning the device
+  - def/set/del/message from a driver go to the clients and snooping
+    drivers subscribed to the device, setBLOBVector only to those that
+    enabled BLOBs for it (enableBLOB Never/Also/Only per device or property)
+  - getProperties/enableBLOB from a driver set up its snoop subscription
+
+The server is an IndiLoop, so devices defined with defineProperties are
+served by the same process: handleNewValue/handleSnoop work as in a
+standalone driver.
+
+    server = IndiServer(port=7624)
+    server.startDriver(['indi_simulator_telescope'])
+    server.loop()
+"""
+
+import socket
+import os
+import fcntl
+import selectors
+import subprocess
+import collections
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop, OutputQueue
+
+import logging
+log = logging.getLogger()
+
+
+def _set_nonblocking(fd):
+    flag = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flag | os.O_NONBLOCK)
+
+
+class ServerConnection(object):
+    """Client or driver connection of IndiServer."""
+
+    def __init__(self, kind, name, rfd=None, wfd=None, writev=None, sock=None, proc=None):
+        self.kind = kind
+        self.name = name
+        self.rfd = rfd
+        self.wfd = wfd
+        self.sock = sock
+        self.proc = proc
+        self.parser = indi.INDIStreamParser()
+        # never blocks, IndiServer.deliver closes connections queueing too much
+        self.queue = OutputQueue(writev, wfd, None) if wfd is not None else None
+        self.write_registered = False
+        self.closed = False
+
+        # devices defined by this driver
+        self.devices = set()
+        # getProperties subscriptions
+        self.all_props = False
+        self.props = set()
+        # enableBLOB modes, keyed by (device, name or None)
+        self.blob_modes = {}
+
+    def subscribe(self, device, name):
+        if device is None:
+            self.all_props = True
+        else:
+            self.props.add((device, name))
+
+    def wants(self, device, name):
+        if device is None or self.all_props:
+            return self.all_props or self.kind == 'client'
+        return (device, None) in self.props or (device, name) in self.props
+
+    def setBlobMode(self, device, name, mode):
+        self.blob_modes[(device, name)] = mode
+
+    def blobMode(self, device, name):
+        mode = self.blob_modes.get((device, name))
+        if mode is None:
+            mode = self.blob_modes.get((device, None), 'Never')
+        return mode
+
+    def read(self):
+        if self.sock is not None:
+            return self.sock.recv(1000000)
+        return os.read(self.rfd, 1000000)
+
+    def __repr__(self):
+        return '{} {}'.format(self.kind, self.name)
+
+
+class IndiServer(IndiLoop):
+
+    def __init__(self, port = 7624, host = '', unix_path = None, max_queue = 64 * 1024 * 1024):
+        super(IndiServer, self).__init__()
+        self.selector = selectors.DefaultSelector()
+        self.max_queue = max_queue
+        self.clients = []
+        self.drivers = []
+        self.device_drivers = {}
+        self.routed = collections.Counter()
+        # devices defined by this process
+        self.local = ServerConnection('local', 'local')
+        self.selector.register(self.callWakeup(), selectors.EVENT_READ, ('calls', None))
+
+        if port is not None:
+            lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            lsock.bind((host, port))
+            self.listen(lsock)
+
+        if unix_path is not None:
+            try:
+                os.unlink(unix_path)
+            except FileNotFoundError:
+                pass
+            lsock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            lsock.bind(unix_path)
+            self.listen(lsock)
+
+    def listen(self, lsock):
+        lsock.listen(64)
+        lsock.setblocking(False)
+        self.selector.register(lsock, selectors.EVENT_READ, ('listen', lsock))
+
+    def addExtraInput(self, s):
+        super(IndiServer, self).addExtraInput(s)
+        self.selector.register(s, selectors.EVENT_READ, ('extra', s))
+
+    def startDriver(self, cmd):
+        """Spawn a driver process, cmd is an argument list."""
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        rfd = proc.stdout.fileno()
+        wfd = proc.stdin.fileno()
+        _set_nonblocking(rfd)
+        _set_nonblocking(wfd)
+        conn = ServerConnection('driver', cmd[0], rfd, wfd, lambda bufs: os.writev(wfd, bufs), proc=proc)
+        self.addConnection(conn)
+        return conn
+
+    def attachDriver(self, host, port = 7624):
+        """Use a driver or another server listening on host:port."""
+        sock = socket.create_connection((host, port))
+        return self.attachSocket(sock, 'driver', '{}:{}'.format(host, port))
+
+    def attachSocket(self, sock, kind, name):
+        sock.setblocking(False)
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = ServerConnection(kind, name, sock.fileno(), sock.fileno(), sock.sendmsg, sock=sock)
+        self.addConnection(conn)
+        return conn
+
+    def addConnection(self, conn):
+        if conn.kind == 'client':
+            self.clients.append(conn)
+        else:
+            self.drivers.append(conn)
+        self.selector.register(conn.rfd, selectors.EVENT_READ, ('conn', conn))
+        log.info("connected %s", conn)
+
+    def closeConnection(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        log.info("closed %s", conn)
+        self.selector.unregister(conn.rfd)
+        if conn.write_registered and conn.wfd != conn.rfd:
+            self.selector.unregister(conn.wfd)
+        if conn.kind == 'client':
+            self.clients.remove(conn)
+        else:
+            self.drivers.remove(conn)
+            for device in conn.devices:
+                if self.device_drivers.get(device) is conn:
+                    del self.device_drivers[device]
+        if conn.sock is not None:
+            conn.sock.close()
+        if conn.proc is not None:
+            conn.proc.stdin.close()
+            conn.proc.stdout.close()
+            conn.proc.terminate()
+            conn.proc.wait()
+
+    def _setWriteInterest(self, conn, on):
+        if conn.write_registered == on:
+            return
+        conn.write_registered = on
+        if conn.wfd == conn.rfd:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if on else selectors.EVENT_READ
+            self.selector.modify(conn.rfd, events, ('conn', conn))
+        elif on:
+            self.selector.register(conn.wfd, selectors.EVENT_WRITE, ('write', conn))
+        else:
+            self.selector.unregister(conn.wfd)
+
+    def loop1(self, timeout = None):
+        if timeout is None:
+            timeout = self.timeout
+
+        for key, mask in self.selector.select(timeout):
+            kind, obj = key.data
+            if kind == 'listen':
+                try:
+                    sock, addr = obj.accept()
+                except BlockingIOError:
+                    continue
+                self.attachSocket(sock, 'client', str(addr))
+            elif kind == 'extra':
+                self.handleExtraInput(obj)
+            elif kind == 'calls':
+                self.runLoopCalls()
+            elif obj.closed:
+                continue
+            else:
+                if mask & selectors.EVENT_WRITE:
+                    self.flushConnection(obj)
+                if kind == 'conn' and mask & selectors.EVENT_READ and not obj.closed:
+                    self.readConnection(obj)
+
+        for conn in self.clients + self.drivers:
+            if conn.queue.queued:
+                self.flushConnection(conn)
+
+    def readConnection(self, conn):
+        try:
+            d = conn.read()
+        except BlockingIOError:
+            return
+        except OSError:
+            d = b''
+        if not d:
+            self.closeConnection(conn)
+            return
+        for msg in conn.parser.feed(d):
+            self.route(msg, conn)
+
+    def flushConnection(self, conn):
+        try:
+            conn.queue.flush()
+        except OSError:
+            log.exception("write %s", conn)
+            self.closeConnection(conn)
+            return
+        self._setWriteInterest(conn, conn.queue.queued > 0)
+
+    def owner(self, device):
+        if device in self.my_devices:
+            return self.local
+        return self.device_drivers.get(device)
+
+    def route(self, msg, src):
+        tag = msg.tag
+        device = msg.get('device')
+        name = msg.get('name')
+        self.routed[tag] += 1
+
+        if tag == 'getProperties':
+            src.subscribe(device, name)
+            owner = self.owner(device)
+            if owner is not None:
+                targets = [owner]
+            else:
+                targets = [d for d in self.drivers if d is not src]
+                if self.my_devices and src is not self.local:
+                    targets.append(self.local)
+        elif tag == 'enableBLOB':
+            src.setBlobMode(device, name, (msg.text or '').strip())
+            return
+        elif tag.startswith('new'):
+            owner = self.owner(device)
+            if owner is None:
+                log.error("%s: unknown device '%s'", src, device)
+                return
+            targets = [owner]
+        elif src.kind == 'client':
+            log.error("%s: unexpected %s", src, tag)
+            return
+        else:
+            if tag.startswith('def') and device is not None and src is not self.local:
+                self.device_drivers[device] = src
+                src.devices.add(device)
+
+            blob = tag == 'setBLOBVector'
+            targets = []
+            for conn in self.clients + self.drivers + [self.local]:
+                if conn is src or not conn.wants(device, name):
+                    continue
+                mode = conn.blobMode(device, name)
+                if mode == 'Never' if blob else mode == 'Only':
+                    continue
+                targets.append(conn)
+
+        data = None
+        for conn in targets:
+            if conn is self.local:
+                self.processMessage(msg, src)
+                continue
+            if data is None:
+                data = etree.tostring(msg)
+            self.deliver(conn, data)
+
+    def deliver(self, conn, data):
+        if conn.closed:
+            return
+        conn.queue.put(data, flush=False)
+        if conn.queue.queued > self.max_queue:
+            log.error("%s: %d bytes queued, closing", conn, conn.queue.queued)
+            self.closeConnection(conn)
+
+    def sendLocal(self, msg):
+        for m in etree.fromstring(b'<msg>' + msg + b'</msg>'):
+            self.route(m, self.local)
+
+    # the local devices talk to the server instead of stdout/socket
+    def sendDriver(self, msg):
+        self.sendLocal(msg)
+
+    def sendClient(self, msg):
+        self.sendLocal(msg)
+
+    def close(self):
+        for conn in self.clients + self.drivers:
+            self.closeConnection(conn)
+        for key in list(self.selector.get_map().values()):
+            if key.data[0] == 'listen':
+                key.data[1].close()
+        self.selector.close()
+
+    def connectionStats(self):
+        return [{ 'kind': conn.kind, 'name': conn.name, 'devices': sorted(conn.devices), **conn.queue.stats() }
+                for conn in self.clients + self.drivers]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+State machine driven by property changes.
+
+Each transition names the properties its condition depends on; the
+condition is evaluated when one of them is defined or updated while the
+machine is in the source state, and once when the state is entered.
+Nothing is polled.
+
+    sm = StateMachine(driver, 'idle')
+    sm.transition('idle', 'cooling', deps=[('CCD', 'CCD_TEMPERATURE')],
+                  condition=lambda: driver.checkValue('CCD', 'CCD_TEMPERATURE', 'CCD_TEMPERATURE_VALUE', native=True) > 0,
+                  action=start_cooling)
+
+source None makes a rule that applies in every state, target None keeps
+the state; an action may return the target state instead.
+
+A timeout fires its transition when the machine is still in the source
+state seconds after entering it, so actions never have to sleep:
+
+    sm.timeout('roof_released', 1.0, 'roof_opening', action=open_roof)
+"""
+
+import collections
+
+import logging
+log = logging.getLogger()
+
+
+class Transition(object):
+    __slots__ = ('source', 'target', 'deps', 'condition', 'action')
+
+    def __init__(self, source, target, deps, condition, action):
+        self.source = source
+        self.target = target
+        self.deps = deps
+        self.condition = condition
+        self.action = action
+
+    def __repr__(self):
+        return '{} -> {}'.format(self.source, self.target)
+
+
+class StateMachine(object):
+
+    # longest chain of transitions fired by one change
+    MAX_CHAIN = 100
+
+    def __init__(self, loop, state):
+        self.loop = loop
+        self.state = state
+        # (source, device, name) -> transitions depending on the property
+        self.triggers = {}
+        # source -> transitions evaluated when entering it
+        self.entered = {}
+        self.watched = set()
+        self.depth = 0
+        # counts entered states, a timer fires only in the entry that set it
+        self.entries = 0
+        # source -> timeout transitions
+        self.timeouts = {}
+        self.evaluations = 0
+        self.fired = collections.Counter()
+
+    def transition(self, source, target, deps=(), condition=None, action=None):
+        t = Transition(source, target, tuple(deps), condition, action)
+        for device, name in t.deps:
+            self.triggers.setdefault((source, device, name), []).append(t)
+            if (device, name) not in self.watched:
+                self.watched.add((device, name))
+                self.loop.snoop_handlers.add(device, name, self.propertyChanged)
+                self.loop.define_handlers.add(device, name, self.propertyChanged)
+        if source is not None:
+            self.entered.setdefault(source, []).append(t)
+        return t
+
+    def timeout(self, source, seconds, target, action=None):
+        t = Transition(source, target, (), None, action)
+        self.timeouts.setdefault(source, []).append((seconds, t))
+        return t
+
+    def timedOut(self, t, entry):
+        if self.entries != entry or self.state != t.source:
+            return
+        self.fire(t)
+
+    def propertyChanged(self, msg, prop):
+        device = prop.getAttr('device')
+        name = prop.getAttr('name')
+        for source in (self.state, None):
+            for t in self.triggers.get((source, device, name), ()):
+                if self.evaluate(t):
+                    return
+
+    def evaluate(self, t):
+        """Fire t if its condition holds, return True if the state changed."""
+        self.evaluations += 1
+        try:
+            if t.condition is not None and not t.condition():
+                return False
+        except Exception:
+            log.exception('condition %s', t)
+            return False
+        return self.fire(t)
+
+    def fire(self, t):
+        self.fired[(t.source, t.target)] += 1
+        target = t.target
+        if t.action is not None:
+            r = t.action()
+            if target is None:
+                target = r
+        if target is None or target == self.state:
+            return False
+        self.enter(target)
+        return True
+
+    def enter(self, state):
+        if self.depth >= self.MAX_CHAIN:
+            raise RuntimeError('state machine does not settle, entering ' + state)
+        log.info('state %s -> %s', self.state, state)
+        self.state = state
+        self.entries += 1
+        for seconds, t in self.timeouts.get(state, ()):
+            self.loop.callLater(seconds, self.timedOut, t, self.entries)
+        self.depth += 1
+        try:
+            for t in self.entered.get(state, ()):
+                if self.evaluate(t):
+                    break
+        finally:
+            self.depth -= 1
@@ -5,12 +5,10 @@ A basic INDI driver.
 """
 
 import sys
-import time
 import os
 import requests
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
-import re
 
 import logging
 logging.basicConfig(format="%(filename)s:%(lineno)d: %(message)s", level=logging.INFO)
@@ -18,6 +16,8 @@ log = logging.getLogger()
 
 import indi_python.indi_base as indi
 from indi_python.indi_loop import IndiLoop
+from indi_python.indi_state import StateMachine
+from indi_python.indi_metrics import MetricsExporter
 
 class Handler(BaseHTTPRequestHandler):
 
@@ -38,7 +38,7 @@ class Handler(BaseHTTPRequestHandler):
 
 
 class MyDome(IndiLoop):
-    def __init__(self):
+    def __init__(self, export_metrics=True):
         super(MyDome, self).__init__(driver=True, client_addr="127.0.0.1")
         self.defineProperties("""
         <INDIDriver>
@@ -57,187 +57,243 @@ class MyDome(IndiLoop):
         self.power_switch = 'Power Switch'
         self.sensors = 'Sensors'
         self.coolcam = 'coolcam'
-        self.phase = 'closed'
+        self.sm = StateMachine(self, 'closed')
+        self.defineTransitions()
         self.connect_cnt = 0
+        if not export_metrics:
+            # /metrics exports all devices, without it only these are needed
+            for device in (self.telescope, self.power_switch, self.sensors):
+                self.subscribe(device)
+
+        self.snoop_handlers.add(self.telescope, "ACTIVE_DEVICES", self.snoopActiveDevices)
+        self.snoop_handlers.add(self.telescope, "DOME_POLICY", self.snoopDomePolicy)
+        self.snoop_handlers.add(self.telescope, "CONNECTION", self.snoopTelescopeConnection)
+        self.snoop_handlers.add(self.telescope, "TELESCOPE_PARK", self.snoopTelescopePark)
+        self.snoop_handlers.add(self.telescope, "TIME_LST", self.snoopLST)
+        self.snoop_handlers.add(self.sensors, "TELESCOPE_ABORT_MOTION", self.snoopSensorsAbort)
+        self.snoop_handlers.add(self.power_switch, "SENSORS", self.snoopPowerSensors)
+        self.new_handlers.add("MyDome", "DOME_PARK", self.newDomePark)
         self.sendClient(indi.getProperties())
 
-        self.http_server = HTTPServer(('', 9900), Handler)
-        self.http_server.indi_driver = self
-
-        self.addExtraInput(self.http_server.fileno())
+        self.http_server = None
+        self.metrics = None
+        if export_metrics:
+            self.http_server = HTTPServer(('', 9900), Handler)
+            self.http_server.indi_driver = self
+            self.metrics = MetricsExporter(self)
+            self.addExtraInput(self.http_server.fileno())
         self.timeout = 10
         self.log_messages = True
 
-    def loop(self):
-        while True:
-            self.loop1()
-            if self.phase == 'open_connect' and self.checkValue(self.power_switch, "CONNECTION", "CONNECT") == "On":
-                self.message("Connected, start opening")
-                self.sendClientMessage(self.power_switch, "BATTERY", {"ON": "On"})
-                self.sendClientMessage(self.power_switch, "MOUNT_SWITCH", {"ON": "On"})
-                if self.checkValue(self.power_switch, "ROOF_CLOSE", "ON") == "On":
-                    self.sendClientMessage(self.power_switch, "ROOF_CLOSE", {"ON": "Off"})
-                    time.sleep(1)
-                time.sleep(0.1)
-                self.sendClientMessage(self.power_switch, "ROOF_OPEN", {"ON": "On"})
-                self.phase = 'open_start_move1'
-            elif (self.phase == 'close_connect' and 
-                  self.checkValue(self.power_switch, "CONNECTION", "CONNECT") == "On" and
-                  self.checkValue(self.sensors, "CONNECTION", "CONNECT") == "On" and
-                  self.checkValue(self.telescope, "CONNECTION", "CONNECT") == "On"): 
-                self.message("Connected, wait for telescope")
-                if self.checkValue(self.power_switch, "ROOF_OPEN", "ON") == "On":
-                    self.sendClientMessage(self.power_switch, "ROOF_OPEN", {"ON": "Off"})
-                    time.sleep(1)
-                
-                try:
-                    self.checkCoords()
-                except:
-                    log.exception("checkCoords")
-                
-                self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Busy')
-                self.sendDriverMessage("MyDome", "DOME_PARK")
-                self.phase = 'close_wait_park'
-            elif self.phase == 'close_wait_park':
-                try:
-                    if self.checkValue(self.telescope, "TELESCOPE_PARK", "PARK") == "On":
-                        try:
-                            s_ha = float(self.checkValue(self.sensors, "COORD", "HA"))
-                            s_dec = float(self.checkValue(self.sensors, "COORD", "DEC"))
-                            s_pier_east = self.checkValue(self.sensors, "TELESCOPE_PIER_SIDE", "PIER_EAST")
-
-                        except:
-                            s_ha = 0
-                            s_dec = 0
-                            s_pier_east = 'unknown'
-                            log.exception("checkCoords")
-                        
-                        if s_ha > 0 and s_ha < 16 and s_dec > 50 and s_dec < 70 and s_pier_east == "On":
-                            self.message("Telescope parked, start closing")
-                            self.sendClientMessage(self.power_switch, "ROOF_CLOSE", {"ON": "On"})
-                            self.phase = 'close_start_move1'
-                        else:
-                            self.message("Telescope parked in wrong position {} {} {}".format(s_ha, s_dec, s_pier_east))
-                            self.phase = 'close_error'
-                    elif self.checkState(self.telescope, "TELESCOPE_PARK") == 'Alert':
-                        self.message("Telescope parking failed, abort")
-                        self.phase = 'close_error'
-                except KeyError:
-                    self.message("Telescope not found, start closing")
-                    self.phase = 'close_start_move1'
-
-            elif self.phase == 'open_start_move1' and self.checkValue(self.power_switch, "ROOF_OPEN", "ON") == "On":
-                self.message("Opening")
-                self.phase = 'open_start_move2'
-
-            elif self.phase == 'open_start_move2' and self.checkValue(self.power_switch, "ROOF_OPEN", "ON") == "Off":
-                self.message("Opened")
-                self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Ok')
-                self.properties["MyDome"]["DOME_PARK"].enforceRule("UNPARK", 'On')
-                self.sendDriverMessage("MyDome", "DOME_PARK")
-                open("/root/alert/enable", 'a').close()
-                self.phase = 'opened'
-
-            elif self.phase == 'close_start_move1' and self.checkValue(self.power_switch, "ROOF_CLOSE", "ON") == "On":
-                self.message("Closing")
-                self.phase = 'close_start_move2'
-
-            elif self.phase == 'close_start_move2' and self.checkValue(self.power_switch, "ROOF_CLOSE", "ON") == "Off":
-                self.message("Closed")
-                self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Ok')
-                self.properties["MyDome"]["DOME_PARK"].enforceRule("UNPARK", 'Off')
-                self.sendDriverMessage("MyDome", "DOME_PARK")
-                self.phase = 'closed'
-                try:
-                    os.remove("/root/alert/enable")
-                except:
-                    log.exception("rm enable")
+    @property
+    def phase(self):
+        return self.sm.state
+
+    @phase.setter
+    def phase(self, state):
+        self.sm.enter(state)
+
+    def defineTransitions(self):
+        P = self.power_switch
+        S = self.sensors
+        T = self.telescope
+        sm = self.sm
+
+        sm.transition('open_connect', None, [(P, "CONNECTION")],
+                      lambda: self.checkValue(P, "CONNECTION", "CONNECT") == "On",
+                      self.startOpening)
+        # the roof controller needs the delays between the switches
+        sm.timeout('open_release_close', 1.1, 'open_start_move1', self.openRoof)
+        sm.timeout('open_settle', 0.1, 'open_start_move1', self.openRoof)
+        sm.transition('open_connect', 'open_error', [(P, "CONNECTION")],
+                      lambda: self.checkState(P, "CONNECTION", 'Alert') == 'Alert',
+                      lambda: self.message("Arduino disconnected"))
+
+        sm.timeout('close_abort', 1, 'close_connect')
+        sm.transition('close_connect', None, [(P, "CONNECTION"), (S, "CONNECTION"), (T, "CONNECTION")],
+                      lambda: (self.checkValue(P, "CONNECTION", "CONNECT") == "On" and
+                               self.checkValue(S, "CONNECTION", "CONNECT") == "On" and
+                               self.checkValue(T, "CONNECTION", "CONNECT") == "On"),
+                      self.startParking)
+        sm.timeout('close_release_open', 1, None, self.syncForParking)
+        sm.timeout('close_sync', 2, None, self.waitForPark)
+        sm.transition('close_connect', 'close_error', [(P, "CONNECTION")],
+                      lambda: self.checkState(P, "CONNECTION", 'Alert') == 'Alert',
+                      lambda: self.message("Arduino disconnected"))
+
+        sm.transition('close_wait_park', None, [(T, "TELESCOPE_PARK")],
+                      lambda: self.checkValue(T, "TELESCOPE_PARK", "PARK") == "On",
+                      self.checkParkPosition)
+        sm.transition('close_wait_park', 'close_error', [(T, "TELESCOPE_PARK")],
+                      lambda: self.checkState(T, "TELESCOPE_PARK") == 'Alert',
+                      lambda: self.message("Telescope parking failed, abort"))
+
+        sm.transition('open_start_move1', 'open_start_move2', [(P, "ROOF_OPEN")],
+                      lambda: self.checkValue(P, "ROOF_OPEN", "ON") == "On",
+                      lambda: self.message("Opening"))
+        sm.transition('open_start_move2', 'opened', [(P, "ROOF_OPEN")],
+                      lambda: self.checkValue(P, "ROOF_OPEN", "ON") == "Off",
+                      self.finishOpening)
+
+        sm.transition('close_start_move1', 'close_start_move2', [(P, "ROOF_CLOSE")],
+                      lambda: self.checkValue(P, "ROOF_CLOSE", "ON") == "On",
+                      lambda: self.message("Closing"))
+        sm.transition('close_start_move2', 'closed', [(P, "ROOF_CLOSE")],
+                      lambda: self.checkValue(P, "ROOF_CLOSE", "ON") == "Off",
+                      self.finishClosing)
+
+        sm.transition('close_error', 'opened', action=lambda: self.reportDomePark('Alert', 'On'))
+        sm.transition('open_error', 'closed', action=lambda: self.reportDomePark('Alert', 'Off'))
+
+        # keep the devices connected, checked when their connection changes
+        sm.transition(None, None, [(P, "CONNECTION")], lambda: self.disconnected(P),
+                      lambda: self.sendClientMessage(P, "CONNECTION", {"CONNECT": "On"}))
+        sm.transition(None, None, [(S, "CONNECTION")], lambda: self.disconnected(S),
+                      lambda: self.sendClientMessage(S, "CONNECTION", {"CONNECT": "On"}))
+        sm.transition('opened', None, [(T, "CONNECTION")], lambda: self.disconnected(T),
+                      lambda: self.sendClientMessage(T, "CONNECTION", {"CONNECT": "On"}))
+
+    def disconnected(self, device):
+        state = self.checkState(device, "CONNECTION")
+        return state is not None and state != 'Busy' and self.checkValue(device, "CONNECTION", "CONNECT", state=['Ok', 'Idle', 'Alert']) != "On"
+
+    def startOpening(self):
+        self.message("Connected, start opening")
+        self.sendClientMessage(self.power_switch, "BATTERY", {"ON": "On"})
+        self.sendClientMessage(self.power_switch, "MOUNT_SWITCH", {"ON": "On"})
+        if self.checkValue(self.power_switch, "ROOF_CLOSE", "ON") == "On":
+            self.sendClientMessage(self.power_switch, "ROOF_CLOSE", {"ON": "Off"})
+            return 'open_release_close'
+        return 'open_settle'
+
+    def openRoof(self):
+        self.sendClientMessage(self.power_switch, "ROOF_OPEN", {"ON": "On"})
+
+    def startParking(self):
+        self.message("Connected, wait for telescope")
+        if self.checkValue(self.power_switch, "ROOF_OPEN", "ON") == "On":
+            self.sendClientMessage(self.power_switch, "ROOF_OPEN", {"ON": "Off"})
+            return 'close_release_open'
+        return self.syncForParking()
+
+    def syncForParking(self):
+        try:
+            if self.checkCoords():
+                # let the mount apply the sync
+                return 'close_sync'
+        except:
+            log.exception("checkCoords")
+        return self.waitForPark()
 
-            elif self.phase == 'open_connect' and self.checkState(self.power_switch, "CONNECTION", 'Alert') == 'Alert':
-                self.message("Arduino disconnected")
-                self.phase = 'open_error'
+    def waitForPark(self):
+        self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Busy')
+        self.sendDriverMessage("MyDome", "DOME_PARK")
+        return 'close_wait_park'
+
+    def checkParkPosition(self):
+        try:
+            s_ha = float(self.checkValue(self.sensors, "COORD", "HA"))
+            s_dec = float(self.checkValue(self.sensors, "COORD", "DEC"))
+            s_pier_east = self.checkValue(self.sensors, "TELESCOPE_PIER_SIDE", "PIER_EAST")
 
-            elif self.phase == 'close_connect' and self.checkState(self.power_switch, "CONNECTION", 'Alert') == 'Alert':
-                self.message("Arduino disconnected")
-                self.phase = 'close_error'
+        except:
+            s_ha = 0
+            s_dec = 0
+            s_pier_east = 'unknown'
+            log.exception("checkCoords")
+        
+        if s_ha > 0 and s_ha < 16 and s_dec > 50 and s_dec < 70 and s_pier_east == "On":
+            self.message("Telescope parked, start closing")
+            self.sendClientMessage(self.power_switch, "ROOF_CLOSE", {"ON": "On"})
+            return 'close_start_move1'
+        else:
+            self.message("Telescope parked in wrong position {} {} {}".format(s_ha, s_dec, s_pier_east))
+            return 'close_error'
 
-            elif self.phase == 'close_error':
-                self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Alert')
-                self.properties["MyDome"]["DOME_PARK"].enforceRule("UNPARK", 'On')
-                self.sendDriverMessage("MyDome", "DOME_PARK")
-                self.phase = 'opened'
+    def finishOpening(self):
+        self.message("Opened")
+        self.reportDomePark('Ok', 'On')
+        open("/root/alert/enable", 'a').close()
 
-            elif self.phase == 'open_error':
-                self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Alert')
-                self.properties["MyDome"]["DOME_PARK"].enforceRule("UNPARK", 'Off')
-                self.sendDriverMessage("MyDome", "DOME_PARK")
-                self.phase = 'closed'
+    def finishClosing(self):
+        self.message("Closed")
+        self.reportDomePark('Ok', 'Off')
+        try:
+            os.remove("/root/alert/enable")
+        except:
+            log.exception("rm enable")
 
+    def reportDomePark(self, state, unpark):
+        self.properties["MyDome"]["DOME_PARK"].setAttr('state', state)
+        self.properties["MyDome"]["DOME_PARK"].enforceRule("UNPARK", unpark)
+        self.sendDriverMessage("MyDome", "DOME_PARK")
+
+    def loop(self):
+        while True:
+            self.loop1()
             if  self.phase == 'opened' and os.path.exists("/root/alert/alert"):
                 self.startClose()
                 self.message("closing: alert")
 
-            if self.checkValue(self.power_switch, "CONNECTION", "CONNECT") != "On":
-                self.sendClientMessage(self.power_switch, "CONNECTION", {"CONNECT": "On"})
-            if self.checkValue(self.sensors, "CONNECTION", "CONNECT") != "On":
-                 self.sendClientMessage(self.sensors, "CONNECTION", {"CONNECT": "On"})
-            if self.phase == 'opened' and self.checkValue(self.telescope, "CONNECTION", "CONNECT") != "On":
-                 self.sendClientMessage(self.telescope, "CONNECTION", {"CONNECT": "On"})
-
-
-
 
     def handleExtraInput(self, in_s):
-        if in_s == self.http_server.fileno():
+        if self.http_server is not None and in_s == self.http_server.fileno():
             self.http_server.handle_request()
 
 
 
-    def handleSnoop(self, msg, prop):
-        if prop.getAttr("device") == self.telescope and prop.getAttr("name") == "ACTIVE_DEVICES" and prop.checkValue("ACTIVE_DOME") != "MyDome":
+    def snoopActiveDevices(self, msg, prop):
+        if prop.checkValue("ACTIVE_DOME") != "MyDome":
             self.sendClientMessage(self.telescope, "ACTIVE_DEVICES", {"ACTIVE_DOME": "MyDome"})
 
-        if prop.getAttr("device") == self.telescope and prop.getAttr("name") == "DOME_POLICY" and prop.checkValue("LOCK_AND_FORCE") != "On":
+    def snoopDomePolicy(self, msg, prop):
+        if prop.checkValue("LOCK_AND_FORCE") != "On":
             self.sendClientMessage(self.telescope, "DOME_POLICY", {"LOCK_AND_FORCE": "On"})
 
-        if prop.getAttr("device") == self.telescope and prop.getAttr("name") == "CONNECTION" and self.checkValue(self.telescope, "CONFIG_PROCESS", "CONFIG_LOAD") and prop.checkValue("CONNECT") == 'On':
+    def snoopTelescopeConnection(self, msg, prop):
+        if self.checkValue(self.telescope, "CONFIG_PROCESS", "CONFIG_LOAD") and prop.checkValue("CONNECT") == 'On':
             self.sendClientMessage(self.telescope, "CONFIG_PROCESS", {"CONFIG_LOAD": "On"})
             self.connect_cnt = 5
 
-        if prop.getAttr("device") == self.telescope and prop.getAttr("name") == "TELESCOPE_PARK" and self.checkValue(self.telescope, "TELESCOPE_PARK", "UNPARK") == 'On':
+    def snoopTelescopePark(self, msg, prop):
+        if self.checkValue(self.telescope, "TELESCOPE_PARK", "UNPARK") == 'On':
             self.connect_cnt = 5
 
-        if prop.getAttr("device") == self.telescope and prop.getAttr("name") == "TIME_LST":
-            if (self.connect_cnt > 0):
-                self.connect_cnt -= 1
-                
-                if (self.connect_cnt == 0):
-                    try:
-                        self.checkCoords()
-                    except:
-                        log.exception("checkCoords")
-
-        if prop.getAttr("device") == self.sensors and prop.getAttr("name") == "TELESCOPE_ABORT_MOTION" and prop.checkValue("ABORT") == "On":
+    def snoopLST(self, msg, prop):
+        if (self.connect_cnt > 0):
+            self.connect_cnt -= 1
+            
+            if (self.connect_cnt == 0):
+                try:
+                    self.checkCoords()
+                except:
+                    log.exception("checkCoords")
+
+    def snoopSensorsAbort(self, msg, prop):
+        if prop.checkValue("ABORT") == "On":
             try:
                 self.sendClientMessage(self.telescope, "TELESCOPE_ABORT_MOTION", {"ABORT": "On"})
             except:
                 log.exception("abort")
                 pass
 
-        if prop.getAttr("device") == self.power_switch and prop.getAttr("name") =="SENSORS" and float(self.checkValue(self.power_switch, "SENSORS", "V_SUPPLY")) < 13.0 and self.phase == 'opened':
+    def snoopPowerSensors(self, msg, prop):
+        if float(self.checkValue(self.power_switch, "SENSORS", "V_SUPPLY")) < 13.0 and self.phase == 'opened':
             self.startClose()
             self.message("closing: battery " + self.checkValue(self.power_switch, "SENSORS", "V_SUPPLY"))
 
 
     def checkCoords(self):
+        """Sync the mount to the sensor position if they differ, returns
+        True if synced."""
         log.info('checkCoords start')
-        lst = float(self.checkValue(self.telescope, "TIME_LST", "LST"))
-        t_ra = float(self.checkValue(self.telescope, "EQUATORIAL_EOD_COORD", "RA"))
-        t_dec = float(self.checkValue(self.telescope, "EQUATORIAL_EOD_COORD", "DEC"))
+        lst = self.checkValue(self.telescope, "TIME_LST", "LST", native=True)
+        t_ra = self.checkValue(self.telescope, "EQUATORIAL_EOD_COORD", "RA", native=True)
+        t_dec = self.checkValue(self.telescope, "EQUATORIAL_EOD_COORD", "DEC", native=True)
         t_pier = self.checkValue(self.telescope, "TELESCOPE_PIER_SIDE", "PIER_WEST")
 
-        s_ha = float(self.checkValue(self.sensors, "COORD", "HA")) / 180.0 * 12.0
-        s_dec = float(self.checkValue(self.sensors, "COORD", "DEC"))
+        s_ha = self.checkValue(self.sensors, "COORD", "HA", native=True) / 180.0 * 12.0
+        s_dec = self.checkValue(self.sensors, "COORD", "DEC", native=True)
         s_pier_west = self.checkValue(self.sensors, "TELESCOPE_PIER_SIDE", "PIER_WEST")
         s_pier_east = self.checkValue(self.sensors, "TELESCOPE_PIER_SIDE", "PIER_EAST")
 
@@ -256,9 +312,10 @@ class MyDome(IndiLoop):
             self.sendClientMessage(self.telescope, 'TARGETPIERSIDE', {'PIER_WEST': s_pier_west, 'PIER_EAST': s_pier_east})
             self.sendClientMessage(self.telescope, 'EQUATORIAL_EOD_COORD', {'RA': str(s_ra), 'DEC': str(s_dec)})
             self.sendClientMessage(self.telescope, 'ON_COORD_SET', {'TRACK': 'On'})
-            time.sleep(2)
+            return True
         else:
             self.sendClientMessage(self.telescope, 'TARGETPIERSIDE', {'PIER_WEST': s_pier_west, 'PIER_EAST': s_pier_east})
+            return False
 
 
     def startClose(self):
@@ -271,7 +328,6 @@ class MyDome(IndiLoop):
         self.message("http notify: " + str(response))
 
         #self.properties["MyDome"]["DOME_PARK"].setAttr('state', 'Busy')
-        self.phase = 'close_connect'
 
         if self.checkValue(self.telescope, "CONNECTION", "CONNECT") != "On":
             self.sendClientMessage(self.telescope, "CONNECTION", {"CONNECT": "On"})
@@ -279,17 +335,11 @@ class MyDome(IndiLoop):
         self.sendClientMessage(self.sensors, "CONNECTION", {"CONNECT": "On"})
 
         self.sendClientMessage(self.telescope, "TELESCOPE_ABORT_MOTION", {"ABORT": "On"})
-        time.sleep(1)
+        # close_connect after the abort had a second
+        self.phase = 'close_abort'
         #self.sendDriverMessage("MyDome", "DOME_PARK")
     
-    def handleNewValue(self, msg, prop, from_client_socket=False):
-        if from_client_socket:
-            return
-
-        device = prop.getAttr("device")
-        name = prop.getAttr("name")
-        if name != 'DOME_PARK':
-            return;
+    def newDomePark(self, msg, prop):
         prev_val = prop["UNPARK"].getValue()
         prop.newFromEtree(msg)
         new_val = prop["UNPARK"].getValue()
@@ -301,10 +351,10 @@ class MyDome(IndiLoop):
             except:
                 log.exception("rm alert")
             prop.setAttr('state', 'Busy')
-            self.phase = 'open_connect'
             self.sendClientMessage(self.power_switch, "CONNECTION", {"CONNECT": "On"})
             self.sendClientMessage(self.sensors, "CONNECTION", {"CONNECT": "On"})
             self.sendDriverMessage("MyDome", "DOME_PARK")
+            self.phase = 'open_connect'
 
         elif new_val == 'Off': 
             self.startClose()
@@ -315,40 +365,10 @@ class MyDome(IndiLoop):
 
 
     def print_state(self):
-        ret = ''
-        try:
-            for device in self.properties:
-                for prop in self.properties[device]:
-                    for element in self.properties[device][prop].getElements():
-                        #if isinstance(element, indiXML.DefBLOB):
-                        #    continue
-
-                        out_prop = "{}_{}_{}".format(device, prop, element.getAttr("name"))
-                        change_ch = r'[ -]'
-                        drop_ch = r'[^A-Za-z0-9_]'
-                        value = element.getValue()
-                        out_prop = re.sub(change_ch, '_', out_prop)
-                        out_prop = re.sub(drop_ch, '', out_prop)
-                        if value == 'On':
-                            value = 1
-                        elif value == 'Off':
-                            value = 0
-                        try:
-                            value = float(value)
-                        except:
-                            value = re.sub(change_ch, '_', value)
-                            value = re.sub(drop_ch, '', value)
-    
-                            out_prop += '{' + 'value="{}"'.format(value) + '}'
-                            value = 1
-                        ret += "{} {}\n".format(out_prop, value)
-
-        except:
-            log.exception('print_state')
-        return ret
+        return self.metrics.render()
 
 
 if __name__ == '__main__':
-    driver = MyDome()
+    driver = MyDome(export_metrics='--no-metrics' not in sys.argv)
     driver.loop()
 
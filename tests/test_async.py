@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from indi_python.indi_async import AsyncIndiLoop
+from indi_python.indi_base import INDIStreamParser
+
+
+DEFS = (b"<defNumberVector device='Dev' name='A' state='Idle' perm='rw'>"
+        b"<defNumber name='v'>1</defNumber></defNumberVector>")
+# different elements, replaces the vector object
+REDEFS = (b"<defNumberVector device='Dev' name='A' state='Ok' perm='rw'>"
+          b"<defNumber name='v'>2</defNumber><defNumber name='w'>0</defNumber></defNumberVector>")
+
+
+async def feed(loop, parser, d):
+    msgs, superseded = loop.parseInput(None, parser, d)
+    for msg in msgs:
+        await loop.processMessage(msg)
+
+
+def test_wait_ends_on_redefinition():
+    async def run():
+        loop = AsyncIndiLoop(client_addr='localhost')
+        parser = INDIStreamParser()
+        await feed(loop, parser, DEFS)
+        baseprop = loop.properties['Dev']['A']
+        wait = asyncio.ensure_future(loop.sendClientMessageWait('Dev', 'A', { 'v': 5 }, timeout=5))
+        await asyncio.sleep(0)
+        await feed(loop, parser, REDEFS)
+        await asyncio.wait_for(wait, 1)
+        assert loop.properties['Dev']['A'] is not baseprop
+        assert loop.client_pending
+
+    asyncio.run(run())
+
+
+def test_stats():
+    async def run():
+        loop = AsyncIndiLoop()
+        stats = loop.enableStats()
+        loop.snoop_handlers.add('Dev', 'A', lambda msg, prop: None)
+        parser = INDIStreamParser()
+        await feed(loop, parser, DEFS + b"<setNumberVector device='Dev' name='A'><oneNumber name='v'>3</oneNumber></setNumberVector>")
+        snap = stats.snapshot()
+        assert snap['vector_seconds']['update']['count'] == 1
+        assert snap['message_seconds']['setNumberVector']['count'] == 1
+        assert sum(h['count'] for h in snap['handler_seconds'].values()) == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('method, args', [('enableExecutor', ()), ('enableBlobPool', ()), ('enableBlobConnection', (['Cam'],))])
+def test_select_loop_features_raise(method, args):
+    loop = AsyncIndiLoop()
+    with pytest.raises(RuntimeError):
+        getattr(loop, method)(*args)
@@ -0,0 +1,39 @@
+import base64
+import zlib
+
+from lxml import etree
+
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = b"<defBLOBVector device='Cam' name='CCD1' state='Idle' perm='ro'><defBLOB name='CCD1'/></defBLOBVector>"
+
+
+def blob(data, fmt, size):
+    return (b"<setBLOBVector device='Cam' name='CCD1'><oneBLOB name='CCD1' size='%d' format='%s'>" % (size, fmt.encode()) +
+            base64.encodebytes(data) + b"</oneBLOB></setBLOBVector>")
+
+
+def test_inflated_blob_format():
+    data = bytes(range(256)) * 400
+    loop = IndiLoop()
+    pool = loop.enableBlobPool(workers=1)
+    try:
+        parser = indi.INDIStreamParser(loop.blob_sink, loop.acceptMessage)
+        loop.feedInput(None, parser, DEFS + blob(zlib.compress(data), '.fits.z', len(data)) + blob(b'raw', '.raw', 3))
+        loop.deliverBlobs(wait=True)
+        prop = loop.properties['Cam']['CCD1']
+        assert prop['CCD1'].native() == b'raw'
+        assert prop['CCD1'].getAttr('format') == '.raw'
+
+        loop.feedInput(None, parser, blob(zlib.compress(data), '.fits.z', len(data)))
+        loop.deliverBlobs(wait=True)
+        assert prop['CCD1'].native() == data
+        # re-sent as what it holds, inflated
+        assert prop['CCD1'].getAttr('format') == '.fits'
+        sent = etree.fromstring(prop.setMessage())[0]
+        assert sent.get('format') == '.fits'
+        assert base64.b64decode(sent.text) == data
+    finally:
+        loop.disableBlobPool()
@@ -0,0 +1,66 @@
+import base64
+
+from indi_python.indi_base import BlobSink, FileBlobSink, INDIStreamParser
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = b"<defBLOBVector device='Cam' name='CCD1' state='Idle' perm='ro'><defBLOB name='IMG'/></defBLOBVector>"
+
+
+def blob(data):
+    return (b"<setBLOBVector device='Cam' name='CCD1' state='Ok'><oneBLOB name='IMG' size='%d' format='.fits'>" % len(data) +
+            base64.encodebytes(data) + b"</oneBLOB></setBLOBVector>")
+
+
+def feed(loop, data, size=4096):
+    for i in range(0, len(data), size):
+        loop.feedInput(None, loop.parsers[0], data[i:i + size])
+
+
+def loop_with_sink(sink):
+    loop = IndiLoop()
+    loop.parsers.append(INDIStreamParser())
+    loop.setBlobSink(sink)
+    loop.feedInput(None, loop.parsers[0], DEFS)
+    return loop
+
+
+def test_file_blob_sink(tmp_path):
+    loop = loop_with_sink(FileBlobSink(str(tmp_path / '{device}_{name}_{element}_{n}{format}')))
+    data = bytes(range(256)) * 100
+    feed(loop, blob(data) + blob(b'second'), 1000)
+
+    e = loop.properties['Cam']['CCD1']['IMG']
+    path = tmp_path / 'Cam_CCD1_IMG_2.fits'
+    assert e.native() == str(path)
+    assert path.read_bytes() == b'second'
+    assert (tmp_path / 'Cam_CCD1_IMG_1.fits').read_bytes() == data
+    assert e.getAttr('format') == '.fits' and e.getAttr('size') == '6'
+    assert 'blob(6, ' in repr(loop.properties['Cam']['CCD1'])
+
+
+def test_discarding_sink():
+    opened = []
+
+    class Sink(BlobSink):
+        def open(self, device, name, attrs):
+            opened.append((device, name, dict(attrs)))
+            return self
+
+    loop = loop_with_sink(Sink())
+    feed(loop, blob(b'x' * 5000), 100)
+    e = loop.properties['Cam']['CCD1']['IMG']
+    assert opened == [('Cam', 'CCD1', { 'name': 'IMG', 'size': '5000', 'format': '.fits' })]
+    # the data was discarded, the size is from the message
+    assert not e.native()
+    assert repr(e).endswith(': blob(5000)')
+
+
+def test_sink_removed():
+    loop = loop_with_sink(BlobSink())
+    loop.setBlobSink(None)
+    assert loop.parsers[0].blob_sink is None
+    feed(loop, blob(b'abc'))
+    e = loop.properties['Cam']['CCD1']['IMG']
+    assert e.native() == b'abc'
+    assert repr(e).endswith(': blob(3)')
@@ -0,0 +1,44 @@
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_metrics import MetricsExporter
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Idle' perm='ro'>"
+        b"<defNumber name='ra'>0</defNumber><defNumber name='dec'>0</defNumber></defNumberVector>")
+
+
+def set_pos(**values):
+    return (b"<setNumberVector device='Mount' name='POS' state='Ok'>" +
+            b''.join(b"<oneNumber name='%s'>%g</oneNumber>" % (k.encode(), v) for k, v in values.items()) +
+            b"</setNumberVector>")
+
+
+def test_coalesced_elements_reach_handlers():
+    loop = IndiLoop()
+    loop.coalesce_sets = True
+    metrics = MetricsExporter(loop)
+    seen = []
+    loop.snoop_handlers.add('Mount', 'POS', lambda msg, prop: seen.append(sorted(c.get('name') for c in msg)))
+    parser = indi.INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    metrics.render()
+
+    # dec is changed only by the superseded message
+    loop.feedInput(None, parser, set_pos(ra=1, dec=2) + set_pos(ra=3))
+    prop = loop.properties['Mount']['POS']
+    assert prop['ra'].native() == 3 and prop['dec'].native() == 2
+    assert seen == [['dec', 'ra']]
+    assert loop.coalesced[('Mount', 'POS')] == 1
+    body = metrics.render()
+    assert 'indi_number{device="Mount",property="POS",element="dec"} 2.0' in body
+    assert 'indi_number{device="Mount",property="POS",element="ra"} 3.0' in body
+
+
+def test_newest_superseded_value_wins():
+    loop = IndiLoop()
+    loop.coalesce_sets = True
+    parser = indi.INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    loop.feedInput(None, parser, set_pos(dec=1) + set_pos(dec=5) + set_pos(ra=3))
+    prop = loop.properties['Mount']['POS']
+    assert prop['dec'].native() == 5 and prop['ra'].native() == 3
@@ -0,0 +1,57 @@
+import base64
+import threading
+import time
+import zlib
+
+from lxml import etree
+
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_compress import BlobCompressor
+
+
+DEFS = b"""<INDIDriver>
+<defBLOBVector device="Cam" name="CCD1" state="Idle" perm="ro">
+    <defBLOB name="CCD1"/>
+</defBLOBVector>
+</INDIDriver>
+"""
+
+
+def test_compressor_stream():
+    data = bytes(range(256)) * 20000
+    c = BlobCompressor(level=1, chunk=65536)
+    try:
+        assert zlib.decompress(c.compress(data)) == data
+    finally:
+        c.close()
+
+
+def test_send_blob_applied_on_loop_thread():
+    loop = IndiLoop()
+    loop.defineProperties(DEFS)
+    prop = loop.properties['Cam']['CCD1']
+    prop['CCD1'].setAttr('format', '.fits')
+    sent = []
+    loop.sendDriver = lambda msg: sent.append((threading.get_ident(), msg))
+    data = bytes(range(256)) * 10000
+
+    c = BlobCompressor(level=1, chunk=65536)
+    try:
+        future = loop.sendBlob('Cam', 'CCD1', { 'CCD1': data }, c)
+        time.sleep(0.2)
+        # the property changes only when the loop runs
+        assert prop['CCD1'].getAttr('format') == '.fits' and not sent
+        for i in range(50):
+            loop.loop1(0.1)
+            if future.done():
+                break
+        assert future.done() and future.result() > 0
+    finally:
+        c.close()
+
+    assert [t for t, msg in sent] == [threading.get_ident()]
+    msg = etree.fromstring(sent[0][1])
+    assert msg[0].get('format') == '.fits.z'
+    assert msg[0].get('size') == str(len(data))
+    assert zlib.decompress(base64.b64decode(msg[0].text)) == data
+    assert prop['CCD1'].native() == data
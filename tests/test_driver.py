@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+import time
+
+
+DRIVER = """
+import fcntl, os, sys
+from indi_python.indi_loop import IndiLoop
+driver = IndiLoop(driver=True)
+for i in range(1000):
+    driver.sendDriver(b'<x/>' * 250)
+assert driver.driver_queue.queued
+assert not fcntl.fcntl(1, fcntl.F_GETFL) & os.O_NONBLOCK
+print('done')
+sys.stdout.flush()
+"""
+
+
+def test_stdout_stays_blocking():
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    proc = subprocess.Popen([sys.executable, '-c', DRIVER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    # let the driver fill the pipe first
+    time.sleep(1)
+    out, _ = proc.communicate(timeout=20)
+    assert proc.returncode == 0
+    assert out.endswith(b'done\n')
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+NUMBERS = ("<defNumberVector device='Mount' name='EQUATORIAL_EOD_COORD' label='Eq. Coordinates' group='Main' state='Ok' perm='rw'>"
+           "<defNumber name='RA' format='%010.6m' min='0' max='24' step='0'>5.5</defNumber>"
+           "<defNumber name='DEC' format='%010.6m' min='-90' max='90' step='0'>-12:30:00</defNumber>"
+           "</defNumberVector>")
+
+SWITCHES = ("<defSwitchVector device='CCD' name='FILTER' state='Idle' perm='rw' rule='OneOfMany'>"
+            "<defSwitch name='A'>On</defSwitch><defSwitch name='B'>Off</defSwitch></defSwitchVector>")
+
+
+def vector(xml):
+    return indi.INDIVector(etree.fromstring(xml))
+
+
+def one_number(msg, name):
+    return etree.fromstring(msg).find("oneNumber[@name='{}']".format(name)).text
+
+
+def test_parsed_values():
+    v = vector(NUMBERS)
+    assert v['RA'].native() == 5.5 and v['RA'].getValue() == '5.5'
+    assert v['DEC'].native() == -12.5 and v['DEC'].getValue() == '-12:30:00'
+    assert list(v.array) == [5.5, -12.5]
+    assert v['RA'].getAttr('format') == '%010.6m' and v.getAttr('device') == 'Mount'
+
+
+def test_set_get_round_trip():
+    v = vector(NUMBERS)
+    e = v['DEC']
+    for text, native in (('10:15:00', 10.25), ('-0:30', -0.5), ('12 30 36', 12.51), ('7.25', 7.25), ('1e3', 1000.0)):
+        e.setValue(text)
+        assert e.getValue() == text
+        assert math.isclose(e.native(), native)
+        assert math.isclose(v.array[1], native)
+        assert one_number(v.setMessage(), 'DEC') == text
+
+
+def test_number_string_form():
+    v = vector(NUMBERS)
+    e = v['RA']
+    e.setValue(5)
+    assert e.getValue() == '5' and e.native() == 5.0
+    e.setValue(np.int64(7))
+    assert e.getValue() == '7'
+    e.setValue(2.25)
+    assert e.getValue() == '2.25'
+    assert one_number(v.setMessage(), 'RA') == '2.25'
+    e.setValue('bad')
+    assert math.isnan(e.native())
+
+
+def test_inplace_ufunc_keeps_vector():
+    v = vector(NUMBERS)
+    array = v.array
+    w = v
+    w += 1
+    assert w is v and v.array is array
+    assert list(v.array) == [6.5, -11.5]
+    assert v['RA'].native() == 6.5 and v['RA'].getValue() == '6.5'
+    assert one_number(v.setMessage(), 'DEC') == '-11.5'
+
+    np.multiply(v, 2, out=v)
+    assert v['DEC'].native() == -23.0
+    # not in place, a plain array
+    r = v + 1
+    assert isinstance(r, np.ndarray) and list(r) == [14.0, -22.0]
+    assert v['RA'].native() == 13.0
+
+
+def test_shared_attribute_layout():
+    a = vector(SWITCHES)
+    b = vector(SWITCHES)
+    assert a.spec is b.spec
+    assert a['A'].layout is b['A'].layout
+    a['B'].setAttr('label', 'Second')
+    assert a['B'].getAttr('label') == 'Second'
+    assert not b['B'].hasAttr('label')
+    assert a.getActiveSwitch() == 'A'
+    a.enforceRule('B', 'On')
+    assert a.getActiveSwitch() == 'B' and b.getActiveSwitch() == 'A'
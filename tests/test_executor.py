@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from indi_python.indi_executor import HandlerExecutor
+
+
+def blocker():
+    """A handler call waiting for release.set()."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def call():
+        started.set()
+        release.wait(5)
+    return call, started, release
+
+
+def test_block():
+    executor = HandlerExecutor(workers=2, max_queue=1, policy='block')
+    done = []
+    lock = threading.Lock()
+
+    def call(i):
+        with lock:
+            done.append(i)
+
+    for i in range(200):
+        executor.submit('d', 'p', lambda i=i: call(i))
+    assert executor.join(5)
+    executor.close()
+    assert done == list(range(200))
+    assert all(t.is_alive() is False for t in executor.threads)
+    assert executor.stats()['executed'] == 200
+
+
+def test_block_waits_for_worker():
+    executor = HandlerExecutor(workers=1, max_queue=1, policy='block')
+    call, started, release = blocker()
+    executor.submit('d', 'p', call)
+    started.wait(5)
+    executor.submit('d', 'p', lambda: None)
+
+    submitted = threading.Event()
+
+    def submit():
+        executor.submit('d', 'p', lambda: None)
+        submitted.set()
+    t = threading.Thread(target=submit)
+    t.start()
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(5)
+    t.join()
+    assert executor.join(5)
+    executor.close()
+    assert executor.stats()['executed'] == 3
+    assert executor.stats()['blocked'] == 1
+
+
+def test_drop_oldest():
+    executor = HandlerExecutor(workers=1, max_queue=2, policy='drop_oldest')
+    call, started, release = blocker()
+    executor.submit('d', 'p', call)
+    started.wait(5)
+    done = []
+    for i in range(5):
+        executor.submit('d', 'p', lambda i=i: done.append(i))
+    release.set()
+    assert executor.join(5)
+    executor.close()
+    assert done == [3, 4]
+    assert executor.stats()['dropped'] == 3
+
+
+def test_coalesce():
+    executor = HandlerExecutor(workers=1, max_queue=2, policy='coalesce')
+    call, started, release = blocker()
+    executor.submit('d', 'p', call)
+    started.wait(5)
+    done = []
+    executor.submit('d', 'a', lambda: done.append('a'), handler='h')
+    executor.submit('d', 'b', lambda: done.append('b1'), handler='h')
+    # replaces b1, the queued call of the same handler and property
+    executor.submit('d', 'b', lambda: done.append('b2'), handler='h')
+    release.set()
+    assert executor.join(5)
+    executor.close()
+    assert done == ['a', 'b2']
+    assert executor.stats()['coalesced'] == 1
+
+
+def test_devices_run_in_parallel():
+    executor = HandlerExecutor(workers=2, policy='block')
+    call, started, release = blocker()
+    executor.submit('d1', 'p', call)
+    started.wait(5)
+    other = threading.Event()
+    executor.submit('d2', 'p', other.set)
+    assert other.wait(5)
+    release.set()
+    executor.close()
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        HandlerExecutor(policy='lifo')
@@ -0,0 +1,79 @@
+from lxml import etree
+
+from indi_python.indi_base import INDIStreamParser
+from indi_python.indi_loop import HandlerRegistry, IndiLoop
+
+
+def msg(xml):
+    return etree.fromstring(xml)
+
+
+SET_POS = msg("<setNumberVector device='Mount' name='POS'><oneNumber name='ra'>1</oneNumber></setNumberVector>")
+
+
+def test_wildcards_in_registration_order():
+    reg = HandlerRegistry()
+    calls = []
+    for device, name in (('*', '*'), ('Mount', 'POS'), ('*', 'POS'), ('Mount', '*'), ('CCD', 'POS'), ('Mount', 'TIME')):
+        reg.add(device, name, lambda m, p, key=(device, name): calls.append(key))
+    assert reg.dispatch('Mount', 'POS', SET_POS, None) == 4
+    assert calls == [('*', '*'), ('Mount', 'POS'), ('*', 'POS'), ('Mount', '*')]
+
+    calls[:] = []
+    assert reg.dispatch('Focuser', 'TEMP', SET_POS, None) == 1
+    assert calls == [('*', '*')]
+
+
+def test_element_filter_and_remove():
+    reg = HandlerRegistry()
+    calls = []
+    ra = lambda m, p: calls.append('ra')
+    dec = lambda m, p: calls.append('dec')
+    reg.add('Mount', 'POS', ra, element='ra')
+    reg.add('Mount', 'POS', dec, element='dec')
+    reg.dispatch('Mount', 'POS', SET_POS, None)
+    assert calls == ['ra']
+
+    reg.remove('Mount', 'POS', ra)
+    assert reg.dispatch('Mount', 'POS', SET_POS, None) == 0
+
+
+def test_failing_handler_does_not_stop_others():
+    reg = HandlerRegistry()
+    calls = []
+    reg.add('*', '*', lambda m, p: 1 / 0)
+    reg.add('*', '*', lambda m, p: calls.append(p))
+    reg.dispatch('Mount', 'POS', SET_POS, 'prop')
+    assert calls == ['prop']
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Idle' perm='ro'><defNumber name='ra'>0</defNumber></defNumberVector>"
+        b"<defNumberVector device='Dome' name='AZ' state='Idle' perm='rw'><defNumber name='az'>0</defNumber></defNumberVector>")
+
+
+def test_decorators():
+    loop = IndiLoop()
+    loop.my_devices.append('Dome')
+    calls = []
+    handled = []
+    loop.handleNewValue = lambda msg, prop, from_client_socket=False: handled.append(prop.getAttr('name'))
+
+    @loop.onSnoop('Mount')
+    def pos(msg, prop):
+        calls.append(('snoop', prop['ra'].native()))
+
+    @loop.onSnoop(name='POS', element='dec')
+    def dec(msg, prop):
+        calls.append('dec')
+
+    @loop.onNew('Dome', 'AZ')
+    def az(msg, prop):
+        calls.append(('new', msg[0].text))
+
+    assert pos.__name__ == 'pos'
+    loop.feedInput(None, INDIStreamParser(), DEFS)
+    loop.feedInput(None, INDIStreamParser(), b"<setNumberVector device='Mount' name='POS'><oneNumber name='ra'>2</oneNumber></setNumberVector>")
+    # as read from the driver connection, not the client socket
+    loop.processMessage(msg("<newNumberVector device='Dome' name='AZ'><oneNumber name='az'>90</oneNumber></newNumberVector>"), in_s=object())
+    assert calls == [('snoop', 2.0), ('new', '90')]
+    assert handled == []
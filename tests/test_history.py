@@ -0,0 +1,36 @@
+from indi_python.indi_base import INDIStreamParser
+from indi_python.indi_history import HistoryStore
+from indi_python.indi_loop import IndiLoop
+
+
+def defs(device, name):
+    return (b"<defNumberVector device='%s' name='%s' state='Idle' perm='ro' timestamp='2026-01-01T00:00:00'>"
+            b"<defNumber name='V'>0</defNumber></defNumberVector>" % (device, name))
+
+
+def test_rows_use_message_timestamps():
+    loop = IndiLoop()
+    history = HistoryStore()
+    history.attach(loop)
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, defs(b'Power', b'SENSORS'))
+    loop.feedInput(None, parser, b"<setNumberVector device='Power' name='SENSORS' timestamp='2026-01-01T00:00:10.5'>"
+                                 b"<oneNumber name='V'>12</oneNumber></setNumberVector>")
+    t, v = history.get('Power', 'SENSORS').series('V')
+    assert list(t - t[0]) == [0, 10.5]
+    assert t[0] == 1767225600.0
+    assert list(v) == [0, 12]
+
+
+def test_deleted_vectors_release_their_buffers():
+    loop = IndiLoop()
+    history = HistoryStore()
+    history.attach(loop)
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, defs(b'Power', b'A') + defs(b'Power', b'B') + defs(b'Mount', b'A'))
+    assert len(history.histories) == 3
+
+    loop.feedInput(None, parser, b"<delProperty device='Power' name='A'/>")
+    assert sorted(history.histories) == [('Mount', 'A'), ('Power', 'B')]
+    loop.feedInput(None, parser, b"<delProperty device='Power'/>")
+    assert sorted(history.histories) == [('Mount', 'A')]
@@ -0,0 +1,78 @@
+from indi_python.indi_base import INDIStreamParser
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_metrics import MetricsExporter
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Ok' perm='ro'>"
+        b"<defNumber name='ra'>5.25</defNumber><defNumber name='dec'>-12:30:00</defNumber></defNumberVector>"
+        b"<defSwitchVector device='Mount' name='CONNECTION' state='Idle' perm='rw' rule='OneOfMany'>"
+        b"<defSwitch name='CONNECT'>On</defSwitch><defSwitch name='DISCONNECT'>Off</defSwitch></defSwitchVector>"
+        b"<defLightVector device='CCD \"1\"' name='STATUS' state='Alert'><defLight name='L'>Busy</defLight></defLightVector>"
+        b"<defTextVector device='Sensors' name='INFO' state='Idle' perm='ro'><defText name='T'>a \"b\" \\ c</defText></defTextVector>")
+
+EXPECTED = """# TYPE indi_number gauge
+indi_number{device="Mount",property="POS",element="ra"} 5.25
+indi_number{device="Mount",property="POS",element="dec"} -12.5
+# TYPE indi_switch gauge
+indi_switch{device="Mount",property="CONNECTION",element="CONNECT"} 1
+indi_switch{device="Mount",property="CONNECTION",element="DISCONNECT"} 0
+# TYPE indi_light gauge
+indi_light{device="CCD \\"1\\"",property="STATUS",element="L"} 2
+# TYPE indi_text_info gauge
+indi_text_info{device="Sensors",property="INFO",element="T",value="a \\"b\\" \\\\ c"} 1
+# TYPE indi_property_state gauge
+indi_property_state{device="Mount",property="POS"} 1
+indi_property_state{device="Mount",property="CONNECTION"} 0
+indi_property_state{device="CCD \\"1\\"",property="STATUS"} 3
+indi_property_state{device="Sensors",property="INFO"} 0
+"""
+
+
+def setup():
+    loop = IndiLoop()
+    metrics = MetricsExporter(loop)
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    return loop, metrics, parser
+
+
+def test_exposition_text():
+    loop, metrics, parser = setup()
+    assert metrics.render() == EXPECTED
+
+
+def test_update_renders_changed_lines():
+    loop, metrics, parser = setup()
+    body = metrics.render()
+    assert metrics.render() is body
+
+    rendered = metrics.lines_rendered
+    loop.feedInput(None, parser, b"<setNumberVector device='Mount' name='POS' state='Busy'><oneNumber name='dec'>nan</oneNumber></setNumberVector>")
+    body = metrics.render()
+    # the element and the state line
+    assert metrics.lines_rendered - rendered == 2
+    assert 'indi_number{device="Mount",property="POS",element="dec"} NaN\n' in body
+    assert 'indi_number{device="Mount",property="POS",element="ra"} 5.25\n' in body
+    assert 'indi_property_state{device="Mount",property="POS"} 2\n' in body
+
+
+def test_deleted_properties_removed():
+    loop, metrics, parser = setup()
+    metrics.render()
+    loop.feedInput(None, parser, b"<delProperty device='Mount' name='POS'/><delProperty device='Sensors'/>")
+    body = metrics.render()
+    assert 'property="POS"' not in body and 'Sensors' not in body
+    assert '# TYPE indi_number gauge' not in body
+    assert 'indi_switch{device="Mount",property="CONNECTION",element="CONNECT"} 1\n' in body
+
+
+def test_own_devices_rendered_on_scrape():
+    loop = IndiLoop()
+    loop.my_devices.append('Dome')
+    loop.defineProperties("<INDIDriver><defNumberVector device='Dome' name='AZ' state='Idle' perm='rw'>"
+                          "<defNumber name='az'>0</defNumber></defNumberVector></INDIDriver>")
+    metrics = MetricsExporter(loop)
+    assert 'element="az"} 0.0\n' in metrics.render()
+    # changed without a message
+    loop.properties['Dome']['AZ']['az'].setValue(90)
+    assert 'element="az"} 90.0\n' in metrics.render()
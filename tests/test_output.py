@@ -0,0 +1,41 @@
+import socket
+
+import pytest
+
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = b"<defNumberVector device='Dev' name='A' state='Idle' perm='rw'><defNumber name='v'>1</defNumber></defNumberVector>"
+SET = b"<setNumberVector device='Dev' name='A' state='Ok'><oneNumber name='v'>2</oneNumber></setNumberVector>"
+
+
+def received(peer):
+    peer.setblocking(False)
+    try:
+        return peer.recv(65536)
+    except BlockingIOError:
+        return b''
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_handler_output(batch):
+    sock, peer = socket.socketpair()
+    loop = IndiLoop()
+    loop.connectClient(sock)
+    loop.batch_output = batch
+    seen = []
+
+    def handler(msg, prop):
+        loop.sendClient(b'<first/>')
+        # what the peer has before the handler would sleep
+        seen.append(received(peer))
+        loop.flush()
+        seen.append(received(peer))
+        loop.sendClient(b'<second/>')
+
+    loop.snoop_handlers.add('Dev', 'A', handler)
+    peer.sendall(DEFS + SET)
+    loop.loop1(1)
+
+    assert seen == ([b'', b'<first/>'] if batch else [b'<first/>', b''])
+    assert received(peer) == b'<second/>'
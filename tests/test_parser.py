@@ -0,0 +1,88 @@
+import base64
+
+import pytest
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+BLOB = bytes(range(256)) * 20
+
+STREAM = ("<defTextVector device='Sensors' name='INFO' state='Idle' perm='ro' label='Température &amp; °C'>"
+          "<defText name='T1'>a &amp; b &lt; c €𝄞 &#233;</defText></defTextVector>\n"
+          "<setNumberVector device='Mount' name='POS' state='Ok'><oneNumber name='ra'>5.5</oneNumber></setNumberVector>"
+          "<delProperty device='Mount' name='OLD'/>"
+          "<message device='Mount' message='ünïcode'/>").encode()
+
+BLOB_MSG = (b"<setBLOBVector device='Cam' name='CCD1' state='Ok'><oneBLOB name='CCD1' size='5120' format='.raw'>\n" +
+            base64.encodebytes(BLOB) + b"</oneBLOB></setBLOBVector>")
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def feed(parser, data, size):
+    msgs = []
+    for chunk in chunks(data, size):
+        msgs.extend(parser.feed(chunk))
+    return msgs
+
+
+def summary(msgs):
+    return [(m.tag, dict(m.attrib), [(c.get('name'), c.text) for c in m]) for m in msgs]
+
+
+@pytest.mark.parametrize('size', [1, 3, 7])
+def test_split_reads(size):
+    expected = summary(indi.INDIStreamParser().feed(STREAM))
+    assert [m[0] for m in expected] == ['defTextVector', 'setNumberVector', 'delProperty', 'message']
+    assert expected[0][1]['label'] == 'Température & °C'
+    assert expected[0][2] == [('T1', 'a & b < c €𝄞 é')]
+    assert expected[3][1]['message'] == 'ünïcode'
+
+    assert summary(feed(indi.INDIStreamParser(), STREAM, size)) == expected
+
+
+@pytest.mark.parametrize('size', [1, 3, 7])
+def test_split_reads_str(size):
+    expected = summary(indi.INDIStreamParser().feed(STREAM))
+    assert summary(feed(indi.INDIStreamParser(), STREAM.decode(), size)) == expected
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 1000])
+def test_split_blob_to_sink(size):
+    received = []
+    sink = indi.CallbackBlobSink(lambda device, name, attrs, data: received.append(data) if data is not None else b''.join(received))
+    parser = indi.INDIStreamParser(sink)
+    msgs = feed(parser, STREAM + BLOB_MSG, size)
+    assert [m.tag for m in msgs] == ['defTextVector', 'setNumberVector', 'delProperty', 'message', 'setBLOBVector']
+    assert parser.blobs.pop(msgs[-1]) == { 'CCD1': BLOB }
+
+
+def accept_mount(tag, device, name):
+    return device == 'Mount'
+
+
+@pytest.mark.parametrize('size', [1, 3, 7])
+@pytest.mark.parametrize('sink', [False, True])
+def test_accept_filter(size, sink):
+    opened = []
+
+    class Sink(indi.BlobSink):
+        def open(self, device, name, attrs):
+            opened.append(device)
+            return self
+
+    parser = indi.INDIStreamParser(Sink() if sink else None, accept_mount)
+    msgs = feed(parser, STREAM + BLOB_MSG + STREAM, size)
+    assert [m.tag for m in msgs] == ['setNumberVector', 'delProperty', 'message'] * 2
+    assert all(m.get('device') == 'Mount' for m in msgs)
+    assert parser.skipped == 3
+    assert opened == []
+
+
+def test_accept_filter_str():
+    parser = indi.INDIStreamParser(accept=accept_mount)
+    msgs = feed(parser, STREAM.decode(), 5)
+    assert [m.tag for m in msgs] == ['setNumberVector', 'delProperty', 'message']
@@ -0,0 +1,122 @@
+import socket
+import time
+
+import pytest
+
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = (b"<defNumberVector device='Dev' name='A' state='Idle' perm='ro'><defNumber name='v'>1</defNumber></defNumberVector>"
+        b"<defNumberVector device='Dev' name='B' state='Idle' perm='ro'><defNumber name='v'>2</defNumber></defNumberVector>")
+
+
+def listener():
+    ls = socket.socket()
+    ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ls.bind(('localhost', 0))
+    ls.listen(5)
+    ls.settimeout(5)
+    return ls
+
+
+def run_until(client, cond, timeout=5):
+    end = time.time() + timeout
+    while not cond() and time.time() < end:
+        client.loop1(0.05)
+    return cond()
+
+
+def test_reconnect_resync_deletes_stale():
+    ls = listener()
+    client = IndiLoop(client_addr='localhost', client_port=ls.getsockname()[1])
+    client.reconnect_min = 0.05
+    client.resync_quiet = 0.2
+    deleted = []
+    client.delete_handlers.add('*', '*', lambda msg, prop: deleted.append(msg.get('name')))
+    server, _ = ls.accept()
+    server.sendall(DEFS)
+    assert run_until(client, lambda: 'B' in client.properties.get('Dev', {}))
+
+    server.close()
+    assert run_until(client, lambda: client.client_socket is None)
+    assert run_until(client, lambda: client.connecting == [] and client.client_socket is not None)
+    server, _ = ls.accept()
+    assert client.reconnects == 1
+    assert client.resync_pending == {('Dev', 'A'), ('Dev', 'B')}
+
+    # B is no longer defined by the server
+    server.sendall(DEFS[:DEFS.index(b'<defNumberVector', 1)])
+    assert run_until(client, lambda: client.resync_duration is not None)
+    assert list(client.properties['Dev']) == ['A']
+    assert deleted == ['B']
+    server.close()
+    ls.close()
+
+
+def test_reconnect_refused_backs_off():
+    ls = listener()
+    port = ls.getsockname()[1]
+    client = IndiLoop(client_addr='localhost', client_port=port)
+    client.reconnect_min = 0.05
+    server, _ = ls.accept()
+    server.close()
+    ls.close()
+    assert run_until(client, lambda: client.client_socket is None)
+    start = time.time()
+    assert run_until(client, lambda: client.reconnect_delay >= 0.2)
+    assert client.client_socket is None or client.client_socket in client.connecting
+    assert time.time() - start < 2
+
+
+def test_write_error_disconnects():
+    ls = listener()
+    client = IndiLoop(client_addr='localhost', client_port=ls.getsockname()[1])
+    disconnects = []
+    client.handleClientDisconnect = lambda: disconnects.append(True)
+    server, _ = ls.accept()
+    # unread data makes the close a reset
+    client.sendClient(b'<getProperties/>')
+    client.loop1(0.05)
+    server.close()
+    for i in range(20):
+        client.sendClient(b'x' * 100000)
+        client.loop1(0.01)
+        if disconnects:
+            break
+    assert disconnects
+    assert client.client_socket is None
+    ls.close()
+
+
+def test_blob_connection():
+    ls = listener()
+    client = IndiLoop(client_addr='localhost', client_port=ls.getsockname()[1])
+    client.reconnect_min = 0.05
+    main, _ = ls.accept()
+    client.enableBlobConnection(['Cam'])
+    # connected by the loop
+    assert client.blob_socket in client.connecting
+    blob, _ = ls.accept()
+    assert run_until(client, lambda: not client.connecting)
+    blob.settimeout(5)
+    assert blob.recv(1000) == b"<enableBLOB device='Cam'>Only</enableBLOB><getProperties version='1.7' device='Cam'/>"
+
+    main.sendall(b"<defBLOBVector device='Cam' name='C' state='Idle' perm='ro'><defBLOB name='X'/></defBLOBVector>")
+    blob.sendall(b"<setBLOBVector device='Cam' name='C'><oneBLOB name='X' size='3' format='.raw'>YWJj</oneBLOB></setBLOBVector>")
+    assert run_until(client, lambda: client.properties.get('Cam', {}).get('C') is not None
+                     and client.properties['Cam']['C']['X'].native() == b'abc')
+
+    blob.close()
+    assert run_until(client, lambda: client.blob_socket is None)
+    assert run_until(client, lambda: client.blob_socket is not None)
+    blob, _ = ls.accept()
+    assert run_until(client, lambda: not client.connecting)
+    assert client.client_socket is not None
+    main.close()
+    blob.close()
+    ls.close()
+
+
+def test_blob_connection_needs_server():
+    with pytest.raises(ValueError):
+        IndiLoop().enableBlobConnection(['Cam'])
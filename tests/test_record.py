@@ -0,0 +1,31 @@
+import base64
+
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_record import TrafficRecorder, TrafficLog, TrafficReplayer, CLIENT_IN, BLOB_IN
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Idle' perm='ro'><defNumber name='x'>0</defNumber></defNumberVector>"
+        b"<defBLOBVector device='Camera' name='CCD1' state='Idle' perm='ro'><defBLOB name='CCD1'/></defBLOBVector>")
+
+
+def test_blob_connection_replayed_separately(tmp_path):
+    payload = bytes(range(256)) * 40
+    blob = (b"<setBLOBVector device='Camera' name='CCD1'><oneBLOB name='CCD1' size='%d' format='.raw'>" % len(payload) +
+            base64.b64encode(payload) + b"</oneBLOB></setBLOBVector>")
+    number = b"<setNumberVector device='Mount' name='POS'><oneNumber name='x'>1.5</oneNumber></setNumberVector>"
+
+    path = str(tmp_path / 'traffic.rec')
+    recorder = TrafficRecorder(path)
+    recorder.record(CLIENT_IN, DEFS)
+    recorder.record(BLOB_IN, blob[:2000])
+    recorder.record(CLIENT_IN, number)
+    recorder.record(BLOB_IN, blob[2000:])
+    recorder.close()
+
+    loop = IndiLoop()
+    updates = []
+    loop.snoop_handlers.add('*', '*', lambda msg, prop: updates.append(msg.tag))
+    TrafficReplayer(TrafficLog(path), speed=None).feed(loop)
+    assert updates == ['setNumberVector', 'setBLOBVector']
+    assert loop.properties['Mount']['POS']['x'].native() == 1.5
+    assert loop.properties['Camera']['CCD1']['CCD1'].native() == payload
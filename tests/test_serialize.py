@@ -0,0 +1,68 @@
+import pytest
+from lxml import etree
+
+import indi_python.indi_base as indi
+
+
+ESCAPED = 'a &amp; b &lt; c &gt; "quoted" \'single\' é°\r'
+
+VECTORS = {
+    'Number': '<defNumberVector device="Mount &amp; co" name="EQUATORIAL_EOD_COORD" label="Eq. &lt;Coordinates&gt;" group="Main" state="Ok" perm="rw" timeout="60">'
+              '<defNumber name="RA" label="RA (hh:mm:ss)" format="%010.6m" min="0" max="24" step="0">5.123456</defNumber>'
+              '<defNumber name="DEC" label="&quot;DEC&quot;" format="%010.6m" min="-90" max="90" step="0">-12:30:00</defNumber>'
+              '</defNumberVector>',
+    'Text': '<defTextVector device="Sensors" name="INFO" label="Info" group="Info" state="Idle" perm="rw">'
+            '<defText name="T1" label="Text">' + ESCAPED + '</defText><defText name="T2" label="Empty"></defText>'
+            '</defTextVector>',
+    'Switch': '<defSwitchVector device="CCD" name="FILTER" label="Filter &amp; &lt;wheel&gt; °" group="Main" state="Idle" perm="rw" rule="OneOfMany" timeout="0">'
+              + ''.join('<defSwitch name="F{}" label="Filter {}">{}</defSwitch>'.format(i, i, 'On' if i == 0 else 'Off') for i in range(4)) +
+              '</defSwitchVector>',
+    'Light': '<defLightVector device="CCD" name="STATUS" label="Status &amp; more" group="Main" state="Alert">'
+             '<defLight name="L1" label="One">Ok</defLight><defLight name="L2" label="Two">Busy</defLight>'
+             '</defLightVector>',
+    'BLOB': '<defBLOBVector device="CCD" name="CCD1" label="Image" group="Image" state="Idle" perm="rw"><defBLOB name="CCD1" label="Image"/></defBLOBVector>',
+}
+
+NEW_VALUES = {
+    'Number': '7.5',
+    'Text': '7 & <8> "x"',
+    'Switch': 'On',
+    'BLOB': b'\0\1\2 & <',
+}
+
+MESSAGES = (None, 'msg & <"x">\n')
+
+
+def vector(itype):
+    v = indi.INDIVector(etree.fromstring(VECTORS[itype]))
+    if itype == 'BLOB':
+        v['CCD1'].setValue(b'\0' * 1000)
+        v['CCD1'].setAttr('format', '.fits')
+    return v
+
+
+@pytest.mark.parametrize('itype', sorted(VECTORS))
+@pytest.mark.parametrize('message', MESSAGES)
+def test_set_and_define_match_lxml(itype, message):
+    v = vector(itype)
+    assert v.setMessage(message) == etree.tostring(v.setMessageTree(message))
+    assert v.defineMessage(message) == etree.tostring(v.defineMessageTree(message))
+
+
+@pytest.mark.parametrize('itype', sorted(NEW_VALUES))
+@pytest.mark.parametrize('message', MESSAGES)
+def test_new_matches_lxml(itype, message):
+    v = vector(itype)
+    changes = { v.elements[-1].getAttr('name'): NEW_VALUES[itype] }
+    assert v.newMessage(changes, message) == etree.tostring(v.newMessageTree(changes, message))
+    assert v.newMessage({}, message) == etree.tostring(v.newMessageTree({}, message))
+
+
+def test_escaped_text_round_trips():
+    v = vector('Text')
+    value = 'x\r\n & <y> "z" \'w\' \x7f é'
+    v['T2'].setValue(value)
+    assert v.setMessage() == etree.tostring(v.setMessageTree())
+    msg = etree.fromstring(v.setMessage())
+    assert msg[0].text == v['T1'].getValue()
+    assert msg[1].text == value
@@ -0,0 +1,28 @@
+import socket
+
+from indi_python.indi_server import IndiServer
+
+
+def test_slow_client_closed():
+    server = IndiServer(port=None, max_queue=1024 * 1024)
+    sock, peer = socket.socketpair()
+    conn = server.attachSocket(sock, 'client', 'slow')
+    # the peer never reads
+    for i in range(100):
+        server.deliver(conn, b'x' * 100000)
+        server.loop1(0)
+    assert conn.closed
+    assert conn not in server.clients
+    server.close()
+    peer.close()
+
+
+def test_reset_client_closed():
+    server = IndiServer(port=None)
+    sock, peer = socket.socketpair()
+    conn = server.attachSocket(sock, 'client', 'gone')
+    peer.close()
+    server.deliver(conn, b'<message/>')
+    server.loop1(0)
+    assert conn.closed
+    server.close()
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from indi_python.indi_base import INDIStreamParser
+from indi_python.indi_loop import IndiLoop
+from indi_python.indi_state import StateMachine
+
+
+def run(loop, seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        loop.loop1(end - time.time())
+
+
+def test_timeout_fires_in_the_entered_state():
+    loop = IndiLoop()
+    sm = StateMachine(loop, 'idle')
+    sent = []
+    sm.timeout('released', 0.05, 'moving', lambda: sent.append(time.time()))
+    sm.enter('released')
+    t0 = time.time()
+    run(loop, 0.02)
+    assert sm.state == 'released' and not sent
+    run(loop, 0.1)
+    assert sm.state == 'moving'
+    assert sent and sent[0] - t0 >= 0.05
+
+
+def test_timeout_of_a_left_state_is_ignored():
+    loop = IndiLoop()
+    sm = StateMachine(loop, 'idle')
+    sm.timeout('released', 0.05, 'moving')
+    sm.enter('released')
+    sm.enter('idle')
+    sm.enter('released')
+    run(loop, 0.03)
+    # both timers fire after the state was left
+    sm.enter('idle')
+    run(loop, 0.1)
+    assert sm.state == 'idle'
+
+
+DEFS = b"<defNumberVector device='CCD' name='TEMP' state='Idle' perm='ro'><defNumber name='t'>20</defNumber></defNumberVector>"
+
+
+def set_temp(t):
+    return b"<setNumberVector device='CCD' name='TEMP' state='Ok'><oneNumber name='t'>%g</oneNumber></setNumberVector>" % t
+
+
+def temp_machine():
+    loop = IndiLoop()
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    sm = StateMachine(loop, 'idle')
+    temp = lambda: loop.checkValue('CCD', 'TEMP', 't', native=True)
+    return loop, parser, sm, temp
+
+
+def test_transitions_and_guards():
+    loop, parser, sm, temp = temp_machine()
+    actions = []
+    sm.transition('idle', 'cooling', [('CCD', 'TEMP')], lambda: temp() > 25, lambda: actions.append('cool'))
+    sm.transition('cooling', 'idle', [('CCD', 'TEMP')], lambda: temp() < 15)
+
+    loop.feedInput(None, parser, set_temp(22))
+    assert sm.state == 'idle' and actions == []
+    loop.feedInput(None, parser, set_temp(30))
+    assert sm.state == 'cooling' and actions == ['cool']
+    loop.feedInput(None, parser, set_temp(20))
+    assert sm.state == 'cooling'
+    loop.feedInput(None, parser, set_temp(10))
+    assert sm.state == 'idle'
+    assert sm.fired == { ('idle', 'cooling'): 1, ('cooling', 'idle'): 1 }
+
+
+def test_transition_of_other_state_not_fired():
+    loop, parser, sm, temp = temp_machine()
+    sm.transition('cooling', 'warm', [('CCD', 'TEMP')], lambda: temp() > 25)
+    loop.feedInput(None, parser, set_temp(30))
+    assert sm.state == 'idle' and not sm.fired
+    # evaluated when its source state is entered
+    sm.enter('cooling')
+    assert sm.state == 'warm'
+
+
+def test_action_chooses_target_and_any_state_rule():
+    loop, parser, sm, temp = temp_machine()
+    sm.transition('idle', None, [('CCD', 'TEMP')], lambda: temp() > 25, lambda: 'hot' if temp() > 40 else None)
+    alerts = []
+    sm.transition(None, None, [('CCD', 'TEMP')], lambda: temp() > 50, lambda: alerts.append(temp()))
+    loop.feedInput(None, parser, set_temp(30))
+    assert sm.state == 'idle'
+    loop.feedInput(None, parser, set_temp(45))
+    assert sm.state == 'hot'
+    loop.feedInput(None, parser, set_temp(60))
+    assert sm.state == 'hot' and alerts == [60]
+
+
+def test_failing_condition_and_loop_limit():
+    loop, parser, sm, temp = temp_machine()
+    sm.transition('idle', 'broken', [('CCD', 'TEMP')], lambda: 1 / 0)
+    loop.feedInput(None, parser, set_temp(30))
+    assert sm.state == 'idle'
+
+    sm.transition('a', 'b')
+    sm.transition('b', 'a')
+    with pytest.raises(RuntimeError):
+        sm.enter('a')
+    assert sm.depth == 0
@@ -0,0 +1,25 @@
+import indi_python.indi_base as indi
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Idle' perm='ro'>"
+        b"<defNumber name='ra'>0</defNumber></defNumberVector>")
+SET = b"<setNumberVector device='Mount' name='POS' state='Ok'><oneNumber name='ra'>1</oneNumber></setNumberVector>"
+
+
+def test_stats_only_time_the_owning_loop():
+    loop = IndiLoop()
+    other = IndiLoop()
+    stats = loop.enableStats()
+    loop.feedInput(None, indi.INDIStreamParser(), DEFS + SET)
+    other.feedInput(None, indi.INDIStreamParser(), DEFS + SET)
+    # serialized outside any loop
+    other.properties['Mount']['POS'].setMessage()
+
+    snap = stats.snapshot()
+    assert snap['vector_seconds']['define']['count'] == 1
+    assert snap['vector_seconds']['update']['count'] == 1
+    assert 'serialize_seconds' not in snap
+
+    loop.disableStats()
+    assert not hasattr(indi.INDIVector.setMessage, '__wrapped__')
@@ -0,0 +1,66 @@
+from indi_python.indi_base import INDIStreamParser, SubscriptionFilter
+from indi_python.indi_loop import IndiLoop
+
+
+def test_filter_patterns():
+    f = SubscriptionFilter()
+    # empty matches everything
+    assert f.match('Anything', 'ANY')
+    f.add('Mount*', 'EQUATORIAL_*')
+    f.add('CCD ?', '*')
+    f.add('[PS]ower*')
+    assert not f.match('Anything', 'ANY')
+    assert f.match('Mount EQMod', 'EQUATORIAL_EOD_COORD')
+    assert not f.match('Mount EQMod', 'TIME_LST')
+    assert f.match('CCD 1', 'CCD1') and not f.match('CCD 12', 'CCD1')
+    assert f.match('Power Switch', 'SENSORS') and not f.match('power Switch', 'SENSORS')
+    # device wide messages have no name
+    assert f.match('Mount EQMod', None)
+    assert not f.match('Focuser', None)
+
+
+def test_filter_cache_cleared_on_add():
+    f = SubscriptionFilter()
+    f.add('Mount')
+    assert not f.match('CCD', 'X')
+    f.add('CCD', 'X')
+    assert f.match('CCD', 'X')
+
+
+DEFS = (b"<defNumberVector device='Mount' name='POS' state='Idle' perm='ro'><defNumber name='ra'>0</defNumber></defNumberVector>"
+        b"<defNumberVector device='Focuser' name='POS' state='Idle' perm='ro'><defNumber name='p'>0</defNumber></defNumberVector>"
+        b"<defNumberVector device='Dome' name='AZ' state='Idle' perm='rw'><defNumber name='az'>0</defNumber></defNumberVector>")
+
+
+def test_loop_subscription():
+    loop = IndiLoop()
+    loop.my_devices.append('Dome')
+    parser = INDIStreamParser()
+    loop.parsers.append(parser)
+    loop.subscribe('Mount')
+    assert parser.accept == loop.acceptMessage
+    loop.feedInput(None, parser, DEFS + b"<message message='no device'/>")
+    assert sorted(loop.properties) == ['Dome', 'Mount']
+    assert parser.skipped == 1
+
+
+def set_pos(ra, state=b'Ok'):
+    return (b"<setNumberVector device='Mount' name='POS' state='%s'><oneNumber name='ra'>%g</oneNumber></setNumberVector>" %
+            (state, ra))
+
+
+def test_lazy_pending_elements():
+    loop = IndiLoop()
+    loop.lazy_elements = True
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    prop = loop.properties['Mount']['POS']
+    loop.feedInput(None, parser, set_pos(1) + set_pos(2, b'Busy'))
+    # attributes are applied, elements decoded on access
+    assert prop.getAttr('state') == 'Busy'
+    assert prop.pending is not None and prop.update_cnt == 2
+    assert prop['ra'].native() == 2.0
+    assert prop.pending is None
+    loop.feedInput(None, parser, set_pos(3))
+    assert list(prop.array) == [3.0]
+    assert prop.pending is None
@@ -0,0 +1,48 @@
+from lxml import etree
+
+import indi_python.indi_base as indi
+from indi_python.indi_base import resolveSwitchRule
+
+
+NAMES = ['A', 'B', 'C']
+
+
+def switches(rule, states):
+    return indi.INDIVector(etree.fromstring(
+        "<defSwitchVector device='CCD' name='MODE' state='Idle' perm='rw' rule='{}'>".format(rule) +
+        ''.join("<defSwitch name='{}'>{}</defSwitch>".format(n, 'On' if on else 'Off') for n, on in zip(NAMES, states)) +
+        "</defSwitchVector>"))
+
+
+def test_one_of_many():
+    assert resolveSwitchRule(NAMES, [True, False, False], 'OneOfMany', { 'B': 'On' }) == [False, True, False]
+    # turning the only On switch off turns on the first other one
+    assert resolveSwitchRule(NAMES, [False, True, False], 'OneOfMany', { 'B': 'Off' }) == [True, False, False]
+    # another switch is already on, it is kept
+    assert resolveSwitchRule(NAMES, [True, True, False], 'OneOfMany', { 'C': 'Off' }) == [True, False, False]
+    assert resolveSwitchRule(NAMES, [True, False, False], 'OneOfMany', { 'A': False, 'C': True }) == [False, False, True]
+
+
+def test_at_most_one_and_any_of_many():
+    assert resolveSwitchRule(NAMES, [True, False, False], 'AtMostOne', { 'C': 'On' }) == [False, False, True]
+    assert resolveSwitchRule(NAMES, [True, False, False], 'AtMostOne', { 'A': 'Off' }) == [False, False, False]
+    assert resolveSwitchRule(NAMES, [True, False, False], 'AnyOfMany', { 'C': 'On' }) == [True, False, True]
+
+
+def test_snapshot_not_modified():
+    states = [True, False, False]
+    resolveSwitchRule(NAMES, states, 'OneOfMany', { 'B': 'On' })
+    assert states == [True, False, False]
+
+    v = switches('OneOfMany', states)
+    assert v.resolveSwitches({ 'C': 'On' }) == [False, False, True]
+    assert v.getActiveSwitch() == 'A'
+    msg = etree.fromstring(v.newMessage({ 'C': 'On' }))
+    assert [(c.get('name'), c.text) for c in msg] == [('A', 'Off'), ('B', 'Off'), ('C', 'On')]
+    assert v.getActiveSwitch() == 'A'
+
+
+def test_enforce_rule():
+    v = switches('OneOfMany', [True, False, False])
+    v.enforceRule('B', 'On')
+    assert [e.getValue() for e in v.elements] == ['Off', 'On', 'Off']
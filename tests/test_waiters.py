@@ -0,0 +1,103 @@
+import threading
+import time
+
+from indi_python.indi_base import INDIStreamParser
+from indi_python.indi_loop import IndiLoop
+
+
+DEFS = b"<defNumberVector device='Dev' name='A' state='Idle' perm='ro'><defNumber name='v'>1</defNumber></defNumberVector>"
+SET = b"<setNumberVector device='Dev' name='A' state='Ok'><oneNumber name='v'>2</oneNumber></setNumberVector>"
+
+
+def test_snoop_condition_wakes_external_waiters():
+    loop = IndiLoop()
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS)
+    prop = loop.properties['Dev']['A']
+    woken = []
+
+    def wait():
+        with loop.snoop_condition:
+            ready.set()
+            t0 = time.monotonic()
+            while prop.getAttr('state') != 'Ok':
+                if not loop.snoop_condition.wait(5):
+                    break
+            woken.append(time.monotonic() - t0)
+
+    ready = threading.Event()
+    t = threading.Thread(target=wait)
+    t.start()
+    ready.wait(5)
+    loop.feedInput(None, parser, SET)
+    t.join(10)
+    assert woken and woken[0] < 1
+
+
+DEFS_AB = (b"<defNumberVector device='Dev' name='A' state='Idle' perm='rw'><defNumber name='v'>1</defNumber></defNumberVector>"
+           b"<defNumberVector device='Dev' name='B' state='Idle' perm='rw'><defNumber name='v'>1</defNumber></defNumberVector>")
+
+
+def set_msg(name, state, v):
+    return (b"<setNumberVector device='Dev' name='%s' state='%s'><oneNumber name='v'>%d</oneNumber></setNumberVector>" %
+            (name, state, v))
+
+
+def start_wait(loop, name, predicate):
+    result = []
+    t = threading.Thread(target=lambda: result.append(loop.waitFor('Dev', name, predicate, timeout=5)))
+    t.start()
+    # registered when the property has a waiter
+    while ('Dev', name) not in loop.prop_waiters.waiters:
+        time.sleep(0.001)
+    return t, result
+
+
+def test_waiter_not_woken_by_other_property():
+    loop = IndiLoop()
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS_AB)
+    checked = []
+    t, result = start_wait(loop, 'A', lambda prop: checked.append(prop.getAttr('name')) or prop['v'].native() == 2)
+
+    loop.feedInput(None, parser, set_msg(b'B', b'Ok', 2))
+    time.sleep(0.05)
+    # checked only once, by waitFor itself
+    waiter = loop.prop_waiters.waiters[('Dev', 'A')][0]
+    assert checked == ['A'] and not waiter.event.is_set()
+
+    loop.feedInput(None, parser, set_msg(b'A', b'Ok', 2))
+    t.join(5)
+    assert checked == ['A', 'A', 'A']
+    assert result[0] is loop.properties['Dev']['A']
+
+
+def test_predicate_rechecked_on_each_update():
+    loop = IndiLoop()
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS_AB + set_msg(b'A', b'Busy', 1))
+    t, result = start_wait(loop, 'A', lambda prop: prop.getAttr('state') != 'Busy')
+
+    loop.feedInput(None, parser, set_msg(b'A', b'Busy', 2))
+    t.join(0.1)
+    assert t.is_alive() and not result
+
+    loop.feedInput(None, parser, set_msg(b'A', b'Ok', 3))
+    t.join(5)
+    assert result and result[0]['v'].native() == 3
+    assert ('Dev', 'A') not in loop.prop_waiters.waiters
+
+
+def test_wait_timeout():
+    loop = IndiLoop()
+    parser = INDIStreamParser()
+    loop.feedInput(None, parser, DEFS_AB)
+    t0 = time.monotonic()
+    try:
+        loop.sendClientMessageWait('Dev', 'A', { 'v': 5 }, timeout=0.1)
+    except RuntimeError as e:
+        assert str(e) == 'Prop is still busy'
+    else:
+        assert False, 'no timeout'
+    assert 0.1 <= time.monotonic() - t0 < 2
+    assert not loop.prop_waiters.waiters